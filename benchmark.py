@@ -0,0 +1,301 @@
+"""
+端到端基准测试：生成合成录音放进临时监听目录，用真实的 VoiceMemoWatcher + 流水线
+对接本地模拟的 OSS / 豆包 / AI 服务，输出吞吐、各环节耗时分位数、数据库操作数和峰值内存（JSON）。
+
+    python benchmark.py --files 50 --asr-latency 1 --llm-latency 0.5 --output bench.json
+
+所有数据（数据库、日志、日记）都写在临时目录，不影响本机的 ~/.listen_watch。
+"""
+import os
+import sys
+import json
+import time
+import random
+import struct
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# 录音码率（bps），决定合成文件大小
+SYNTHETIC_BITRATE = 64000
+SAMPLE_RATE = 44100
+_MP4_EPOCH = datetime(1904, 1, 1)
+
+
+# ── 合成 m4a ──────────────────────────────────────────────────────
+def _atom(kind: bytes, *payload: bytes) -> bytes:
+    body = b"".join(payload)
+    return struct.pack(">I4s", 8 + len(body), kind) + body
+
+
+def _full_atom(kind: bytes, *payload: bytes, version: int = 0, flags: int = 0) -> bytes:
+    return _atom(kind, struct.pack(">I", (version << 24) | flags), *payload)
+
+
+def _descriptor(tag: int, payload: bytes) -> bytes:
+    return bytes([tag, len(payload)]) + payload
+
+
+def _esds() -> bytes:
+    # AAC-LC, 44.1kHz, 单声道
+    audio_specific = struct.pack(">H", (2 << 11) | (4 << 7) | (1 << 3))
+    decoder_config = _descriptor(
+        0x04,
+        bytes([0x40, 0x15]) + b"\x00\x00\x00"
+        + struct.pack(">II", SYNTHETIC_BITRATE, SYNTHETIC_BITRATE)
+        + _descriptor(0x05, audio_specific),
+    )
+    es = _descriptor(0x03, struct.pack(">HB", 1, 0) + decoder_config + _descriptor(0x06, b"\x02"))
+    return _full_atom(b"esds", es)
+
+
+def _moov(duration: float, title: str, created: datetime) -> bytes:
+    created_ts = int((created - _MP4_EPOCH).total_seconds())
+    timescale = SAMPLE_RATE
+    units = int(duration * timescale)
+    matrix = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+
+    mvhd = _full_atom(
+        b"mvhd",
+        struct.pack(">IIII", created_ts, created_ts, timescale, units),
+        struct.pack(">IH", 0x10000, 0x100), b"\x00" * 10, matrix, b"\x00" * 24,
+        struct.pack(">I", 2),
+    )
+    tkhd = _full_atom(
+        b"tkhd",
+        struct.pack(">IIIII", created_ts, created_ts, 1, 0, units), b"\x00" * 8,
+        struct.pack(">HHHH", 0, 0, 0x100, 0), matrix, struct.pack(">II", 0, 0),
+        flags=7,
+    )
+    mdhd = _full_atom(b"mdhd", struct.pack(">IIIIHH", created_ts, created_ts, timescale, units, 0x55C4, 0))
+    hdlr = _full_atom(b"hdlr", b"\x00" * 4, b"soun", b"\x00" * 12, b"SoundHandler\x00")
+    mp4a = _atom(
+        b"mp4a",
+        b"\x00" * 6, struct.pack(">H", 1), b"\x00" * 8,
+        struct.pack(">HHHHI", 1, 16, 0, 0, SAMPLE_RATE << 16),
+        _esds(),
+    )
+    stbl = _atom(
+        b"stbl",
+        _full_atom(b"stsd", struct.pack(">I", 1), mp4a),
+        _full_atom(b"stts", struct.pack(">I", 0)),
+        _full_atom(b"stsc", struct.pack(">I", 0)),
+        _full_atom(b"stsz", struct.pack(">II", 0, 0)),
+        _full_atom(b"stco", struct.pack(">I", 0)),
+    )
+    minf = _atom(b"minf", _full_atom(b"smhd", b"\x00" * 4), stbl)
+    trak = _atom(b"trak", tkhd, _atom(b"mdia", mdhd, hdlr, minf))
+
+    data = _atom(b"data", struct.pack(">II", 1, 0), title.encode("utf-8"))
+    ilst = _atom(b"ilst", _atom(b"\xa9nam", data))
+    meta = _full_atom(b"meta", _full_atom(b"hdlr", b"\x00" * 4, b"mdir", b"appl", b"\x00" * 9), ilst)
+    return _atom(b"moov", mvhd, trak, _atom(b"udta", meta))
+
+
+def write_synthetic_m4a(path: Path, duration: float, title: str, created: datetime) -> int:
+    """
+    写一个结构完整的 m4a：ftyp + moov（时长、©nam 标题、录制时间、mp4a 编码信息）+ mdat。
+    mdat 是与时长相称的随机字节，足以驱动上传、哈希和元数据解析。返回文件大小。
+    """
+    ftyp = _atom(b"ftyp", b"M4A ", struct.pack(">I", 0), b"M4A mp42isom\x00\x00\x00\x00")
+    mdat = _atom(b"mdat", os.urandom(int(duration * SYNTHETIC_BITRATE / 8)))
+    content = ftyp + _moov(duration, title, created) + mdat
+    path.write_bytes(content)
+    return len(content)
+
+
+def generate_memos(directory: Path, count: int, min_seconds: float, max_seconds: float,
+                   seed: int) -> list:
+    """按 Voice Memos 的命名规则（YYYYMMDD HHMMSS-xxxx.m4a）生成录音，时长在区间内对数均匀分布。"""
+    rng = random.Random(seed)
+    start = datetime.now().replace(microsecond=0) - timedelta(hours=1)
+    memos = []
+    for i in range(count):
+        duration = min_seconds * (max_seconds / min_seconds) ** rng.random()
+        created = start + timedelta(seconds=i * 7)
+        name = f"{created:%Y%m%d %H%M%S}-{rng.getrandbits(32):08X}.m4a"
+        size = write_synthetic_m4a(directory / name, duration, f"录音 {i + 1}", created)
+        memos.append({"name": name, "duration": duration, "bytes": size})
+    return memos
+
+
+# ── 运行 ──────────────────────────────────────────────────────────
+def _peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 为 KB，macOS 为字节
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+def _configure_env(root: Path, base_url: str, args: argparse.Namespace) -> None:
+    """listen_watch 各模块在导入时读取配置，必须在导入前设置。"""
+    os.environ.update({
+        "HOME": str(root / "home"),
+        "VOICE_MEMOS_DIR": str(root / "watch"),
+        "OBSIDIAN_JOURNAL_DIR": str(root / "journal"),
+        "VOLCENGINE_APP_ID": "bench",
+        "VOLCENGINE_API_KEY": "bench",
+        "VOLCENGINE_ASR_URL": f"{base_url}/api/v3/auc/bigmodel",
+        "OSS_ACCESS_KEY_ID": "bench",
+        "OSS_ACCESS_KEY_SECRET": "bench",
+        "OSS_BUCKET_NAME": "bench",
+        "OSS_ENDPOINT": base_url,
+        "OSS_IS_CNAME": "true",
+        "TRANSCRIBE_BACKEND": "doubao",
+        "AI_PROVIDER": "kimi",
+        "AI_FALLBACK_PROVIDER": "",
+        "KIMI_API_KEY": "bench",
+        "KIMI_BASE_URL": f"{base_url}/v1",
+        "TRANSCRIBE_WORKERS": str(args.workers),
+        "AI_WORKERS": str(args.workers),
+        "METRICS_FILE": "",
+        "METRICS_PORT": "0",
+    })
+    for name in ("home", "watch", "journal"):
+        (root / name).mkdir(parents=True, exist_ok=True)
+
+
+def run(args: argparse.Namespace) -> dict:
+    from listen_watch.fake_services import FakeConfig, start_server
+
+    config = FakeConfig(
+        request_delay=args.request_delay,
+        asr_latency=args.asr_latency,
+        failure_rate=args.failure_rate,
+        asr_error_rate=args.asr_error_rate,
+        llm_latency=args.llm_latency,
+        llm_max_concurrency=args.llm_max_concurrency,
+    )
+    server, base_url = start_server(config=config)
+
+    with tempfile.TemporaryDirectory(prefix="listen_watch_bench_") as tmp:
+        root = Path(tmp)
+        _configure_env(root, base_url, args)
+
+        # 配置就绪后再导入，模块级常量才会指向临时目录和模拟服务
+        import logging
+        import main
+        from listen_watch import metrics
+        from listen_watch.db import init_db, close_db, is_processed
+        from listen_watch.obsidian import _journal_path, stop_writer
+        from listen_watch.watcher import VoiceMemoWatcher
+
+        logging.getLogger().setLevel(logging.WARNING if not args.verbose else logging.INFO)
+        init_db()
+        # 预先创建日记文件，避免触发通过 Obsidian 创建日记的逻辑
+        for day in {datetime.now().date(), (datetime.now() - timedelta(hours=1)).date()}:
+            _journal_path(datetime.combine(day, datetime.min.time())).touch()
+
+        pipeline = main.build_pipeline()
+        pipeline.start()
+        watcher = VoiceMemoWatcher(str(root / "watch"), pipeline.submit)
+        watcher.start()
+
+        started = time.monotonic()
+        memos = generate_memos(root / "watch", args.files, args.min_seconds, args.max_seconds, args.seed)
+        generated = time.monotonic()
+        paths = [root / "watch" / m["name"] for m in memos]
+
+        deadline = started + args.timeout
+        while time.monotonic() < deadline:
+            done = sum(1 for p in paths if is_processed(p))
+            if done == len(paths):
+                break
+            time.sleep(0.2)
+        pipeline.join(timeout=max(0.0, deadline - time.monotonic()))
+        elapsed = time.monotonic() - started
+
+        watcher.stop()
+        pipeline.stop()
+        stop_writer()
+        succeeded = sum(1 for p in paths if is_processed(p))
+        snapshot = metrics.snapshot()
+        close_db()
+
+    server.shutdown()
+    audio_seconds = sum(m["duration"] for m in memos)
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "files": args.files,
+            "min_seconds": args.min_seconds,
+            "max_seconds": args.max_seconds,
+            "seed": args.seed,
+            "workers": args.workers,
+            "request_delay": args.request_delay,
+            "asr_latency": args.asr_latency,
+            "llm_latency": args.llm_latency,
+            "llm_max_concurrency": args.llm_max_concurrency,
+            "failure_rate": args.failure_rate,
+            "asr_error_rate": args.asr_error_rate,
+        },
+        "results": {
+            "succeeded": succeeded,
+            "failed": len(memos) - succeeded,
+            "elapsed_seconds": round(elapsed, 3),
+            "generate_seconds": round(generated - started, 3),
+            "throughput_per_minute": round(succeeded / elapsed * 60, 2) if elapsed else None,
+            "audio_minutes_per_minute": round(audio_seconds / elapsed, 2) if elapsed else None,
+            "audio_seconds": round(audio_seconds, 1),
+            "input_bytes": sum(m["bytes"] for m in memos),
+            "db_ops": snapshot["stages"].get("db", {}).get("count", 0),
+            "peak_rss_mb": round(_peak_rss_mb(), 1),
+            "fake_service_requests": dict(server.state.stats),
+        },
+        "stages": snapshot["stages"],
+        "counters": snapshot["counters"],
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="listen_watch 端到端基准测试（本地模拟服务）")
+    parser.add_argument("--files", type=int, default=20, help="合成录音数量")
+    parser.add_argument("--min-seconds", type=float, default=5, help="最短录音时长（秒）")
+    parser.add_argument("--max-seconds", type=float, default=240, help="最长录音时长（秒）")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子，固定后各次运行的输入一致")
+    parser.add_argument("--workers", type=int, default=4, help="转写 / AI 阶段并发数")
+    parser.add_argument("--request-delay", type=float, default=0.01, help="模拟服务每个请求的额外延迟（秒）")
+    parser.add_argument("--asr-latency", type=float, default=1.0, help="转写固定耗时（秒）")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="AI 首个输出前的等待（秒）")
+    parser.add_argument("--llm-max-concurrency", type=int, default=0, help="模拟 AI 服务的并发上限，超出返回 429")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="模拟服务请求返回 503 的概率")
+    parser.add_argument("--asr-error-rate", type=float, default=0.0, help="转写任务失败的概率")
+    parser.add_argument("--timeout", type=float, default=600, help="最长等待时间（秒）")
+    parser.add_argument("--output", help="结果 JSON 写入路径（默认输出到标准输出）")
+    parser.add_argument("--verbose", action="store_true", help="输出流水线日志")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    report = run(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+        r = report["results"]
+        print(
+            f"{r['succeeded']}/{args.files} 成功，用时 {r['elapsed_seconds']}s，"
+            f"{r['throughput_per_minute']} 个/分钟，峰值内存 {r['peak_rss_mb']} MB → {args.output}"
+        )
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import os
+import ssl
+import asyncio
+import logging
+import threading
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# httpx / oss2 / openai / anthropic 都在首次创建客户端时才导入，进程启动后可以立即开始监听
+# 每个 HTTP 客户端的连接池大小（同一主机的最大并发连接数）
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+# 空闲 keep-alive 连接保留时间（秒）
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "120"))
+HTTP_TIMEOUT = 30
+# AI 流式响应的读取超时（秒）：超过此时长没有收到任何数据视为连接卡死，释放工作线程
+LLM_STREAM_IDLE_TIMEOUT = float(os.getenv("LLM_STREAM_IDLE_TIMEOUT", "120"))
+# OSS SDK（requests）连接池大小
+OSS_POOL_SIZE = int(os.getenv("OSS_POOL_SIZE", "10"))
+
+_registry: dict = {}
+_lock = threading.RLock()  # 工厂函数内可能再次访问注册表（如共享 TLS 上下文）
+
+
+def _get_or_create(key, factory: Callable):
+    """按 key 返回进程内唯一的客户端实例，首次访问时创建。"""
+    client = _registry.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _registry.get(key)
+        if client is None:
+            client = factory()
+            _registry[key] = client
+            logger.debug("创建共享客户端: %s", key[0])
+        return client
+
+
+def ssl_context() -> ssl.SSLContext:
+    """共享的 TLS 上下文，避免每个客户端重复加载 CA 证书。"""
+    def factory():
+        import certifi
+        return ssl.create_default_context(cafile=certifi.where())
+    return _get_or_create(("ssl",), factory)
+
+
+def http_limits() -> "httpx.Limits":
+    import httpx
+    return httpx.Limits(
+        max_connections=HTTP_POOL_SIZE,
+        max_keepalive_connections=HTTP_POOL_SIZE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def async_http_client() -> "httpx.AsyncClient":
+    """异步 HTTP 客户端，按事件循环共享（AsyncClient 不能跨事件循环使用）。"""
+    import httpx
+    loop = asyncio.get_running_loop()
+    return _get_or_create(
+        ("async_http", id(loop)),
+        lambda: httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=http_limits(), verify=ssl_context()),
+    )
+
+
+def oss_bucket(access_key_id: str, access_key_secret: str, endpoint: str, bucket_name: str,
+               is_cname: bool = False):
+    """共享的 OSS Bucket；oss2 默认每个 Bucket 新建 Session，这里复用同一个连接池。"""
+    def factory():
+        import oss2
+        oss2.defaults.connection_pool_size = OSS_POOL_SIZE
+        auth = oss2.Auth(access_key_id, access_key_secret)
+        return oss2.Bucket(auth, endpoint, bucket_name, is_cname=is_cname, session=oss2.Session())
+    return _get_or_create(("oss", endpoint, bucket_name, access_key_id, is_cname), factory)
+
+
+def openai_client(api_key: str, base_url: str):
+    """OpenAI 兼容客户端（Kimi / DeepSeek），按 base_url 共享。"""
+    def factory():
+        import openai
+        return openai.OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=0,   # 429 交给 ratelimit 按 Retry-After 重试并调整限额，其余错误由流水线重试
+            timeout=openai.Timeout(HTTP_TIMEOUT, read=LLM_STREAM_IDLE_TIMEOUT),
+            # SDK 可能使用自带的 httpx 分支，只能传入它自己的客户端类型；连接池大小与豆包客户端相同
+            http_client=openai.DefaultHttpxClient(limits=http_limits(), verify=ssl_context()),
+        )
+    return _get_or_create(("openai", base_url, api_key), factory)
+
+
+def anthropic_client(api_key: str):
+    """Anthropic 客户端（进程内共享）。"""
+    def factory():
+        # 延迟导入，仅在使用 Claude 时才需要 anthropic 包
+        import anthropic
+        return anthropic.Anthropic(
+            api_key=api_key,
+            max_retries=0,
+            timeout=anthropic.Timeout(HTTP_TIMEOUT, read=LLM_STREAM_IDLE_TIMEOUT),
+            http_client=anthropic.DefaultHttpxClient(limits=http_limits(), verify=ssl_context()),
+        )
+    return _get_or_create(("anthropic", api_key), factory)
+
+
+def close_all() -> None:
+    """关闭所有同步客户端的连接池（进程退出前调用）。"""
+    with _lock:
+        clients = list(_registry.items())
+        _registry.clear()
+    for key, client in clients:
+        close = getattr(client, "close", None)
+        if key[0] in ("openai", "anthropic") and close:
+            try:
+                close()
+            except Exception as e:
+                logger.debug("关闭客户端失败 %s: %s", key[0], e)
@@ -1,9 +1,16 @@
+import os
 import json
+import hashlib
 import sqlite3
 import logging
+import threading
+import zlib
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, List, Optional
+
+from listen_watch import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -18,59 +25,406 @@ CREATE TABLE IF NOT EXISTS processed_files (
     file_size           INTEGER NOT NULL,
     status              TEXT    NOT NULL,       -- 'success' | 'failed'
     processed_at        TEXT    NOT NULL,
-    transcription_text  TEXT,                   -- 豆包转写结果缓存
-    ai_result_json      TEXT,                   -- ProcessedMemo 序列化（JSON）
+    transcription_text  TEXT,                   -- 旧版本字段，已迁移到 memo_payloads，保持为空
+    ai_result_json      TEXT,                   -- 同上
     memo_title          TEXT,                   -- iOS 语音备忘录显示的文件名
     duration_seconds    REAL                    -- 录音时长（秒）
 )
 """
 
+# 按音频内容哈希缓存转写和 AI 结果：同一段录音换了路径（iCloud 重命名 / 重新同步 / 重复导入）
+# 也能直接命中，不再重复上传和转写
+CREATE_CONTENT_CACHE_SQL = """
+CREATE TABLE IF NOT EXISTS content_cache (
+    audio_hash          TEXT    PRIMARY KEY,    -- 音频字节的 SHA-256
+    file_size           INTEGER NOT NULL,
+    transcription_text  BLOB,                   -- zlib 压缩（旧版本写入的未压缩文本仍可读）
+    ai_result_json      BLOB,
+    created_at          TEXT    NOT NULL,
+    last_used_at        TEXT    NOT NULL        -- LRU 淘汰依据
+)
+"""
+
+# 监听目录快照：启动时只需比对变化的文件，不必每次全量对照 processed_files
+CREATE_SNAPSHOT_SQLS = [
+    """
+    CREATE TABLE IF NOT EXISTS dir_snapshot (
+        file_path   TEXT    PRIMARY KEY,
+        file_size   INTEGER NOT NULL,
+        mtime_ns    INTEGER NOT NULL,
+        inode       INTEGER NOT NULL,
+        scan_id     INTEGER NOT NULL            -- 最近一次见到该文件的扫描编号
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS scan_state (
+        directory   TEXT    PRIMARY KEY,
+        mtime_ns    INTEGER NOT NULL,           -- 上次扫描时目录本身的修改时间（仅记录，不据此跳过扫描）
+        scan_id     INTEGER NOT NULL,
+        scanned_at  TEXT    NOT NULL
+    )
+    """,
+]
+
+# 豆包转写实测耗时，用于估算查询时间
+CREATE_ASR_LATENCY_SQL = """
+CREATE TABLE IF NOT EXISTS asr_latency (
+    id                  INTEGER PRIMARY KEY AUTOINCREMENT,
+    duration_seconds    REAL,                   -- 音频时长，未知为 NULL
+    turnaround_seconds  REAL    NOT NULL,       -- 提交到拿到结果的耗时
+    queries             INTEGER NOT NULL,       -- 查询接口调用次数
+    created_at          TEXT    NOT NULL
+)
+"""
+
+# 长录音分段转写的中间结果：某段失败重试时，已完成的段直接复用
+CREATE_SEGMENT_CACHE_SQL = """
+CREATE TABLE IF NOT EXISTS segment_cache (
+    audio_hash          TEXT    NOT NULL,
+    start_ms            INTEGER NOT NULL,
+    end_ms              INTEGER NOT NULL,
+    transcription_text  TEXT    NOT NULL,
+    created_at          TEXT    NOT NULL,
+    PRIMARY KEY (audio_hash, start_ms, end_ms)
+)
+"""
+
+# AI 调用结果缓存：键为 (规范化输入, 提示词, 服务, 模型, 温度) 的哈希
+CREATE_LLM_CACHE_SQL = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    cache_key       TEXT    PRIMARY KEY,
+    prompt_hash     TEXT    NOT NULL,           -- 提示词变更后据此清理旧条目
+    provider        TEXT    NOT NULL,
+    model           TEXT    NOT NULL,
+    result_json     TEXT    NOT NULL,
+    created_at      TEXT    NOT NULL,           -- TTL 依据
+    last_used_at    TEXT    NOT NULL            -- LRU 淘汰依据
+)
+"""
+
+# 各环节耗时记录，main.py stats 据此统计
+CREATE_METRICS_SQL = """
+CREATE TABLE IF NOT EXISTS metrics (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    recorded_at     TEXT    NOT NULL,
+    stage           TEXT    NOT NULL,           -- 如 oss_upload / asr_wait / llm / journal_write
+    detail          TEXT    NOT NULL DEFAULT '',-- 服务名、引擎名等
+    file_path       TEXT,
+    duration_ms     INTEGER NOT NULL,
+    bytes           INTEGER,
+    outcome         TEXT    NOT NULL            -- 'ok' 或异常类型名
+)
+"""
+
+# 流水线任务：未完成的任务（含等待重试的）重启后直接恢复，重试耗尽的留作死信
+CREATE_JOBS_SQL = """
+CREATE TABLE IF NOT EXISTS jobs (
+    file_path       TEXT    PRIMARY KEY,
+    state           TEXT    NOT NULL,           -- 'queued' | 'retry' | 'dead'，完成后删除
+    priority        INTEGER NOT NULL,
+    stage           TEXT,                       -- 最近一次失败的阶段
+    attempts        INTEGER NOT NULL DEFAULT 0, -- 已失败次数
+    next_attempt_at TEXT,                       -- state = 'retry' 时的下次尝试时间
+    last_error      TEXT,
+    created_at      TEXT    NOT NULL,
+    updated_at      TEXT    NOT NULL
+)
+"""
+
+# 转写文本和 AI 结果（大字段）单独存放并压缩，processed_files 只保留状态等小字段，
+# 状态查询和目录比对只需读很少的页，常驻页缓存。读写经 _compress / _decompress；
+# 迁移和整理时在 SQL 中用 lw_compress（仅本进程的连接注册，表结构不依赖它）
+CREATE_PAYLOADS_SQL = """
+CREATE TABLE IF NOT EXISTS memo_payloads (
+    file_id         INTEGER PRIMARY KEY,        -- processed_files.id
+    transcription   BLOB,                       -- zlib 压缩的转写文本
+    ai_result       BLOB                        -- zlib 压缩的 ProcessedMemo JSON
+)
+"""
+
+# 转写和 AI 结果的全文索引：rowid 即 processed_files.id。索引内容在 Python 中解压生成，
+# 由写入转写 / AI 结果 / 录音标题的函数在同一事务内同步（不用触发器：触发器若调用
+# 自定义解压函数，其他工具修改这几张表时会报 no such function）。
+# trigram 分词不依赖空格，中文按任意 3 字以上的子串检索；更短的词用 LIKE 在同一张表上匹配
+CREATE_SEARCH_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS memo_fts USING fts5(
+    title, memo_title, summary, todos, cleaned_text, transcription,
+    tokenize = 'trigram'
+)
+"""
+
+# 删除记录时一并清理索引和正文（只用内置 SQL，任何工具都能执行）
+CREATE_SEARCH_TRIGGER_SQLS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS memo_fts_file_delete AFTER DELETE ON processed_files
+    BEGIN
+        DELETE FROM memo_fts WHERE rowid = old.id;
+        DELETE FROM memo_payloads WHERE file_id = old.id;
+    END
+    """,
+]
+# 旧版本的同步触发器（读 processed_files 中的正文，或调用自定义解压函数），初始化时删除
+LEGACY_TRIGGERS = [
+    "memo_fts_insert", "memo_fts_update", "memo_fts_delete",
+    "memo_fts_payload_insert", "memo_fts_payload_update", "memo_fts_title_update",
+]
+_SEARCH_INSERT_SQL = """
+    INSERT INTO memo_fts (rowid, title, memo_title, summary, todos, cleaned_text, transcription)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+COMPRESS_LEVEL = 6   # zlib 压缩级别
+
+# bm25 各列权重（与 memo_fts 列顺序一致）：标题命中最相关
+SEARCH_WEIGHTS = (10.0, 5.0, 4.0, 2.0, 1.0, 1.0)
+SEARCH_INDEX_BATCH = 500   # 补建索引每批处理的行数，每批单独提交
+SEARCH_SNIPPET_CHARS = 40  # 摘录长度（字）
+
 # 旧版数据库迁移：补充新列（幂等）
 MIGRATE_SQLS = [
     "ALTER TABLE processed_files ADD COLUMN transcription_text TEXT",
     "ALTER TABLE processed_files ADD COLUMN ai_result_json TEXT",
     "ALTER TABLE processed_files ADD COLUMN memo_title TEXT",
     "ALTER TABLE processed_files ADD COLUMN duration_seconds REAL",
+    "ALTER TABLE processed_files ADD COLUMN audio_hash TEXT",
+    "ALTER TABLE processed_files ADD COLUMN codec TEXT",
+    "ALTER TABLE processed_files ADD COLUMN bitrate INTEGER",
+    "ALTER TABLE processed_files ADD COLUMN created_at TEXT",
+    "ALTER TABLE processed_files ADD COLUMN mtime_ns INTEGER",
+    "ALTER TABLE processed_files ADD COLUMN journal_written_at TEXT",
+]
+
+INDEX_SQLS = [
+    "CREATE INDEX IF NOT EXISTS idx_processed_files_status ON processed_files(status)",
+    "CREATE INDEX IF NOT EXISTS idx_content_cache_last_used ON content_cache(last_used_at)",
+    "CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used_at)",
+    "CREATE INDEX IF NOT EXISTS idx_metrics_recorded_at ON metrics(recorded_at)",
+    "CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state)",
+]
+
+# 长连接参数：WAL 允许读写并发，NORMAL 同步在 WAL 下仍保证崩溃一致性
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8000",   # 约 8 MB 页缓存
 ]
 
+# update_file() 允许批量写入的字段（转写和 AI 结果存 memo_payloads，不在此列）
+FILE_COLUMNS = {
+    "file_size", "status", "processed_at",
+    "memo_title", "duration_seconds", "audio_hash", "codec", "bitrate", "created_at", "mtime_ns",
+}
 
-def _connect() -> sqlite3.Connection:
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(DB_PATH))
-    conn.row_factory = sqlite3.Row
-    return conn
+SCAN_BATCH_SIZE = 500  # 目录扫描每批比对的文件数，限制内存占用
+
+# 内容缓存最多保留的条目数，超出后按最近使用时间淘汰
+CONTENT_CACHE_MAX_ENTRIES = int(os.getenv("CONTENT_CACHE_MAX_ENTRIES", "5000"))
+# AI 结果缓存的条数上限与有效期（天），0 表示不过期
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+LLM_CACHE_TTL_DAYS = float(os.getenv("LLM_CACHE_TTL_DAYS", "90"))
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+# 进程内共享一个长连接，所有访问经 _lock 串行化；流水线多个工作线程
+# 不再各自开连接争抢文件锁
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.RLock()
+_depth = 0                     # 当前线程嵌套的事务层数（仅在持有 _lock 时访问）
+_processed: Optional[set] = None  # 已成功处理的文件路径（内存副本）
+_after_commit: list = []       # 最外层事务提交成功后才执行的回调（回滚时丢弃）
+
+
+def _get_conn() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(DB_PATH), check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.create_function("lw_compress", 1, _compress, deterministic=True)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        _conn = conn
+    return _conn
+
+
+def _compress(value):
+    """文本压缩为 zlib 字节；None 与已压缩的字节原样返回。"""
+    if value is None or isinstance(value, bytes):
+        return value
+    return zlib.compress(str(value).encode("utf-8"), COMPRESS_LEVEL)
+
+
+def _decompress(value):
+    """_compress 的逆操作；旧版本写入的未压缩文本原样返回。"""
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode("utf-8")
+    return value
+
+
+@contextmanager
+def _connect() -> Iterator[sqlite3.Connection]:
+    """
+    获取共享连接并开启事务，退出时提交（异常回滚）。
+    可嵌套：内层直接复用外层事务，由最外层统一提交；
+    提交成功后再执行 _after_commit 中登记的内存状态更新。
+    """
+    global _depth
+    with _lock:
+        conn = _get_conn()
+        if _depth:
+            _depth += 1
+            try:
+                yield conn
+            finally:
+                _depth -= 1
+            return
+        _depth = 1
+        try:
+            # 只统计最外层事务（含提交），不写 metrics 表，避免记录指标时递归
+            with metrics.timed("db", persist=False), conn:
+                yield conn
+            callbacks = list(_after_commit)
+        finally:
+            _depth = 0
+            _after_commit.clear()
+        for callback in callbacks:
+            callback()
+
+
+def transaction():
+    """
+    把多次写入合并为一个事务：
+        with db.transaction():
+            db.save_transcription(...)
+            db.save_content_transcription(...)
+    """
+    return _connect()
+
+
+def close_db() -> None:
+    """关闭共享连接（进程退出前调用）。"""
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
 
 
 def init_db() -> None:
-    """初始化数据库，创建表并迁移旧版本（幂等）。"""
+    """初始化数据库，创建表并迁移旧版本（幂等），并加载已处理文件集合。"""
     with _connect() as conn:
         conn.execute(CREATE_TABLE_SQL)
+        conn.execute(CREATE_CONTENT_CACHE_SQL)
+        for sql in CREATE_SNAPSHOT_SQLS:
+            conn.execute(sql)
+        conn.execute(CREATE_ASR_LATENCY_SQL)
+        conn.execute(CREATE_SEGMENT_CACHE_SQL)
+        conn.execute(CREATE_LLM_CACHE_SQL)
+        conn.execute(CREATE_METRICS_SQL)
+        conn.execute(CREATE_JOBS_SQL)
         for sql in MIGRATE_SQLS:
             try:
                 conn.execute(sql)
             except sqlite3.OperationalError:
                 pass  # 列已存在，忽略
+        for sql in INDEX_SQLS:
+            conn.execute(sql)
+        conn.execute(CREATE_PAYLOADS_SQL)
+        conn.execute(CREATE_SEARCH_SQL)
+        for name in LEGACY_TRIGGERS:
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        _migrate_payloads(conn)
+        for sql in CREATE_SEARCH_TRIGGER_SQLS:
+            conn.execute(sql)
+    _load_processed()
     logger.debug("数据库初始化完成: %s", DB_PATH)
 
 
+def _migrate_payloads(conn: sqlite3.Connection) -> None:
+    """
+    旧版本把转写和 AI 结果存在 processed_files：压缩后移到 memo_payloads，原列置空。
+    在创建新触发器之前执行，已有的全文索引行保持不变；腾出的空间由 vacuum 命令回收。
+    """
+    moved = conn.execute(
+        """
+        INSERT INTO memo_payloads (file_id, transcription, ai_result)
+        SELECT id, lw_compress(transcription_text), lw_compress(ai_result_json)
+        FROM processed_files
+        WHERE transcription_text IS NOT NULL OR ai_result_json IS NOT NULL
+        ON CONFLICT(file_id) DO NOTHING
+        """
+    ).rowcount
+    if moved:
+        conn.execute(
+            """
+            UPDATE processed_files SET transcription_text = NULL, ai_result_json = NULL
+            WHERE transcription_text IS NOT NULL OR ai_result_json IS NOT NULL
+            """
+        )
+        logger.info("转写与 AI 结果已迁移到压缩存储: %d 条，可运行 vacuum 回收空间", moved)
+
+
+def _load_processed() -> set:
+    global _processed
+    with _connect() as conn:
+        _processed = {
+            row["file_path"]
+            for row in conn.execute(
+                "SELECT file_path FROM processed_files WHERE status = 'success'"
+            )
+        }
+    return _processed
+
+
 def is_processed(path: Path) -> bool:
-    """文件是否已成功处理过。"""
+    """文件是否已成功处理过（查内存集合，不访问磁盘）。"""
+    with _lock:
+        done = _processed if _processed is not None else _load_processed()
+        return str(path) in done
+
+
+def update_file(path: Path, **fields) -> None:
+    """
+    一条 upsert 写入多个字段，替代多次单字段写入。
+    例：update_file(path, memo_title=..., duration_seconds=..., audio_hash=...)
+    """
+    unknown = set(fields) - FILE_COLUMNS
+    if unknown:
+        raise ValueError(f"未知字段: {sorted(unknown)}")
+    size = path.stat().st_size if path.exists() else 0
+    values = {"file_size": size, "status": "pending", "processed_at": datetime.now().isoformat()}
+    values.update(fields)
+    columns = list(values)
+    updates = list(fields) or ["file_size"]
     with _connect() as conn:
-        row = conn.execute(
-            "SELECT status FROM processed_files WHERE file_path = ?",
-            (str(path),)
-        ).fetchone()
-    return row is not None and row["status"] == "success"
+        conn.execute(
+            f"""
+            INSERT INTO processed_files (file_path, {", ".join(columns)})
+            VALUES (?, {", ".join("?" for _ in columns)})
+            ON CONFLICT(file_path) DO UPDATE SET
+                {", ".join(f"{c} = excluded.{c}" for c in updates)}
+            """,
+            (str(path), *values.values())
+        )
+        if "memo_title" in fields:
+            _index_title(conn, path, fields["memo_title"])
+        if "status" in fields:
+            _track_status(path, fields["status"])
 
 
 def get_transcription(path: Path) -> Optional[str]:
     """读取缓存的转写文本，无缓存返回 None。"""
     with _connect() as conn:
         row = conn.execute(
-            "SELECT transcription_text FROM processed_files WHERE file_path = ?",
+            """
+            SELECT m.transcription FROM processed_files p
+            JOIN memo_payloads m ON m.file_id = p.id
+            WHERE p.file_path = ?
+            """,
             (str(path),)
         ).fetchone()
-    return row["transcription_text"] if row else None
+    return _decompress(row["transcription"]) if row else None
 
 
 def get_ai_result(path: Path):
@@ -78,47 +432,59 @@ def get_ai_result(path: Path):
     from listen_watch.processor import ProcessedMemo
     with _connect() as conn:
         row = conn.execute(
-            "SELECT ai_result_json FROM processed_files WHERE file_path = ?",
+            """
+            SELECT m.ai_result FROM processed_files p
+            JOIN memo_payloads m ON m.file_id = p.id
+            WHERE p.file_path = ?
+            """,
             (str(path),)
         ).fetchone()
-    if not row or not row["ai_result_json"]:
+    if not row or not row["ai_result"]:
         return None
-    data = json.loads(row["ai_result_json"])
+    data = json.loads(_decompress(row["ai_result"]))
     return ProcessedMemo(**data)
 
 
-def save_file_info(path: Path, memo_title: Optional[str], duration_seconds: Optional[float]) -> None:
-    """保存录音的文件名和时长（upsert）。"""
-    size = path.stat().st_size if path.exists() else 0
-    now = datetime.now().isoformat()
+def get_file_metadata(path: Path, size: int, mtime_ns: int) -> Optional[sqlite3.Row]:
+    """读取已记录的录音元数据；文件大小或修改时间与记录不符时视为无记录。"""
     with _connect() as conn:
-        conn.execute(
+        return conn.execute(
             """
-            INSERT INTO processed_files (file_path, file_size, status, processed_at, memo_title, duration_seconds)
-            VALUES (?, ?, 'pending', ?, ?, ?)
-            ON CONFLICT(file_path) DO UPDATE SET
-                memo_title       = excluded.memo_title,
-                duration_seconds = excluded.duration_seconds
+            SELECT memo_title, duration_seconds, codec, bitrate, created_at
+            FROM processed_files WHERE file_path = ? AND file_size = ? AND mtime_ns = ?
             """,
-            (str(path), size, now, memo_title, duration_seconds)
-        )
+            (str(path), size, mtime_ns)
+        ).fetchone()
+
+
+def save_file_metadata(path: Path, meta, size: int, mtime_ns: int) -> None:
+    """保存录音元数据（AudioMetadata）及其对应的文件大小和修改时间（upsert）。"""
+    update_file(
+        path,
+        file_size=size,
+        mtime_ns=mtime_ns,
+        memo_title=meta.title,
+        duration_seconds=meta.duration,
+        codec=meta.codec,
+        bitrate=meta.bitrate,
+        created_at=meta.created_at,
+    )
     logger.debug("文件信息已记录: %s", path.name)
 
 
 def save_transcription(path: Path, text: str) -> None:
-    """缓存转写结果（upsert）。"""
-    size = path.stat().st_size if path.exists() else 0
-    now = datetime.now().isoformat()
+    """缓存转写结果（upsert），压缩存入 memo_payloads。"""
     with _connect() as conn:
+        update_file(path)
         conn.execute(
             """
-            INSERT INTO processed_files (file_path, file_size, status, processed_at, transcription_text)
-            VALUES (?, ?, 'pending', ?, ?)
-            ON CONFLICT(file_path) DO UPDATE SET
-                transcription_text = excluded.transcription_text
+            INSERT INTO memo_payloads (file_id, transcription)
+            SELECT id, ? FROM processed_files WHERE file_path = ?
+            ON CONFLICT(file_id) DO UPDATE SET transcription = excluded.transcription
             """,
-            (str(path), size, now, text)
+            (_compress(text), str(path))
         )
+        _index_memo(conn, path)
     logger.debug("转写结果已缓存: %s", path.name)
 
 
@@ -128,14 +494,563 @@ def save_ai_result(path: Path, memo) -> None:
     with _connect() as conn:
         conn.execute(
             """
-            UPDATE processed_files SET ai_result_json = ?
-            WHERE file_path = ?
+            INSERT INTO memo_payloads (file_id, ai_result)
+            SELECT id, ? FROM processed_files WHERE file_path = ?
+            ON CONFLICT(file_id) DO UPDATE SET ai_result = excluded.ai_result
             """,
-            (json.dumps(asdict(memo), ensure_ascii=False), str(path))
+            (_compress(json.dumps(asdict(memo), ensure_ascii=False)), str(path))
         )
+        _index_memo(conn, path)
     logger.debug("AI 结果已缓存: %s", path.name)
 
 
+# ── 内容哈希缓存 ──────────────────────────────────────────────────
+def compute_audio_hash(path: Path) -> str:
+    """流式计算音频文件的 SHA-256，内存占用与文件大小无关。"""
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def save_audio_hash(path: Path, audio_hash: str) -> None:
+    """记录文件对应的内容哈希。"""
+    update_file(path, audio_hash=audio_hash)
+
+
+def get_content_transcription(audio_hash: str) -> Optional[str]:
+    """按内容哈希读取转写缓存，命中时刷新最近使用时间。"""
+    row = _touch_content(audio_hash, "transcription_text")
+    return _decompress(row["transcription_text"]) if row else None
+
+
+def get_content_ai_result(audio_hash: str):
+    """按内容哈希读取 AI 结果缓存（ProcessedMemo），无缓存返回 None。"""
+    from listen_watch.processor import ProcessedMemo
+    row = _touch_content(audio_hash, "ai_result_json")
+    if not row:
+        return None
+    return ProcessedMemo(**json.loads(_decompress(row["ai_result_json"])))
+
+
+def save_content_transcription(audio_hash: str, file_size: int, text: str) -> None:
+    """按内容哈希缓存转写结果（upsert），必要时淘汰最久未用的条目。"""
+    now = datetime.now().isoformat()
+    with _connect() as conn:
+        conn.execute(
+            """
+            INSERT INTO content_cache (audio_hash, file_size, transcription_text, created_at, last_used_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(audio_hash) DO UPDATE SET
+                transcription_text = excluded.transcription_text,
+                last_used_at       = excluded.last_used_at
+            """,
+            (audio_hash, file_size, _compress(text), now, now)
+        )
+        _evict_content_cache(conn)
+
+
+def save_content_ai_result(audio_hash: str, file_size: int, memo) -> None:
+    """按内容哈希缓存 AI 结果（upsert；转写缓存已被淘汰或未写入时同样保存），必要时淘汰最久未用的条目。"""
+    from dataclasses import asdict
+    now = datetime.now().isoformat()
+    with _connect() as conn:
+        conn.execute(
+            """
+            INSERT INTO content_cache (audio_hash, file_size, ai_result_json, created_at, last_used_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(audio_hash) DO UPDATE SET
+                ai_result_json = excluded.ai_result_json,
+                last_used_at   = excluded.last_used_at
+            """,
+            (audio_hash, file_size, _compress(json.dumps(asdict(memo), ensure_ascii=False)), now, now)
+        )
+        _evict_content_cache(conn)
+
+
+def _touch_content(audio_hash: str, column: str) -> Optional[sqlite3.Row]:
+    with _connect() as conn:
+        row = conn.execute(
+            f"SELECT {column} FROM content_cache WHERE audio_hash = ? AND {column} IS NOT NULL",
+            (audio_hash,)
+        ).fetchone()
+        if row:
+            conn.execute(
+                "UPDATE content_cache SET last_used_at = ? WHERE audio_hash = ?",
+                (datetime.now().isoformat(), audio_hash)
+            )
+    return row
+
+
+def _evict_content_cache(conn: sqlite3.Connection) -> None:
+    cur = conn.execute(
+        """
+        DELETE FROM content_cache WHERE audio_hash IN (
+            SELECT audio_hash FROM content_cache
+            ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+        )
+        """,
+        (CONTENT_CACHE_MAX_ENTRIES,)
+    )
+    if cur.rowcount:
+        logger.debug("内容缓存淘汰 %d 条", cur.rowcount)
+
+
+# ── AI 结果缓存 ──────────────────────────────────────────────────
+def get_llm_cache(cache_key: str) -> Optional[str]:
+    """读取 AI 结果缓存（JSON 文本），过期或不存在返回 None；命中时刷新最近使用时间。"""
+    now = datetime.now()
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT result_json, created_at FROM llm_cache WHERE cache_key = ?", (cache_key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if LLM_CACHE_TTL_DAYS > 0 and \
+                (now - datetime.fromisoformat(row["created_at"])).total_seconds() > LLM_CACHE_TTL_DAYS * 86400:
+            conn.execute("DELETE FROM llm_cache WHERE cache_key = ?", (cache_key,))
+            return None
+        conn.execute(
+            "UPDATE llm_cache SET last_used_at = ? WHERE cache_key = ?", (now.isoformat(), cache_key)
+        )
+    return row["result_json"]
+
+
+def save_llm_cache(cache_key: str, prompt_hash: str, provider: str, model: str, result_json: str) -> None:
+    now = datetime.now().isoformat()
+    with _connect() as conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO llm_cache
+                (cache_key, prompt_hash, provider, model, result_json, created_at, last_used_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (cache_key, prompt_hash, provider, model, result_json, now, now)
+        )
+        cur = conn.execute(
+            """
+            DELETE FROM llm_cache WHERE cache_key IN (
+                SELECT cache_key FROM llm_cache
+                ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (LLM_CACHE_MAX_ENTRIES,)
+        )
+        if cur.rowcount:
+            logger.debug("AI 结果缓存淘汰 %d 条", cur.rowcount)
+
+
+def purge_llm_cache(valid_prompt_hashes: List[str]) -> int:
+    """删除提示词已变更（不在 valid_prompt_hashes 中）或已过期的缓存条目，返回删除数。"""
+    placeholders = ",".join("?" * len(valid_prompt_hashes))
+    params: list = list(valid_prompt_hashes)
+    sql = f"DELETE FROM llm_cache WHERE prompt_hash NOT IN ({placeholders})"
+    if LLM_CACHE_TTL_DAYS > 0:
+        cutoff = datetime.fromtimestamp(datetime.now().timestamp() - LLM_CACHE_TTL_DAYS * 86400)
+        sql += " OR created_at < ?"
+        params.append(cutoff.isoformat())
+    with _connect() as conn:
+        return conn.execute(sql, params).rowcount
+
+
+# ── 指标 ──────────────────────────────────────────────────────────
+def save_metrics(rows: list) -> None:
+    """批量写入耗时记录，rows 为 (recorded_at, stage, detail, file_path, duration_ms, bytes, outcome)。"""
+    with _connect() as conn:
+        conn.executemany(
+            """
+            INSERT INTO metrics (recorded_at, stage, detail, file_path, duration_ms, bytes, outcome)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows
+        )
+
+
+def prune_metrics(before: str) -> int:
+    with _connect() as conn:
+        return conn.execute("DELETE FROM metrics WHERE recorded_at < ?", (before,)).rowcount
+
+
+def get_metrics(since: str) -> List[sqlite3.Row]:
+    """since 之后的耗时记录。"""
+    with _connect() as conn:
+        return conn.execute(
+            """
+            SELECT stage, detail, duration_ms, bytes, outcome FROM metrics
+            WHERE recorded_at >= ? ORDER BY stage, detail
+            """,
+            (since,)
+        ).fetchall()
+
+
+# ── 全文检索 ──────────────────────────────────────────────────────
+def build_search_index(batch_size: int = SEARCH_INDEX_BATCH) -> int:
+    """
+    为尚未建立索引的已有记录补建全文索引（建表前写入或由其他工具写入的数据），
+    分批提交，不长时间占用连接。重复调用只处理遗漏的行。返回补建的行数。
+    """
+    total = 0
+    last_id = 0
+    while True:
+        with _connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT p.id, p.memo_title, m.transcription, m.ai_result
+                FROM memo_payloads m JOIN processed_files p ON p.id = m.file_id
+                WHERE m.file_id > ?
+                  AND NOT EXISTS (SELECT 1 FROM memo_fts f WHERE f.rowid = m.file_id)
+                ORDER BY m.file_id
+                LIMIT ?
+                """,
+                (last_id, batch_size)
+            ).fetchall()
+            conn.executemany(_SEARCH_INSERT_SQL, [_search_row(*row) for row in rows])
+        total += len(rows)
+        if len(rows) < batch_size:
+            break
+        last_id = rows[-1]["id"]
+    if total:
+        logger.info("全文索引补建完成: %d 条", total)
+    return total
+
+
+def _search_row(file_id: int, memo_title: Optional[str], transcription, ai_result) -> tuple:
+    """全文索引的一行：解压正文，从 AI 结果中取标题、摘要、待办和整理后正文；JSON 无效时只索引转写文本。"""
+    try:
+        ai = json.loads(_decompress(ai_result) or "{}")
+    except ValueError:
+        ai = {}
+    if not isinstance(ai, dict):
+        ai = {}
+    todos = ai.get("todos")
+    return (
+        file_id, ai.get("title"), memo_title, ai.get("summary"),
+        "\n".join(map(str, todos)) if isinstance(todos, list) and todos else None,
+        ai.get("cleaned_text"), _decompress(transcription),
+    )
+
+
+def _index_memo(conn: sqlite3.Connection, path: Path) -> None:
+    """在调用方的事务内重建单条记录的全文索引（无正文时不建索引）。"""
+    row = conn.execute(
+        """
+        SELECT p.id, p.memo_title, m.transcription, m.ai_result
+        FROM processed_files p JOIN memo_payloads m ON m.file_id = p.id
+        WHERE p.file_path = ?
+        """,
+        (str(path),)
+    ).fetchone()
+    if row is None:
+        return
+    conn.execute("DELETE FROM memo_fts WHERE rowid = ?", (row["id"],))
+    conn.execute(_SEARCH_INSERT_SQL, _search_row(*row))
+
+
+def _index_title(conn: sqlite3.Connection, path: Path, title: Optional[str]) -> None:
+    """录音标题变化时更新已建索引的记录。"""
+    row = conn.execute(
+        """
+        SELECT memo_fts.memo_title FROM processed_files p
+        JOIN memo_fts ON memo_fts.rowid = p.id
+        WHERE p.file_path = ?
+        """,
+        (str(path),)
+    ).fetchone()
+    if row is not None and row["memo_title"] != title:
+        _index_memo(conn, path)
+
+
+def _fts_phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like_pattern(term: str) -> str:
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _excerpt(text: str, terms: List[str], width: int = SEARCH_SNIPPET_CHARS) -> str:
+    """截取第一个命中词附近的文字，命中词用【】标出。"""
+    text = " ".join(text.split())
+    hits = [(text.find(t), t) for t in terms if t and text.find(t) >= 0]
+    if not hits:
+        return text[:width] + ("…" if len(text) > width else "")
+    pos, term = min(hits)
+    start = max(0, pos - width // 2)
+    end = min(len(text), start + width)
+    excerpt = text[start:end]
+    for t in terms:
+        excerpt = excerpt.replace(t, f"【{t}】")
+    return ("…" if start else "") + excerpt + ("…" if end < len(text) else "")
+
+
+def search_memos(query: str, limit: int = 20) -> List[dict]:
+    """
+    全文检索转写文本与 AI 结果（标题、摘要、待办、整理后正文）。
+    空格分隔的多个词须全部命中；3 字及以上的词走 FTS5 索引按 bm25 排序，
+    全是短词时按 LIKE 匹配、按时间倒序。返回 [{file_path, date, title, snippet}]。
+    """
+    terms = [t for t in query.split() if t]
+    if not terms:
+        return []
+    long_terms = [t for t in terms if len(t) >= 3]
+    short_terms = [t for t in terms if len(t) < 3]
+    columns = ("title", "memo_title", "summary", "todos", "cleaned_text", "transcription")
+
+    where, params = [], []
+    if long_terms:
+        where.append("memo_fts MATCH ?")
+        params.append(" AND ".join(_fts_phrase(t) for t in long_terms))
+    for term in short_terms:
+        where.append("(" + " OR ".join(f"memo_fts.{c} LIKE ? ESCAPE '\\'" for c in columns) + ")")
+        params.extend([_like_pattern(term)] * len(columns))
+
+    if long_terms:
+        weights = ", ".join(str(w) for w in SEARCH_WEIGHTS)
+        rank = f"bm25(memo_fts, {weights})"
+        snippet = f"snippet(memo_fts, -1, '【', '】', '…', {SEARCH_SNIPPET_CHARS // 3})"
+    else:
+        rank = "COALESCE(p.created_at, p.processed_at) DESC"
+        snippet = "NULL"
+    sql = f"""
+        SELECT p.file_path, COALESCE(p.created_at, p.processed_at) AS date,
+               COALESCE(memo_fts.title, memo_fts.memo_title) AS title, {snippet} AS snippet,
+               memo_fts.summary, memo_fts.cleaned_text, memo_fts.transcription
+        FROM memo_fts JOIN processed_files p ON p.id = memo_fts.rowid
+        WHERE {" AND ".join(where)}
+        ORDER BY {rank}
+        LIMIT ?
+    """
+    with _connect() as conn:
+        rows = conn.execute(sql, (*params, limit)).fetchall()
+
+    results = []
+    for row in rows:
+        snippet = row["snippet"]
+        if not snippet:
+            text = row["summary"] or row["cleaned_text"] or row["transcription"] or ""
+            for candidate in (row["summary"], row["cleaned_text"], row["transcription"]):
+                if candidate and any(t in candidate for t in terms):
+                    text = candidate
+                    break
+            snippet = _excerpt(text, terms)
+        results.append({
+            "file_path": row["file_path"],
+            "date": row["date"],
+            "title": row["title"],
+            "snippet": " ".join(snippet.split()),
+        })
+    return results
+
+
+# ── 维护 ──────────────────────────────────────────────────────────
+def db_size() -> int:
+    """数据库文件与 WAL 文件的总字节数。"""
+    return sum(
+        p.stat().st_size
+        for p in (DB_PATH, DB_PATH.with_name(DB_PATH.name + "-wal"))
+        if p.exists()
+    )
+
+
+def table_sizes() -> dict:
+    """各表及索引占用的字节数 {名称: 字节}，SQLite 未编译 dbstat 时返回空字典。"""
+    with _connect() as conn:
+        try:
+            rows = conn.execute(
+                "SELECT name, SUM(pgsize) AS size FROM dbstat GROUP BY name ORDER BY size DESC"
+            ).fetchall()
+        except sqlite3.OperationalError:
+            return {}
+    return {row["name"]: row["size"] for row in rows}
+
+
+def compact_db() -> dict:
+    """
+    压缩旧版本写入的明文内容缓存、合并全文索引段、VACUUM 回收空闲页并截断 WAL。
+    VACUUM 期间独占数据库，应在监听停止时运行。返回 {"before": 字节, "after": 字节, "compressed": 行数}。
+    """
+    before = db_size()
+    with _connect() as conn:
+        compressed = 0
+        for column in ("transcription_text", "ai_result_json"):
+            compressed += conn.execute(
+                f"UPDATE content_cache SET {column} = lw_compress({column}) WHERE typeof({column}) = 'text'"
+            ).rowcount
+        conn.execute("INSERT INTO memo_fts (memo_fts) VALUES ('optimize')")
+    # VACUUM 不能在事务中执行：上面的事务已提交，这里持有连接锁直接执行
+    with _lock:
+        conn = _get_conn()
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("PRAGMA optimize")
+    after = db_size()
+    logger.debug("数据库整理完成: %d → %d 字节", before, after)
+    return {"before": before, "after": after, "compressed": compressed}
+
+
+# ── 分段转写缓存 ──────────────────────────────────────────────────
+def get_segment_transcriptions(audio_hash: str) -> dict:
+    """已完成的分段转写，{(start_ms, end_ms): 文本}。"""
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT start_ms, end_ms, transcription_text FROM segment_cache WHERE audio_hash = ?",
+            (audio_hash,)
+        ).fetchall()
+    return {(r["start_ms"], r["end_ms"]): r["transcription_text"] for r in rows}
+
+
+def save_segment_transcription(audio_hash: str, start_ms: int, end_ms: int, text: str) -> None:
+    with _connect() as conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO segment_cache
+                (audio_hash, start_ms, end_ms, transcription_text, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (audio_hash, start_ms, end_ms, text, datetime.now().isoformat())
+        )
+
+
+def clear_segment_transcriptions(audio_hash: str) -> None:
+    """整段转写已存入 content_cache 后清理分段结果。"""
+    with _connect() as conn:
+        conn.execute("DELETE FROM segment_cache WHERE audio_hash = ?", (audio_hash,))
+
+
+# ── 日记写入记录 ──────────────────────────────────────────────────
+def get_journal_written(entry_ids: List[str]) -> set:
+    """返回其中已写入过日记的条目 ID（即录音文件路径）。"""
+    with _connect() as conn:
+        return {
+            row["file_path"]
+            for row in conn.execute(
+                f"SELECT file_path FROM processed_files "
+                f"WHERE journal_written_at IS NOT NULL AND file_path IN ({', '.join('?' for _ in entry_ids)})",
+                entry_ids
+            )
+        }
+
+
+def mark_journal_written(entry_ids: List[str]) -> None:
+    """批量记录条目已写入日记，重试时据此跳过。"""
+    if not entry_ids:
+        return
+    now = datetime.now().isoformat()
+    with _connect() as conn:
+        conn.executemany(
+            "UPDATE processed_files SET journal_written_at = ? WHERE file_path = ?",
+            [(now, entry_id) for entry_id in entry_ids]
+        )
+
+
+# ── 转写耗时 ──────────────────────────────────────────────────────
+def record_asr_latency(duration: Optional[float], turnaround: float, queries: int) -> None:
+    with _connect() as conn:
+        conn.execute(
+            """
+            INSERT INTO asr_latency (duration_seconds, turnaround_seconds, queries, created_at)
+            VALUES (?, ?, ?, ?)
+            """,
+            (duration, turnaround, queries, datetime.now().isoformat())
+        )
+
+
+def get_asr_latency_samples(limit: int) -> list:
+    """最近 limit 条转写耗时样本，[(音频时长, 耗时)]，按时间正序。"""
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT duration_seconds, turnaround_seconds FROM asr_latency ORDER BY id DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+    return [(r["duration_seconds"], r["turnaround_seconds"]) for r in reversed(rows)]
+
+
+# ── 任务队列 ──────────────────────────────────────────────────────
+def enqueue_job(path: Path, priority: int) -> None:
+    """
+    登记进入流水线的任务。已有未完成记录时保留失败次数（重启恢复），
+    死信任务再次提交（文件变化 / 手动重试）时从头开始。
+    """
+    now = datetime.now().isoformat()
+    with _connect() as conn:
+        conn.execute(
+            """
+            INSERT INTO jobs (file_path, state, priority, created_at, updated_at)
+            VALUES (?, 'queued', ?, ?, ?)
+            ON CONFLICT(file_path) DO UPDATE SET
+                priority   = MIN(jobs.priority, excluded.priority),
+                state      = CASE WHEN jobs.state = 'dead' THEN 'queued' ELSE jobs.state END,
+                attempts   = CASE WHEN jobs.state = 'dead' THEN 0 ELSE jobs.attempts END,
+                updated_at = excluded.updated_at
+            """,
+            (str(path), priority, now, now)
+        )
+
+
+def schedule_job_retry(path: Path, stage: str, attempts: int, next_attempt_at: datetime, error: str) -> None:
+    with _connect() as conn:
+        conn.execute(
+            """
+            UPDATE jobs SET state = 'retry', stage = ?, attempts = ?, next_attempt_at = ?,
+                            last_error = ?, updated_at = ?
+            WHERE file_path = ?
+            """,
+            (stage, attempts, next_attempt_at.isoformat(), error, datetime.now().isoformat(), str(path))
+        )
+
+
+def mark_job_dead(path: Path, stage: str, attempts: int, error: str) -> None:
+    """重试耗尽：转为死信，不再自动重试（启动补处理也会跳过）。"""
+    with _connect() as conn:
+        conn.execute(
+            """
+            UPDATE jobs SET state = 'dead', stage = ?, attempts = ?, next_attempt_at = NULL,
+                            last_error = ?, updated_at = ?
+            WHERE file_path = ?
+            """,
+            (stage, attempts, error, datetime.now().isoformat(), str(path))
+        )
+
+
+def finish_job(path: Path) -> None:
+    """任务离开流水线（成功或跳过）时删除记录，死信保留。"""
+    with _connect() as conn:
+        conn.execute("DELETE FROM jobs WHERE file_path = ? AND state != 'dead'", (str(path),))
+
+
+def get_pending_jobs() -> List[sqlite3.Row]:
+    """上次运行未完成的任务（排队中 / 等待重试），按优先级和下次尝试时间排序。"""
+    with _connect() as conn:
+        return conn.execute(
+            """
+            SELECT file_path, priority, stage, attempts, next_attempt_at FROM jobs
+            WHERE state != 'dead' ORDER BY priority, next_attempt_at
+            """
+        ).fetchall()
+
+
+def get_jobs(state: Optional[str] = None) -> List[sqlite3.Row]:
+    with _connect() as conn:
+        if state:
+            return conn.execute(
+                "SELECT * FROM jobs WHERE state = ? ORDER BY updated_at", (state,)
+            ).fetchall()
+        return conn.execute("SELECT * FROM jobs ORDER BY state, updated_at").fetchall()
+
+
+def requeue_dead_jobs() -> int:
+    """死信任务重新排队（失败次数清零），下次启动监听时处理。返回数量。"""
+    with _connect() as conn:
+        return conn.execute(
+            """
+            UPDATE jobs SET state = 'queued', attempts = 0, next_attempt_at = NULL, updated_at = ?
+            WHERE state = 'dead'
+            """,
+            (datetime.now().isoformat(),)
+        ).rowcount
+
+
 def mark_success(path: Path) -> None:
     """标记文件处理成功。"""
     _set_status(path, "success")
@@ -163,27 +1078,150 @@ def _set_status(path: Path, status: str) -> None:
             """,
             (str(path), size, status, now)
         )
+        _track_status(path, status)
 
 
-def get_unprocessed(directory: Path) -> list:
+def _track_status(path: Path, status: str) -> None:
     """
-    扫描目录，返回尚未成功处理的音频文件列表（按文件名排序）。
-    用于程序启动时补处理遗漏的文件。
+    同步内存中的已处理集合（调用方在事务内）。
+    推迟到最外层事务提交成功后再改，回滚时集合保持与库一致。
     """
+    def apply():
+        if _processed is None:
+            return
+        if status == "success":
+            _processed.add(str(path))
+        else:
+            _processed.discard(str(path))
+    _after_commit.append(apply)
+
+
+def get_unprocessed(directory: Path) -> Iterator[Path]:
+    """
+    逐个产出尚未成功处理的音频文件，用于程序启动时补处理遗漏的文件。
+    1. 先产出库中未成功（failed / pending）且仍存在的文件（走 status 索引），死信任务除外
+    2. 再与目录快照比对，只产出新增或变化的文件（原地改写的文件目录修改时间不变，每次都逐个比对）
+    新发现的文件先登记为 pending，即使本次未处理完，下次启动也能从第 1 步找回。
+    """
+    retried = set()
     with _connect() as conn:
-        done = {
-            row["file_path"]
-            for row in conn.execute(
-                "SELECT file_path FROM processed_files WHERE status = 'success'"
-            ).fetchall()
-        }
+        rows = conn.execute(
+            """
+            SELECT file_path FROM processed_files
+            WHERE status != 'success'
+              AND file_path NOT IN (SELECT file_path FROM jobs WHERE state = 'dead')
+            """
+        ).fetchall()
+    for row in rows:
+        p = Path(row["file_path"])
+        if p.parent == directory and p.suffix.lower() in WATCH_EXTENSIONS and p.exists():
+            retried.add(row["file_path"])
+            yield p
+
+    for batch in _scan_changes(directory):
+        for p in batch:
+            if str(p) not in retried and not is_processed(p):
+                yield p
+
+
+def _scan_changes(directory: Path) -> Iterator[List[Path]]:
+    """
+    用 os.scandir 流式扫描目录，按批与 dir_snapshot 比对 (大小, mtime, inode)，
+    产出每批中新增或变化的文件，并更新快照。内存占用只与批大小有关。
+    """
+    try:
+        dir_mtime = directory.stat().st_mtime_ns
+    except OSError as e:
+        logger.warning("无法扫描目录，跳过补处理: %s", e)
+        return
+    with _connect() as conn:
+        state = conn.execute(
+            "SELECT mtime_ns, scan_id FROM scan_state WHERE directory = ?", (str(directory),)
+        ).fetchone()
+    scan_id = (state["scan_id"] + 1) if state else 1
+
+    started = datetime.now()
+    seen = changed = 0
     try:
-        files = list(directory.iterdir())
+        with os.scandir(directory) as it:
+            batch = []
+            for entry in it:
+                if os.path.splitext(entry.name)[1].lower() not in WATCH_EXTENSIONS:
+                    continue
+                batch.append(entry)
+                if len(batch) >= SCAN_BATCH_SIZE:
+                    found = _diff_batch(batch, scan_id)
+                    seen, changed = seen + len(batch), changed + len(found)
+                    batch = []
+                    if found:
+                        yield found
+            if batch:
+                found = _diff_batch(batch, scan_id)
+                seen, changed = seen + len(batch), changed + len(found)
+                if found:
+                    yield found
     except PermissionError as e:
-        import logging
-        logging.getLogger(__name__).warning("无法扫描目录，跳过补处理: %s", e)
-        return []
-    return sorted(
-        p for p in files
-        if p.suffix.lower() in WATCH_EXTENSIONS and str(p) not in done
+        logger.warning("无法扫描目录，跳过补处理: %s", e)
+        return
+
+    # 扫描完整结束才记录目录状态，并清理已删除文件的快照
+    with _connect() as conn:
+        prefix = os.path.join(str(directory), "")
+        conn.execute(
+            "DELETE FROM dir_snapshot WHERE substr(file_path, 1, ?) = ? AND scan_id != ?",
+            (len(prefix), prefix, scan_id)
+        )
+        conn.execute(
+            """
+            INSERT INTO scan_state (directory, mtime_ns, scan_id, scanned_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(directory) DO UPDATE SET
+                mtime_ns = excluded.mtime_ns, scan_id = excluded.scan_id, scanned_at = excluded.scanned_at
+            """,
+            (str(directory), dir_mtime, scan_id, datetime.now().isoformat())
+        )
+    logger.info(
+        "目录扫描完成：%d 个音频文件，%d 个新增或变化（%.2fs）",
+        seen, changed, (datetime.now() - started).total_seconds(),
     )
+
+
+def _diff_batch(entries: list, scan_id: int) -> List[Path]:
+    """比对一批目录项与快照，返回变化的文件；同时刷新快照并为新文件登记 pending 记录。"""
+    rows = []
+    for entry in entries:
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            continue
+        rows.append((entry.path, st.st_size, st.st_mtime_ns, entry.inode()))
+    if not rows:
+        return []
+
+    now = datetime.now().isoformat()
+    with _connect() as conn:
+        known = {
+            r["file_path"]: (r["file_size"], r["mtime_ns"], r["inode"])
+            for r in conn.execute(
+                f"SELECT file_path, file_size, mtime_ns, inode FROM dir_snapshot "
+                f"WHERE file_path IN ({', '.join('?' for _ in rows)})",
+                [r[0] for r in rows]
+            )
+        }
+        changed = [r for r in rows if known.get(r[0]) != r[1:]]
+        conn.executemany(
+            """
+            INSERT INTO dir_snapshot (file_path, file_size, mtime_ns, inode, scan_id) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(file_path) DO UPDATE SET
+                file_size = excluded.file_size, mtime_ns = excluded.mtime_ns,
+                inode = excluded.inode, scan_id = excluded.scan_id
+            """,
+            [(*r, scan_id) for r in rows]
+        )
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO processed_files (file_path, file_size, status, processed_at)
+            VALUES (?, ?, 'pending', ?)
+            """,
+            [(r[0], r[1], now) for r in changed]
+        )
+    return [Path(r[0]) for r in changed]
@@ -0,0 +1,360 @@
+"""
+本地模拟的豆包转写 + OSS + OpenAI 兼容 AI 服务，用于离线联调和压测流水线，不消耗云端额度。
+
+    python -m listen_watch.fake_services --port 8765 --asr-latency 2 --failure-rate 0.05
+
+然后在 .env 中指向本地：
+    VOLCENGINE_ASR_URL=http://127.0.0.1:8765/api/v3/auc/bigmodel
+    OSS_ENDPOINT=http://127.0.0.1:8765
+    OSS_IS_CNAME=true
+    KIMI_BASE_URL=http://127.0.0.1:8765/v1
+"""
+import re
+import json
+import uuid
+import time
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit, unquote
+
+logger = logging.getLogger(__name__)
+
+ASR_PATH = "/api/v3/auc/bigmodel"
+LLM_PATH = "/v1/chat/completions"
+
+CODE_SUCCESS = 20000000
+CODE_PROCESSING = 20000001
+CODE_FAILED = 45000001
+
+
+@dataclass
+class FakeConfig:
+    request_delay: float = 0.0    # 每个请求的额外延迟（秒），模拟网络往返
+    asr_latency: float = 2.0      # 转写固定耗时（秒）
+    asr_rate: float = 0.05        # 每 MB 音频额外耗时（秒）
+    asr_jitter: float = 0.2       # 耗时随机浮动比例
+    failure_rate: float = 0.0     # 请求直接返回 HTTP 503 的概率
+    asr_error_rate: float = 0.0   # 转写任务最终失败的概率
+    llm_latency: float = 1.0      # AI 首个输出片段前的等待（秒）
+    llm_chunks: int = 10          # AI 输出拆成的流式片段数
+    llm_max_concurrency: int = 0  # AI 同时处理的请求上限，超出返回 429 + Retry-After（0 不限制）
+
+
+@dataclass
+class _AsrJob:
+    ready_at: float
+    text: Optional[str]   # None 表示任务失败
+
+
+class _State:
+    def __init__(self, config: FakeConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.objects: dict = {}      # key → bytes
+        self.uploads: dict = {}      # upload_id → (key, {part_number: bytes})
+        self.jobs: dict = {}         # request_id → _AsrJob
+        self.llm_active = 0
+        self.stats = {
+            "submit": 0, "query": 0, "put": 0, "get": 0, "delete": 0, "llm": 0, "failed": 0, "throttled": 0,
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "listen-watch-fake/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def state(self) -> _State:
+        return self.server.state
+
+    def log_message(self, fmt, *args):
+        logger.debug("%s %s", self.address_string(), fmt % args)
+
+    # ── 请求分发 ──────────────────────────────────────────────────
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_HEAD(self):
+        self._dispatch("HEAD")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method: str) -> None:
+        url = urlsplit(self.path)
+        query = parse_qs(url.query, keep_blank_values=True)
+        body = self._read_body()
+        config = self.state.config
+        if config.request_delay:
+            time.sleep(config.request_delay)
+        if random.random() < config.failure_rate:
+            with self.state.lock:
+                self.state.stats["failed"] += 1
+            self._reply(503, b"simulated failure")
+            return
+        if method == "POST" and url.path == f"{ASR_PATH}/submit":
+            self._asr_submit(body)
+        elif method == "POST" and url.path == f"{ASR_PATH}/query":
+            self._asr_query()
+        elif method == "POST" and url.path == LLM_PATH:
+            self._llm(body)
+        elif url.path == "/stats":
+            with self.state.lock:
+                self._reply_json(dict(self.state.stats))
+        else:
+            self._oss(method, unquote(url.path.lstrip("/")), query, body)
+
+    # ── 豆包转写 ──────────────────────────────────────────────────
+    def _asr_submit(self, body: bytes) -> None:
+        request_id = self.headers.get("X-Api-Request-Id") or uuid.uuid4().hex
+        audio_url = json.loads(body or b"{}").get("audio", {}).get("url", "")
+        key = unquote(urlsplit(audio_url).path.lstrip("/"))
+        config = self.state.config
+        with self.state.lock:
+            self.state.stats["submit"] += 1
+            data = self.state.objects.get(key)
+        if data is None:
+            self._reply_json({"resp": {"code": CODE_FAILED, "message": f"audio not found: {key}"}})
+            return
+        size_mb = len(data) / 1024 / 1024
+        latency = (config.asr_latency + config.asr_rate * size_mb) * random.uniform(
+            1 - config.asr_jitter, 1 + config.asr_jitter
+        )
+        text = None
+        if random.random() >= config.asr_error_rate:
+            digest = hashlib.sha1(data).hexdigest()[:8]
+            text = f"模拟转写：{key.rsplit('/', 1)[-1]}，{len(data)} 字节，{digest}。"
+        with self.state.lock:
+            self.state.jobs[request_id] = _AsrJob(ready_at=time.monotonic() + latency, text=text)
+        self._reply_json({})
+
+    def _asr_query(self) -> None:
+        request_id = self.headers.get("X-Api-Request-Id", "")
+        with self.state.lock:
+            self.state.stats["query"] += 1
+            job = self.state.jobs.get(request_id)
+        if job is None:
+            self._reply_json({"resp": {"code": CODE_FAILED, "message": "unknown request id"}})
+        elif time.monotonic() < job.ready_at:
+            self._reply_json({"resp": {"code": CODE_PROCESSING}})
+        elif job.text is None:
+            self._reply_json({"resp": {"code": CODE_FAILED, "message": "simulated asr error"}})
+        else:
+            self._reply_json({"resp": {"code": CODE_SUCCESS}, "result": {"text": job.text}})
+
+    # ── AI（OpenAI 兼容 chat.completions，流式）──────────────────
+    def _llm(self, body: bytes) -> None:
+        """按系统提示词里要求的字段生成 JSON，流式分片返回（SSE）。"""
+        request = json.loads(body or b"{}")
+        messages = request.get("messages", [])
+        system = next((m["content"] for m in messages if m["role"] == "system"), "")
+        user = next((m["content"] for m in messages if m["role"] == "user"), "")
+        config = self.state.config
+        with self.state.lock:
+            if config.llm_max_concurrency and self.state.llm_active >= config.llm_max_concurrency:
+                self.state.stats["throttled"] += 1
+                throttled = True
+            else:
+                self.state.stats["llm"] += 1
+                self.state.llm_active += 1
+                throttled = False
+        if throttled:
+            self._reply(429, b"rate limit exceeded", {"Retry-After": "1"})
+            return
+        content = json.dumps(_fake_llm_result(system, user), ensure_ascii=False)
+
+        try:
+            time.sleep(config.llm_latency)
+        finally:
+            with self.state.lock:
+                self.state.llm_active -= 1
+        step = max(1, -(-len(content) // max(config.llm_chunks, 1)))
+        events = []
+        for i in range(0, len(content), step):
+            chunk = {
+                "id": "fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{"index": 0, "delta": {"content": content[i:i + step]}, "finish_reason": None}],
+            }
+            events.append(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+        events.append("data: [DONE]\n\n")
+        self._reply(200, "".join(events).encode(), {"Content-Type": "text/event-stream"})
+
+    # ── OSS（endpoint/key 形式，不校验签名）──────────────────────
+    def _oss(self, method: str, key: str, query: dict, body: bytes) -> None:
+        state = self.state
+        if method == "POST" and "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            with state.lock:
+                state.uploads[upload_id] = (key, {})
+            self._reply_xml(
+                f"<InitiateMultipartUploadResult><Bucket>fake</Bucket><Key>{key}</Key>"
+                f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+            )
+        elif method == "PUT" and "uploadId" in query:
+            upload_id = query["uploadId"][0]
+            with state.lock:
+                if upload_id not in state.uploads:
+                    self._reply(404, b"NoSuchUpload")
+                    return
+                state.uploads[upload_id][1][int(query["partNumber"][0])] = body
+            self._reply(200, b"", {"ETag": f'"{hashlib.md5(body).hexdigest().upper()}"'})
+        elif method == "GET" and "uploadId" in query:
+            with state.lock:
+                _, parts = state.uploads.get(query["uploadId"][0], (key, {}))
+                items = "".join(
+                    f"<Part><PartNumber>{n}</PartNumber><Size>{len(data)}</Size>"
+                    f'<ETag>"{hashlib.md5(data).hexdigest().upper()}"</ETag>'
+                    f"<LastModified>2000-01-01T00:00:00.000Z</LastModified></Part>"
+                    for n, data in sorted(parts.items())
+                )
+            self._reply_xml(
+                f"<ListPartsResult><Bucket>fake</Bucket><Key>{key}</Key>"
+                f"<UploadId>{query['uploadId'][0]}</UploadId><IsTruncated>false</IsTruncated>"
+                f"{items}</ListPartsResult>"
+            )
+        elif method == "POST" and "uploadId" in query:
+            with state.lock:
+                upload = state.uploads.pop(query["uploadId"][0], None)
+                if upload is None:
+                    self._reply(404, b"NoSuchUpload")
+                    return
+                # 按请求中列出的分片号拼接
+                numbers = [int(n) for n in re.findall(rb"<PartNumber>(\d+)</PartNumber>", body)]
+                _, parts = upload
+                state.objects[key] = b"".join(parts[n] for n in (numbers or sorted(parts)))
+                state.stats["put"] += 1
+            self._reply_xml(
+                f"<CompleteMultipartUploadResult><Bucket>fake</Bucket><Key>{key}</Key>"
+                f'<ETag>"{uuid.uuid4().hex.upper()}"</ETag></CompleteMultipartUploadResult>'
+            )
+        elif method == "DELETE" and "uploadId" in query:
+            with state.lock:
+                state.uploads.pop(query["uploadId"][0], None)
+            self._reply(204, b"")
+        elif method == "PUT":
+            with state.lock:
+                state.objects[key] = body
+                state.stats["put"] += 1
+            self._reply(200, b"", {"ETag": f'"{hashlib.md5(body).hexdigest().upper()}"'})
+        elif method in ("GET", "HEAD"):
+            with state.lock:
+                data = state.objects.get(key)
+                state.stats["get"] += 1
+            if data is None:
+                self._reply(404, b"NoSuchKey")
+            else:
+                self._reply(200, data, {"Content-Type": "audio/mp4"}, head=method == "HEAD")
+        elif method == "DELETE":
+            with state.lock:
+                state.objects.pop(key, None)
+                state.stats["delete"] += 1
+            self._reply(204, b"")
+        else:
+            self._reply(400, b"unsupported request")
+
+    # ── 工具 ──────────────────────────────────────────────────────
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _reply(self, status: int, body: bytes, headers: Optional[dict] = None, head: bool = False) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("x-oss-request-id", uuid.uuid4().hex)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and not head:
+            self.wfile.write(body)
+
+    def _reply_json(self, data: dict) -> None:
+        self._reply(200, json.dumps(data, ensure_ascii=False).encode(), {"Content-Type": "application/json"})
+
+    def _reply_xml(self, xml: str) -> None:
+        body = ('<?xml version="1.0" encoding="UTF-8"?>' + xml).encode()
+        self._reply(200, body, {"Content-Type": "application/xml"})
+
+
+def _fake_llm_result(system: str, user: str) -> dict:
+    """按提示词中 JSON 格式示例里出现的字段构造结果。"""
+    def one(text: str, keys) -> dict:
+        cleaned = text.strip()
+        result = {}
+        if "title" in keys:
+            result["title"] = (cleaned[:10] or "空录音").replace("\n", " ")
+        if "summary" in keys:
+            result["summary"] = cleaned[:40]
+        if "todos" in keys:
+            result["todos"] = []
+        if "cleaned_text" in keys:
+            result["cleaned_text"] = cleaned
+        return result
+
+    schema = system.rsplit("格式：", 1)[-1]
+    keys = [k for k in ("title", "summary", "todos", "cleaned_text") if f'"{k}"' in schema]
+    if '"results"' in schema:
+        items = json.loads(user)
+        return {"results": [dict(one(it.get("text", ""), keys), id=it.get("id")) for it in items]}
+    return one(user, keys)
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0, config: Optional[FakeConfig] = None):
+    """在后台线程启动模拟服务，返回 (server, base_url)；port=0 时自动分配端口。"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.state = _State(config or FakeConfig())
+    threading.Thread(target=server.serve_forever, name="fake-services", daemon=True).start()
+    base_url = f"http://{host}:{server.server_address[1]}"
+    logger.info("模拟服务已启动: %s", base_url)
+    return server, base_url
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="本地模拟豆包转写 + OSS 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--request-delay", type=float, default=0.0, help="每个请求的额外延迟（秒）")
+    parser.add_argument("--asr-latency", type=float, default=2.0, help="转写固定耗时（秒）")
+    parser.add_argument("--asr-rate", type=float, default=0.05, help="每 MB 音频额外耗时（秒）")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="请求返回 503 的概率")
+    parser.add_argument("--asr-error-rate", type=float, default=0.0, help="转写任务失败的概率")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="AI 首个输出前的等待（秒）")
+    parser.add_argument("--llm-max-concurrency", type=int, default=0, help="AI 同时处理的请求上限，超出返回 429")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    config = FakeConfig(
+        request_delay=args.request_delay,
+        asr_latency=args.asr_latency,
+        asr_rate=args.asr_rate,
+        failure_rate=args.failure_rate,
+        asr_error_rate=args.asr_error_rate,
+        llm_latency=args.llm_latency,
+        llm_max_concurrency=args.llm_max_concurrency,
+    )
+    server, base_url = start_server(args.host, args.port, config)
+    print(f"VOLCENGINE_ASR_URL={base_url}{ASR_PATH}")
+    print(f"OSS_ENDPOINT={base_url}")
+    print("OSS_IS_CNAME=true")
+    print(f"KIMI_BASE_URL={base_url}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import os
+import struct
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from listen_watch import metrics
+
+logger = logging.getLogger(__name__)
+
+METADATA_CACHE_SIZE = 2048
+# MP4 时间戳起点为 1904-01-01（UTC）
+_MP4_EPOCH = datetime(1904, 1, 1)
+
+
+@dataclass
+class AudioMetadata:
+    duration: Optional[float] = None   # 时长（秒）
+    title: Optional[str] = None        # iOS 语音备忘录标题（©nam）
+    codec: Optional[str] = None        # 如 mp4a.40.2
+    bitrate: Optional[int] = None      # bps
+    created_at: Optional[str] = None   # 录制时间（ISO 8601，UTC）
+
+
+def _iter_atoms(f: BinaryIO, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """遍历 [start, end) 范围内的同级 atom，产出 (类型, 数据起点, atom 终点)，只读头部。"""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack(">I4s", header)
+        data_start = offset + 8
+        if size == 1:  # 64 位扩展长度
+            size = struct.unpack(">Q", f.read(8))[0]
+            data_start += 8
+        elif size == 0:  # 延伸到文件末尾
+            size = end - offset
+        if size < data_start - offset:
+            return
+        yield kind, data_start, offset + size
+        offset += size
+
+
+def moov_complete(path: Path) -> bool:
+    """
+    MP4 是否已完整写入：顶层 atom 首尾相接恰好覆盖整个文件，且包含 moov。
+    iCloud 同步中的文件通常缺 moov 或最后一个 atom 被截断。
+    """
+    try:
+        file_size = path.stat().st_size
+        with path.open("rb") as f:
+            has_moov = False
+            end = 0
+            for kind, _, atom_end in _iter_atoms(f, 0, file_size):
+                has_moov |= kind == b"moov"
+                end = atom_end
+            return has_moov and end == file_size
+    except OSError:
+        return False
+
+
+def _mvhd_created_at(f: BinaryIO, file_size: int) -> Optional[str]:
+    """从 moov/mvhd 读取创建时间，跳过 mdat 等大块数据。"""
+    for kind, data_start, atom_end in _iter_atoms(f, 0, file_size):
+        if kind != b"moov":
+            continue
+        for child, child_start, _ in _iter_atoms(f, data_start, atom_end):
+            if child != b"mvhd":
+                continue
+            f.seek(child_start)
+            version = f.read(1)[0]
+            f.seek(child_start + 4)
+            fmt = ">Q" if version == 1 else ">I"
+            seconds = struct.unpack(fmt, f.read(struct.calcsize(fmt)))[0]
+            if not seconds:
+                return None
+            return (_MP4_EPOCH + timedelta(seconds=seconds)).isoformat()
+    return None
+
+
+def _extract(path_str: str, size: int) -> AudioMetadata:
+    """一次打开文件读取全部元数据；mutagen 只解析 moov（含 udta/ilst），跳过 mdat 音频数据。"""
+    from mutagen.mp4 import MP4
+
+    meta = AudioMetadata()
+    try:
+        with metrics.timed("metadata", path=path_str, nbytes=size), open(path_str, "rb") as f:
+            audio = MP4(f)
+            meta.duration = audio.info.length
+            meta.codec = getattr(audio.info, "codec", None)
+            meta.bitrate = getattr(audio.info, "bitrate", None) or None
+            titles = (audio.tags or {}).get("©nam")
+            meta.title = titles[0] if titles else None
+            meta.created_at = _mvhd_created_at(f, size)
+            if not meta.bitrate and meta.duration:
+                meta.bitrate = int(size * 8 / meta.duration)
+    except Exception as e:
+        logger.warning("无法读取音频元数据 %s: %s", os.path.basename(path_str), e)
+    return meta
+
+
+@lru_cache(maxsize=METADATA_CACHE_SIZE)
+def _load(path_str: str, size: int, mtime_ns: int) -> AudioMetadata:
+    """以 (路径, 大小, 修改时间) 为键：先查 processed_files，没有再解析文件并写回。"""
+    from listen_watch import db
+
+    path = Path(path_str)
+    row = db.get_file_metadata(path, size, mtime_ns)
+    if row is not None:
+        return AudioMetadata(
+            duration=row["duration_seconds"],
+            title=row["memo_title"],
+            codec=row["codec"],
+            bitrate=row["bitrate"],
+            created_at=row["created_at"],
+        )
+    meta = _extract(path_str, size)
+    db.save_file_metadata(path, meta, size, mtime_ns)
+    return meta
+
+
+def get_metadata(path: Path) -> AudioMetadata:
+    """
+    返回录音元数据：内存缓存 → processed_files 中的记录 → 解析文件（并写回数据库）。
+    文件大小或修改时间变化时重新解析。
+    """
+    st = path.stat()
+    return _load(str(path), st.st_size, st.st_mtime_ns)
@@ -0,0 +1,312 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Prometheus 文本格式导出：HTTP 端口（0 关闭）和文本文件（空字符串关闭）
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_FILE = os.getenv("METRICS_FILE", str(Path.home() / ".listen_watch" / "metrics.prom"))
+# 刷新间隔（秒）：批量写入 metrics 表并更新导出文件
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "15"))
+# metrics 表保留天数
+METRICS_RETENTION_DAYS = int(os.getenv("METRICS_RETENTION_DAYS", "30"))
+
+PREFIX = "listen_watch"
+# 耗时直方图分桶（秒）
+BUCKETS = (0.005, 0.025, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float("inf"))
+QUANTILES = (0.5, 0.95, 0.99)
+RESERVOIR_SIZE = 1024   # 每个指标保留最近的样本数，用于计算分位数
+
+
+class _Series:
+    """单个 (stage, detail) 的耗时统计：直方图分桶 + 最近样本（分位数）+ 结果计数。"""
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.bytes = 0
+        self.outcomes: Dict[str, int] = {}
+        self.recent = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, seconds: float, outcome: str, nbytes: Optional[int]) -> None:
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        self.bytes += nbytes or 0
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        self.recent.append(seconds)
+
+
+def percentile(values, q: float) -> Optional[float]:
+    """最近邻分位数，q 取 0~1。"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str], _Series] = {}
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._gauges: Dict[str, Callable[[], dict]] = {}
+        self._buffer: list = []   # 待写入 metrics 表的记录
+
+    def observe(self, stage: str, seconds: float, outcome: str, detail: str,
+                nbytes: Optional[int], path: Optional[str], persist: bool) -> None:
+        with self._lock:
+            series = self._series.get((stage, detail))
+            if series is None:
+                series = self._series[(stage, detail)] = _Series()
+            series.observe(seconds, outcome, nbytes)
+            if persist:
+                self._buffer.append((
+                    datetime.now().isoformat(), stage, detail, path,
+                    int(seconds * 1000), nbytes, outcome,
+                ))
+
+    def inc(self, name: str, value: float, labels: dict) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def register_gauge(self, name: str, fn: Callable[[], dict]) -> None:
+        """fn() 返回 {标签值: 数值}，导出时调用。"""
+        with self._lock:
+            self._gauges[name] = fn
+
+    def drain(self) -> list:
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        return rows
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stages = {}
+            for (stage, detail), s in sorted(self._series.items()):
+                stages[f"{stage}/{detail}" if detail else stage] = {
+                    "count": s.count,
+                    "errors": s.count - s.outcomes.get("ok", 0),
+                    "bytes": s.bytes,
+                    "sum": round(s.sum, 6),
+                    **{f"p{int(q * 100)}": percentile(s.recent, q) for q in QUANTILES},
+                }
+            counters = {
+                name + "".join(f",{k}={v}" for k, v in labels): value
+                for (name, labels), value in sorted(self._counters.items())
+            }
+        return {"stages": stages, "counters": counters}
+
+    def render(self) -> str:
+        """Prometheus 文本格式。"""
+        lines = []
+        with self._lock:
+            series = sorted(self._series.items())
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+
+            name = f"{PREFIX}_stage_duration_seconds"
+            lines += [f"# HELP {name} 各环节耗时", f"# TYPE {name} histogram"]
+            for (stage, detail), s in series:
+                labels = f'stage="{stage}",detail="{detail}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS, s.buckets):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {s.sum:.6f}")
+                lines.append(f"{name}_count{{{labels}}} {s.count}")
+
+            name = f"{PREFIX}_stage_latency_quantile_seconds"
+            lines += [f"# HELP {name} 各环节最近 {RESERVOIR_SIZE} 次耗时的分位数", f"# TYPE {name} gauge"]
+            for (stage, detail), s in series:
+                for q in QUANTILES:
+                    value = percentile(s.recent, q)
+                    if value is not None:
+                        lines.append(
+                            f'{name}{{stage="{stage}",detail="{detail}",quantile="{q}"}} {value:.6f}'
+                        )
+
+            name = f"{PREFIX}_stage_total"
+            lines += [f"# HELP {name} 各环节调用次数（按结果）", f"# TYPE {name} counter"]
+            for (stage, detail), s in series:
+                for outcome, count in sorted(s.outcomes.items()):
+                    lines.append(f'{name}{{stage="{stage}",detail="{detail}",outcome="{outcome}"}} {count}')
+
+            name = f"{PREFIX}_stage_bytes_total"
+            lines += [f"# HELP {name} 各环节处理的字节数", f"# TYPE {name} counter"]
+            for (stage, detail), s in series:
+                if s.bytes:
+                    lines.append(f'{name}{{stage="{stage}",detail="{detail}"}} {s.bytes}')
+
+            typed = set()
+            for (cname, labels), value in counters:
+                if cname not in typed:
+                    typed.add(cname)
+                    lines.append(f"# TYPE {PREFIX}_{cname} counter")
+                label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{PREFIX}_{cname}{{{label_str}}} {value:g}")
+
+        for gname, fn in gauges:
+            try:
+                values = fn()
+            except Exception as e:
+                logger.debug("读取指标 %s 失败: %s", gname, e)
+                continue
+            lines.append(f"# TYPE {PREFIX}_{gname} gauge")
+            for label, value in sorted(values.items()):
+                lines.append(f'{PREFIX}_{gname}{{name="{label}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+_registry = _Registry()
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+_server = None
+
+
+# ── 记录 ──────────────────────────────────────────────────────────
+def observe(stage: str, seconds: float, outcome: str = "ok", detail: str = "",
+            nbytes: Optional[int] = None, path=None, persist: bool = True) -> None:
+    """
+    记录一次耗时。persist=False 只进内存统计（如数据库操作本身，避免写 metrics 表时递归记录）。
+    """
+    _registry.observe(stage, seconds, outcome, detail, nbytes, str(path) if path else None, persist)
+
+
+@contextmanager
+def timed(stage: str, detail: str = "", path=None, nbytes: Optional[int] = None, persist: bool = True):
+    """
+    计时上下文，异常时 outcome 记为异常类型名：
+        with metrics.timed("oss_upload", path=path, nbytes=size):
+            ...
+    """
+    started = time.monotonic()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException as e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        observe(stage, time.monotonic() - started, outcome, detail, nbytes, path, persist)
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """累加计数器，如 inc("retries_total", stage="ai")。"""
+    _registry.inc(name, value, labels)
+
+
+def register_gauge(name: str, fn: Callable[[], dict]) -> None:
+    """注册导出时才读取的瞬时值，如各阶段队列深度。"""
+    _registry.register_gauge(name, fn)
+
+
+def render() -> str:
+    return _registry.render()
+
+
+def snapshot() -> dict:
+    """当前内存统计的结构化快照：{"stage/detail": {count, errors, bytes, sum, p50, p95, p99}} 与计数器。"""
+    return _registry.snapshot()
+
+
+# ── 导出 ──────────────────────────────────────────────────────────
+def start() -> None:
+    """启动后台刷新线程（写 metrics 表、导出文件）和可选的 HTTP 端点。"""
+    global _thread, _server
+    if _thread is not None:
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="metrics", daemon=True)
+    _thread.start()
+    if METRICS_PORT:
+        _server = _start_http(METRICS_PORT)
+
+
+def stop() -> None:
+    """停止导出并写入剩余记录。"""
+    global _thread, _server
+    _stop.set()
+    if _thread is not None:
+        _thread.join()
+        _thread = None
+    if _server is not None:
+        _server.shutdown()
+        _server = None
+
+
+def _run() -> None:
+    last_prune = 0.0
+    while True:
+        stopping = _stop.wait(METRICS_FLUSH_INTERVAL)
+        try:
+            _flush()
+            if time.monotonic() - last_prune > 3600:
+                _prune()
+                last_prune = time.monotonic()
+        except Exception as e:
+            logger.warning("写入指标失败: %s", e)
+        if stopping:
+            return
+
+
+def _flush() -> None:
+    from listen_watch import db
+
+    rows = _registry.drain()
+    if rows:
+        db.save_metrics(rows)
+    if METRICS_FILE:
+        # 先写临时文件再替换，采集方不会读到写了一半的内容
+        path = Path(METRICS_FILE).expanduser()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(render(), encoding="utf-8")
+        os.replace(tmp, path)
+
+
+def _prune() -> None:
+    from listen_watch import db
+
+    cutoff = datetime.now() - timedelta(days=METRICS_RETENTION_DAYS)
+    removed = db.prune_metrics(cutoff.isoformat())
+    if removed:
+        logger.debug("清理过期指标 %d 条", removed)
+
+
+def _start_http(port: int):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") not in ("", "/metrics"):
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("指标端点: http://127.0.0.1:%d/metrics", port)
+    return server
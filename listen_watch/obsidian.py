@@ -1,10 +1,15 @@
 import os
 import logging
 import subprocess
+import threading
 import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
+
+from listen_watch import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +17,8 @@ JOURNAL_DIR = os.getenv("OBSIDIAN_JOURNAL_DIR", "")
 DATE_FORMAT = os.getenv("OBSIDIAN_DATE_FORMAT", "%Y-%m-%d")
 SECTION_HEADING = "## 语音记录"
 VAULT_DIR = os.getenv("OBSIDIAN_VAULT_DIR", "")
+# 写入窗口（秒）：窗口内提交到同一日记的条目合并为一次写入
+JOURNAL_FLUSH_INTERVAL = float(os.getenv("JOURNAL_FLUSH_INTERVAL", "0.5"))
 
 
 def _journal_path(date: Optional[datetime] = None) -> Path:
@@ -89,52 +96,186 @@ def ensure_journal_exists(date: Optional[datetime] = None) -> Path:
     return path
 
 
-def append_memo(memo, recorded_at: Optional[datetime] = None) -> None:
+def _find_insert_offset(content: str) -> Optional[int]:
     """
-    将处理后的语音备忘录追加写入当天 Obsidian 日记。
-    - 文件不存在：自动调用 ensure_journal_exists() 创建
-    - 无 '## 语音记录' 章节：在文件末尾追加章节和条目
-    - 章节已存在：在章节内末尾追加条目
+    返回 '## 语音记录' 章节内新条目的插入位置（字符偏移）：
+    --- 分隔线之前（或下一个 ## 标题之前）。无章节返回 None。
     """
-    path = _journal_path(recorded_at)
-    if not path.exists():
-        path = ensure_journal_exists(recorded_at)
+    if SECTION_HEADING not in content:
+        return None
+    lines = content.splitlines(keepends=True)
+    section_idx = None
+    next_section_idx = len(lines)
 
-    entry = _format_entry(memo, recorded_at)
-    content = path.read_text(encoding="utf-8")
+    for i, line in enumerate(lines):
+        if line.strip() == SECTION_HEADING:
+            section_idx = i
+        elif section_idx is not None and line.startswith("## "):
+            next_section_idx = i
+            break
 
-    if SECTION_HEADING not in content:
+    if section_idx is None:
+        # 兜底：直接追加
+        return len(content)
+
+    # 从下一个章节往前找 ---，在它之前插入
+    insert_idx = next_section_idx
+    for i in range(next_section_idx - 1, section_idx, -1):
+        if lines[i].strip() == "---":
+            insert_idx = i
+            break
+    return sum(len(line) for line in lines[:insert_idx])
+
+
+def _insert_entry(content: str, entry: str, offset: Optional[int]) -> Tuple[str, int]:
+    """在 offset 处插入条目（offset 为 None 时在文件末尾新建章节），返回 (新内容, 下一条的插入位置)。"""
+    if offset is None:
         # 章节不存在，追加到文件末尾
         separator = "\n" if content.endswith("\n") else "\n\n"
         new_content = content + separator + SECTION_HEADING + "\n\n" + entry
         logger.info("未找到 '%s' 章节，已在文件末尾创建", SECTION_HEADING)
-    else:
-        # 章节存在，找到插入位置：--- 分隔线之前（或下一个 ## 标题之前）
-        lines = content.splitlines(keepends=True)
-        section_idx = None
-        next_section_idx = len(lines)
-
-        for i, line in enumerate(lines):
-            if line.strip() == SECTION_HEADING:
-                section_idx = i
-            elif section_idx is not None and line.startswith("## "):
-                next_section_idx = i
-                break
-
-        if section_idx is None:
-            # 兜底：直接追加
-            new_content = content.rstrip("\n") + "\n\n" + entry
-        else:
-            # 从下一个章节往前找 ---，在它之前插入
-            insert_idx = next_section_idx
-            for i in range(next_section_idx - 1, section_idx, -1):
-                if lines[i].strip() == "---":
-                    insert_idx = i
-                    break
-
-            before = "".join(lines[:insert_idx]).rstrip("\n")
-            after = "".join(lines[insert_idx:])
-            new_content = before + "\n\n" + entry + "\n" + after
-
-    path.write_text(new_content, encoding="utf-8")
-    logger.info("已写入日记: %s", path.name)
+        return new_content, len(new_content)
+    before = content[:offset].rstrip("\n")
+    after = content[offset:]
+    head = before + "\n\n" + entry + "\n"
+    return head + after, len(head)
+
+
+def _atomic_write(path: Path, content: str) -> None:
+    """先写临时文件再 rename，Obsidian / iCloud 不会读到写了一半的日记。"""
+    tmp = path.with_name(f".{path.name}.listen_watch.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+@dataclass
+class _PendingEntry:
+    entry_id: Optional[str]
+    text: str
+    recorded_at: Optional[datetime]
+    future: Future = field(default_factory=Future)
+
+
+class JournalWriter:
+    """
+    写回式日记写入服务：条目先按目标日记文件分组排队，每个写入窗口内每个文件只读写一次
+    （临时文件 + rename 原子替换）。已写入的条目 ID 记录在数据库中，重试时不会重复追加；
+    章节插入位置按文件 (mtime, 大小) 缓存，文件未被外部修改时不必重新扫描。
+    """
+
+    def __init__(self, flush_interval: float = JOURNAL_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._offsets = {}
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="journal-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, memo, recorded_at: Optional[datetime] = None, entry_id: Optional[str] = None) -> Future:
+        """提交一条记录，返回在写入完成（或失败）时结束的 Future。"""
+        path = _journal_path(recorded_at)
+        pending = _PendingEntry(entry_id, _format_entry(memo, recorded_at), recorded_at)
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("日记写入服务已停止")
+            self._pending.setdefault(path, []).append(pending)
+            self._cond.notify()
+        return pending.future
+
+    def stop(self) -> None:
+        """写完剩余条目后停止。"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                stopping = self._stopped
+            if not stopping:
+                time.sleep(self.flush_interval)  # 等待同一窗口内的其他条目
+            with self._cond:
+                batch, self._pending = self._pending, {}
+            for path, entries in batch.items():
+                try:
+                    self._write_file(path, entries)
+                except Exception as e:
+                    for entry in entries:
+                        if not entry.future.done():
+                            entry.future.set_exception(e)
+
+    def _write_file(self, path: Path, entries: list) -> None:
+        from listen_watch.db import get_journal_written, mark_journal_written
+
+        ids = [e.entry_id for e in entries if e.entry_id]
+        written = get_journal_written(ids) if ids else set()
+        todo, seen = [], set(written)
+        for e in entries:
+            if e.entry_id and e.entry_id in seen:
+                logger.info("条目已写入过日记，跳过: %s", e.entry_id)
+                continue
+            seen.add(e.entry_id)
+            todo.append(e)
+
+        if todo:
+            if not path.exists():
+                path = ensure_journal_exists(todo[0].recorded_at)
+            content = path.read_text(encoding="utf-8")
+            st = path.stat()
+            cached = self._offsets.get(path)
+            if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+                offset = cached[2]
+            else:
+                offset = _find_insert_offset(content)
+            for e in todo:
+                content, offset = _insert_entry(content, e.text, offset)
+            with metrics.timed("journal_write", path=path, nbytes=len(content.encode("utf-8"))):
+                _atomic_write(path, content)
+            st = path.stat()
+            self._offsets[path] = (st.st_mtime_ns, st.st_size, offset)
+            mark_journal_written([e.entry_id for e in todo if e.entry_id])
+            logger.info("已写入日记: %s（%d 条）", path.name, len(todo))
+
+        for e in entries:
+            e.future.set_result(path)
+
+
+_writer: Optional[JournalWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> JournalWriter:
+    """进程内共享的日记写入服务（首次使用时启动）。"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = JournalWriter()
+        return _writer
+
+
+def stop_writer() -> None:
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.stop()
+            _writer = None
+
+
+def append_memo(memo, recorded_at: Optional[datetime] = None, entry_id: Optional[str] = None) -> None:
+    """
+    将处理后的语音备忘录追加写入对应日期的 Obsidian 日记，写入完成后返回。
+    - 文件不存在：自动调用 ensure_journal_exists() 创建
+    - 无 '## 语音记录' 章节：在文件末尾追加章节和条目
+    - 章节已存在：在章节内末尾追加条目
+    entry_id（如录音文件路径）用于去重：同一条目重复提交只写入一次。
+    """
+    get_writer().submit(memo, recorded_at, entry_id).result()
@@ -0,0 +1,435 @@
+import os
+import time
+import heapq
+import random
+import logging
+import itertools
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from queue import Empty, SimpleQueue
+from typing import Callable, List, Optional
+
+from listen_watch import metrics
+
+logger = logging.getLogger(__name__)
+
+# 每个阶段入口队列的容量；队列满时提交方阻塞等待（背压）
+QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "64"))
+# 为实时录音额外保留的队列位置：补处理把队列占满时，新录音仍可立即入队
+LIVE_RESERVE = int(os.getenv("PIPELINE_LIVE_RESERVE", "8"))
+DEPTH_LOG_INTERVAL = 30  # 队列深度日志间隔（秒）
+
+# 任务失败后的重试：总尝试次数上限，退避间隔 = base × 2^(n-1)（不超过 max），再加随机抖动
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "900"))
+
+# 任务优先级：数值小的先处理；同一优先级内文件小（录音短）的先处理
+PRIORITY_LIVE = 0        # 监听到的新录音
+PRIORITY_BACKFILL = 1    # 启动补处理 / 批量导入
+
+@dataclass
+class MemoJob:
+    """流水线中流转的单个录音任务，各阶段在其上累积中间结果。"""
+    path: Path
+    prepared: bool = False             # 元数据已读取并入库，重试时不再重复
+    recorded_at: Optional[datetime] = None
+    duration: Optional[float] = None
+    memo_title: Optional[str] = None
+    audio_hash: Optional[str] = None   # 音频内容哈希，用于跨路径复用缓存
+    text: Optional[str] = None
+    memo: object = None
+    priority: int = PRIORITY_LIVE
+    size: int = 0                      # 文件大小，近似录音时长，用于短任务优先
+    attempts: int = 0                  # 已失败次数（跨阶段累计），达到上限后不再重试
+    submitted_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class Stage:
+    """
+    流水线阶段。
+    handler 接收 MemoJob，返回 MemoJob 交给下一阶段，返回 None 表示任务到此结束。
+    handler 也可以返回 Future（如异步转写），结果按同样规则处理：工作线程不等待，立即处理下一个任务，
+    完成后由流水线的回收线程转交下一阶段；max_pending > 0 时限制该阶段同时挂起的任务数（不与批处理同用）。
+    batch_size > 1 且提供 batch_handler 时，工作线程在 batch_wait 秒内凑齐最多 batch_size 个任务
+    一起交给 batch_handler（返回与输入一一对应的结果列表）；批处理失败时逐个改用 handler 重试。
+    """
+    name: str
+    handler: Callable[[MemoJob], Optional[MemoJob]]
+    workers: int = 1
+    batch_handler: Optional[Callable[[List[MemoJob]], List[Optional[MemoJob]]]] = None
+    batch_size: int = 1
+    batch_wait: float = 0.5
+    max_pending: int = 0
+
+
+class _StageQueue:
+    """
+    阶段入口的有界优先队列，按 (优先级, 文件大小, 提交顺序) 出队。
+    实时任务最多可超出容量 reserve 个，不会被排满的补处理任务挡在门外；
+    force=True 的入队（新录音、到期重试）不受容量限制，提交方从不阻塞。
+    """
+
+    def __init__(self, maxsize: int, reserve: int = LIVE_RESERVE):
+        self.maxsize = maxsize
+        self.reserve = reserve
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def put(self, job: MemoJob, timeout: Optional[float] = None, force: bool = False) -> bool:
+        """入队，队列满时最多等待 timeout 秒；返回 False 表示超时。"""
+        limit = self.maxsize + (self.reserve if job.priority == PRIORITY_LIVE else 0)
+        with self._cond:
+            if not force and not self._cond.wait_for(lambda: len(self._heap) < limit, timeout):
+                return False
+            heapq.heappush(self._heap, (job.priority, job.size, next(self._seq), job))
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout: Optional[float] = None) -> Optional[MemoJob]:
+        """取出优先级最高的任务，timeout 秒内没有任务返回 None。"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._heap, timeout):
+                return None
+            job = heapq.heappop(self._heap)[-1]
+            self._cond.notify_all()
+            return job
+
+    def qsize(self) -> int:
+        with self._cond:
+            return len(self._heap)
+
+
+# _run_stage 的返回值：任务已安排延迟重试，暂不离开流水线
+_DEFERRED = object()
+
+
+class Pipeline:
+    """
+    多阶段任务流水线：每个阶段一个有界优先队列 + 独立的工作线程池，
+    多个录音可同时处于不同阶段，单个慢任务不会阻塞其他录音；
+    新录音在每个阶段都排在补处理任务之前。
+    失败的任务按退避时间放入延迟队列，由调度线程到期后重新入队，等待期间不占用工作线程。
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = QUEUE_SIZE,
+                 max_attempts: int = MAX_ATTEMPTS, retry_base: float = RETRY_BASE_DELAY,
+                 retry_max: float = RETRY_MAX_DELAY,
+                 on_submit=None, on_retry=None, on_failure=None, on_complete=None):
+        """
+        max_attempts: 单个任务的最大尝试次数（各阶段失败累计）
+        on_submit:    on_submit(job)，新任务进入流水线时调用（如持久化任务记录）
+        on_retry:     on_retry(job, stage_name, error, delay)，安排 delay 秒后重试时调用
+        on_failure:   on_failure(job, stage_name, error)，重试耗尽后调用
+        on_complete:  on_complete(job)，任务离开流水线时调用（成功、跳过或失败）
+        """
+        self._stages = list(stages)
+        self._queues = [_StageQueue(queue_size) for _ in self._stages]
+        self._max_attempts = max(1, max_attempts)
+        self._retry_base = retry_base
+        self._retry_max = retry_max
+        self._on_submit = on_submit
+        self._on_retry = on_retry
+        self._on_failure = on_failure
+        self._on_complete = on_complete
+        self._delayed = []   # [(到期时间, 序号, 阶段下标, 任务)]
+        self._delayed_seq = itertools.count()
+        self._delayed_cond = threading.Condition()
+        self._pending_slots = [
+            threading.BoundedSemaphore(s.max_pending) if s.max_pending > 0 else None for s in self._stages
+        ]
+        self._completed = SimpleQueue()   # 已完成的 Future：(阶段下标, 任务, Future, 开始时间)
+        self._threads: List[threading.Thread] = []
+        self._inflight = set()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._stop = threading.Event()
+
+    # ── 生命周期 ──────────────────────────────────────────────────
+    def start(self) -> None:
+        for idx, stage in enumerate(self._stages):
+            for n in range(stage.workers):
+                t = threading.Thread(
+                    target=self._worker, args=(idx,),
+                    name=f"{stage.name}-{n + 1}", daemon=True,
+                )
+                t.start()
+                self._threads.append(t)
+        metrics.register_gauge("queue_depth", self.depths)
+        metrics.register_gauge("inflight", lambda: {"pipeline": self.inflight})
+        metrics.register_gauge("retry_pending", lambda: {"pipeline": self.retry_pending})
+        scheduler = threading.Thread(target=self._schedule_retries, name="pipeline-retry", daemon=True)
+        scheduler.start()
+        self._threads.append(scheduler)
+        collector = threading.Thread(target=self._collect_completed, name="pipeline-async", daemon=True)
+        collector.start()
+        self._threads.append(collector)
+        monitor = threading.Thread(target=self._monitor, name="pipeline-monitor", daemon=True)
+        monitor.start()
+        logger.info(
+            "流水线已启动: %s",
+            ", ".join(f"{s.name}×{s.workers}" for s in self._stages),
+        )
+
+    def stop(self, drain: bool = False, timeout: Optional[float] = None) -> None:
+        """停止所有工作线程。drain=True 时先等待已提交的任务全部完成。"""
+        if drain:
+            self.join()
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+        logger.info("流水线已停止")
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """阻塞直到所有已提交任务处理完毕。返回 False 表示超时。"""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._inflight, timeout)
+
+    # ── 提交 ──────────────────────────────────────────────────────
+    def submit(self, path: Path, priority: int = PRIORITY_LIVE, attempts: int = 0, delay: float = 0) -> bool:
+        """
+        提交录音文件。同一文件处理中时忽略重复提交，返回 False。
+        新录音（PRIORITY_LIVE）直接入队不等待，监听线程不会被积压卡住；
+        补处理任务在入口队列已满时阻塞等待（背压），直到有空位。
+        attempts / delay 用于恢复上次未完成的任务：沿用已失败次数，delay 秒后再开始。
+        """
+        key = str(path)
+        with self._lock:
+            if key in self._inflight:
+                logger.debug("文件已在处理中，忽略重复提交: %s", path.name)
+                return False
+            self._inflight.add(key)
+        try:
+            size = path.stat().st_size
+        except OSError:
+            size = 0
+        job = MemoJob(path=path, priority=priority, size=size, attempts=attempts)
+        if self._on_submit:
+            self._on_submit(job)
+        if delay > 0:
+            self._defer(0, job, delay)
+        elif priority == PRIORITY_LIVE:
+            self._queues[0].put(job, force=True)
+        else:
+            self._put(0, job)
+        return True
+
+    def depths(self) -> dict:
+        """各阶段当前排队数量。"""
+        return {s.name: q.qsize() for s, q in zip(self._stages, self._queues)}
+
+    @property
+    def inflight(self) -> int:
+        with self._lock:
+            return len(self._inflight)
+
+    @property
+    def retry_pending(self) -> int:
+        """等待重试的任务数。"""
+        with self._delayed_cond:
+            return len(self._delayed)
+
+    # ── 内部实现 ──────────────────────────────────────────────────
+    def _put(self, idx: int, job: MemoJob) -> None:
+        q = self._queues[idx]
+        if q.put(job, timeout=0):
+            return
+        # 新录音在阶段间等待（保留位置也已用完）说明整体积压，需要提示；补处理的等待属正常背压
+        log = logger.warning if job.priority == PRIORITY_LIVE else logger.debug
+        log("%s 队列已满（%d），等待空位: %s", self._stages[idx].name, q.maxsize, job.path.name)
+        while not self._stop.is_set():
+            if q.put(job, timeout=1):
+                return
+
+    def _worker(self, idx: int) -> None:
+        stage = self._stages[idx]
+        q = self._queues[idx]
+        slots = self._pending_slots[idx]
+        batching = stage.batch_handler is not None and stage.batch_size > 1
+        while not self._stop.is_set():
+            # 先占挂起名额再取任务：名额用完时任务留在队列里，仍按优先级出队
+            if slots is not None and not slots.acquire(timeout=1):
+                continue
+            job = q.get(timeout=1)
+            if job is None:
+                if slots is not None:
+                    slots.release()
+                continue
+            jobs = self._collect_batch(q, job, stage) if batching else [job]
+            started = time.monotonic()
+            try:
+                if len(jobs) > 1:
+                    results = self._run_batch(idx, jobs)
+                else:
+                    results = [self._run_stage(idx, job)]
+            except Exception as e:
+                logger.error("[%s] 未处理的异常 %s: %s", stage.name, job.path.name, e, exc_info=True)
+                results = [None] * len(jobs)
+            if slots is not None and not any(isinstance(r, Future) for r in results):
+                slots.release()
+            for job, result in zip(jobs, results):
+                if isinstance(result, Future):
+                    result.add_done_callback(
+                        lambda f, job=job: self._completed.put((idx, job, f, started))
+                    )
+                else:
+                    self._forward(idx, job, result)
+
+    def _forward(self, idx: int, job: MemoJob, result) -> None:
+        """把阶段结果交给下一阶段；返回 None 或已是最后阶段时任务结束。"""
+        if result is _DEFERRED:
+            return
+        if result is not None and idx + 1 < len(self._stages):
+            self._put(idx + 1, result)
+        else:
+            self._finish(job)
+
+    def _collect_completed(self) -> None:
+        """回收 handler 返回的 Future：释放挂起名额，结果转交下一阶段，异常走重试。"""
+        while not self._stop.is_set():
+            try:
+                idx, job, future, started = self._completed.get(timeout=1)
+            except Empty:
+                continue
+            stage = self._stages[idx]
+            slots = self._pending_slots[idx]
+            if slots is not None:
+                slots.release()
+            elapsed = time.monotonic() - started
+            try:
+                result = future.result()
+            except Exception as e:
+                metrics.observe("stage", elapsed, type(e).__name__, stage.name, path=job.path)
+                result = self._fail(idx, job, e)
+            else:
+                metrics.observe("stage", elapsed, detail=stage.name, path=job.path)
+            try:
+                self._forward(idx, job, result)
+            except Exception as e:
+                logger.error("[%s] 未处理的异常 %s: %s", stage.name, job.path.name, e, exc_info=True)
+                self._finish(job)
+
+    def _collect_batch(self, q: _StageQueue, first: MemoJob, stage: Stage) -> List[MemoJob]:
+        """以 first 开头，在 batch_wait 内从队列中再取任务，最多 batch_size 个。"""
+        jobs = [first]
+        deadline = time.monotonic() + stage.batch_wait
+        while len(jobs) < stage.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            job = q.get(timeout=remaining)
+            if job is None:
+                break
+            jobs.append(job)
+        return jobs
+
+    def _run_batch(self, idx: int, jobs: List[MemoJob]) -> List[Optional[MemoJob]]:
+        """批量执行；批处理本身失败时逐个走 _run_stage（含重试）。"""
+        stage = self._stages[idx]
+        try:
+            with metrics.timed("stage_batch", detail=stage.name):
+                results = stage.batch_handler(jobs)
+            if len(results) != len(jobs):
+                raise ValueError(f"批处理结果数 {len(results)} 与任务数 {len(jobs)} 不一致")
+            return results
+        except Exception as e:
+            logger.warning("[%s] 批处理 %d 个任务失败，改为逐个处理: %s", stage.name, len(jobs), e)
+            metrics.inc("batch_fallbacks_total", stage=stage.name)
+            return [self._run_stage(idx, job) for job in jobs]
+
+    def _run_stage(self, idx: int, job: MemoJob):
+        """
+        执行阶段处理。失败且未达尝试上限时安排延迟重试并返回 _DEFERRED；
+        重试耗尽返回 None。handler 返回的 Future 原样返回。
+        """
+        stage = self._stages[idx]
+        started = time.monotonic()
+        try:
+            result = stage.handler(job)
+        except Exception as e:
+            metrics.observe("stage", time.monotonic() - started, type(e).__name__, stage.name, path=job.path)
+            return self._fail(idx, job, e)
+        # 返回 Future 时耗时在完成后由回收线程记录
+        if not isinstance(result, Future):
+            metrics.observe("stage", time.monotonic() - started, detail=stage.name, path=job.path)
+        return result
+
+    def _fail(self, idx: int, job: MemoJob, e: Exception):
+        """记录一次失败：未达尝试上限时安排延迟重试并返回 _DEFERRED，否则返回 None。"""
+        stage = self._stages[idx]
+        job.attempts += 1
+        if job.attempts >= self._max_attempts:
+            metrics.inc("stage_failures_total", stage=stage.name)
+            if self._on_failure:
+                self._on_failure(job, stage.name, e)
+            else:
+                logger.error("[%s] 处理失败 %s: %s", stage.name, job.path.name, e, exc_info=True)
+            return None
+        delay = self.backoff(job.attempts)
+        metrics.inc("stage_retries_total", stage=stage.name)
+        logger.warning(
+            "[%s] 处理失败（第 %d 次），%.1f 秒后重试 %s: %s",
+            stage.name, job.attempts, delay, job.path.name, e,
+        )
+        if self._on_retry:
+            self._on_retry(job, stage.name, e, delay)
+        self._defer(idx, job, delay)
+        return _DEFERRED
+
+    def backoff(self, attempts: int) -> float:
+        """第 attempts 次失败后的等待时间：指数增长，取上限后在 [一半, 全部] 之间随机，避免同时重试。"""
+        delay = min(self._retry_max, self._retry_base * 2 ** (attempts - 1))
+        return random.uniform(delay / 2, delay)
+
+    def _defer(self, idx: int, job: MemoJob, delay: float) -> None:
+        with self._delayed_cond:
+            heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._delayed_seq), idx, job))
+            self._delayed_cond.notify()
+
+    def _schedule_retries(self) -> None:
+        """到期的重试任务放回对应阶段的队列（从失败的阶段继续，前面阶段的结果仍在任务上）。"""
+        while not self._stop.is_set():
+            with self._delayed_cond:
+                # 最多等 1 秒，及时响应 stop()
+                if not self._delayed:
+                    self._delayed_cond.wait(1)
+                    continue
+                wait = self._delayed[0][0] - time.monotonic()
+                if wait > 0:
+                    self._delayed_cond.wait(min(wait, 1))
+                    continue
+                _, _, idx, job = heapq.heappop(self._delayed)
+            # 重试任务已在流水线内，直接入队：队列满时阻塞会卡住其余所有到期的重试
+            self._queues[idx].put(job, force=True)
+
+    def _finish(self, job: MemoJob) -> None:
+        metrics.observe("memo", time.monotonic() - job.submitted_at, path=job.path)
+        if self._on_complete:
+            try:
+                self._on_complete(job)
+            except Exception as e:
+                logger.debug("on_complete 回调异常: %s", e)
+        with self._idle:
+            self._inflight.discard(str(job.path))
+            self._idle.notify_all()
+
+    def _monitor(self) -> None:
+        """定期记录各阶段队列深度，便于观察积压情况。"""
+        last = None
+        while not self._stop.wait(DEPTH_LOG_INTERVAL):
+            depths = self.depths()
+            snapshot = (tuple(depths.values()), self.inflight)
+            if snapshot == last or not any(snapshot[0]) and not snapshot[1]:
+                last = snapshot
+                continue
+            last = snapshot
+            logger.info(
+                "队列深度: %s，处理中 %d",
+                " ".join(f"{k}={v}" for k, v in depths.items()),
+                snapshot[1],
+            )
@@ -1,12 +1,38 @@
 import os
+import re
+import abc
 import json
 import logging
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dataclasses import dataclass, field
-from typing import List, Optional
-from openai import OpenAI
+from typing import Callable, Iterator, List, Optional
+from listen_watch import clients, metrics, ratelimit
 
 logger = logging.getLogger(__name__)
 
+# 超过此 token 数（估算）的转写文本切块并行处理
+AI_CHUNK_TOKENS = int(os.getenv("AI_CHUNK_TOKENS", "1500"))
+# 同一条录音同时处理的块数
+AI_MAX_PARALLEL = int(os.getenv("AI_MAX_PARALLEL", "4"))
+# 批量整理：不超过此 token 数的短转写可以合并到一次请求，每次最多 AI_BATCH_SIZE 条
+AI_BATCH_SIZE = int(os.getenv("AI_BATCH_SIZE", "10"))
+AI_BATCH_ITEM_TOKENS = int(os.getenv("AI_BATCH_ITEM_TOKENS", "200"))
+# 对冲请求：主服务超过延迟预算（其实测 p90）仍未返回时，同时请求备用服务，先到先用
+AI_HEDGE = os.getenv("AI_HEDGE", "").lower() in ("1", "true", "yes")
+AI_HEDGE_PERCENTILE = float(os.getenv("AI_HEDGE_PERCENTILE", "90"))
+AI_HEDGE_DEFAULT_BUDGET = 20.0   # 样本不足时的预算（秒）
+AI_HEDGE_MIN_BUDGET = 2.0
+HEDGE_MIN_SAMPLES = 10
+# 进程内 AI 结果缓存条数（数据库中的 llm_cache 为第二级）
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "512"))
+# Claude 单次输出上限；cleaned_text 与原文等长，过小会被截断
+CLAUDE_MAX_TOKENS = int(os.getenv("CLAUDE_MAX_TOKENS", "8192"))
+
 SYSTEM_PROMPT = """你是一个语音备忘录整理助手。用户会给你一段语音转写的原始文本（中文为主），请完成以下任务并以 JSON 格式返回结果：
 
 1. **title**：根据内容提炼一个简短标题，10 字以内
@@ -17,6 +43,37 @@ SYSTEM_PROMPT = """你是一个语音备忘录整理助手。用户会给你一
 只返回 JSON，不要有任何多余的解释或 markdown 代码块。格式：
 {"title": "...", "summary": "...", "todos": ["...", "..."], "cleaned_text": "..."}"""
 
+# 多条短录音合并为一次请求时的提示词
+BATCH_PROMPT = """你是一个语音备忘录整理助手。用户会给你多段互相独立的短语音转写（JSON 数组，每项有 id 和 text），请逐条完成以下任务：
+
+1. **title**：根据内容提炼一个简短标题，10 字以内
+2. **summary**：1~3 句话概括核心内容
+3. **todos**：提取所有待办事项，返回字符串数组；若无待办事项则返回空数组 []
+4. **cleaned_text**：去除语气词（嗯、啊、那个、就是等）、修正口语化表达，整理为通顺的书面文字
+
+各条之间互不影响，每个 id 都必须返回一项。只返回 JSON，不要有任何多余的解释或 markdown 代码块。格式：
+{"results": [{"id": 1, "title": "...", "summary": "...", "todos": ["..."], "cleaned_text": "..."}]}"""
+
+# 长文本分块时每块的整理提示词（map）
+MAP_PROMPT = """你是一个语音备忘录整理助手。用户会给你一段较长语音转写中的一部分（中文为主），请完成以下任务并以 JSON 格式返回结果：
+
+1. **summary**：1~2 句话概括这一部分的内容
+2. **todos**：提取这一部分中的待办事项，返回字符串数组；若无则返回空数组 []
+3. **cleaned_text**：去除语气词（嗯、啊、那个、就是等）、修正口语化表达，整理为通顺的书面文字；保留行首的 [mm:ss] 时间标记
+
+只返回 JSON，不要有任何多余的解释或 markdown 代码块。格式：
+{"summary": "...", "todos": ["...", "..."], "cleaned_text": "..."}"""
+
+# 汇总各块结果的提示词（reduce）
+REDUCE_PROMPT = """你是一个语音备忘录整理助手。用户会给你一段长录音各部分的摘要和待办事项（JSON 数组，按时间顺序），请汇总并以 JSON 格式返回结果：
+
+1. **title**：根据全部内容提炼一个简短标题，10 字以内
+2. **summary**：1~3 句话概括整段录音的核心内容
+3. **todos**：合并所有待办事项，去掉重复项，返回字符串数组；若无待办事项则返回空数组 []
+
+只返回 JSON，不要有任何多余的解释或 markdown 代码块。格式：
+{"title": "...", "summary": "...", "todos": ["...", "..."]}"""
+
 
 @dataclass
 class ProcessedMemo:
@@ -28,82 +85,660 @@ class ProcessedMemo:
     memo_title: str = ""      # iOS 录音标题（如"录音 53"），由调用方填入
 
 
-class KimiProcessor:
-    BASE_URL = "https://api.moonshot.cn/v1"
+class Cancelled(Exception):
+    """请求被主动取消（对冲请求中另一方已先返回）。"""
+
+
+class CancelToken:
+    """
+    取消标记：set() 时立即关闭已登记的流式响应，阻塞在读取上的线程随之返回，
+    不必等到下一段输出才发现被取消。
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._closers: list = []
+        self._lock = threading.Lock()
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    def set(self) -> None:
+        with self._lock:
+            self._event.set()
+            closers, self._closers = self._closers, []
+        for close in closers:
+            try:
+                close()
+            except Exception as e:
+                logger.debug("关闭被取消的请求失败: %s", e)
+
+    def register(self, close: Callable[[], None]) -> Callable[[], None]:
+        """登记关闭函数（已取消时立即调用），返回注销函数。"""
+        with self._lock:
+            if not self._event.is_set():
+                self._closers.append(close)
+                return lambda: self._unregister(close)
+        close()
+        return lambda: None
+
+    def _unregister(self, close) -> None:
+        with self._lock:
+            if close in self._closers:
+                self._closers.remove(close)
+
+
+class _StreamingProcessor(abc.ABC):
+    """
+    处理器基类：子类只需实现 _stream(system, user, cancel) 逐段产出模型输出，
+    并把底层响应的 close 登记到 cancel 上。
+    短文本一次请求完成；长文本按 token 估算切块，各块并行整理（map），
+    再基于各块摘要和待办生成标题与总摘要（reduce）。
+    """
+
+    def process(self, text: str, on_partial: Optional[Callable[[dict], None]] = None,
+                cancel: Optional[CancelToken] = None) -> ProcessedMemo:
+        """
+        on_partial: 流式解析出新字段时回调，参数为目前已得到的字段 dict。
+        cancel:     置位后立即关闭进行中的流并抛出 Cancelled（对冲请求中落败的一方）。
+        """
+        chunks = split_chunks(text)
+        if len(chunks) == 1:
+            return _to_memo(self._complete(SYSTEM_PROMPT, text, on_partial, cancel))
+        return self._map_reduce(chunks, on_partial, cancel)
+
+    def cached(self, text: str) -> Optional[ProcessedMemo]:
+        """只查缓存：该文本在本服务下的全部调用都已缓存时返回结果，否则返回 None，不发请求。"""
+        def lookup(system: str, user: str) -> Optional[dict]:
+            key = _cache.key(self.NAME, self.MODEL, self.TEMPERATURE, system, user)
+            return _cache.get(key, count_miss=False)
+
+        chunks = split_chunks(text)
+        if len(chunks) == 1:
+            data = lookup(SYSTEM_PROMPT, text)
+            return _to_memo(data) if data is not None else None
+        results = [lookup(MAP_PROMPT, chunk) for chunk in chunks]
+        if any(r is None for r in results):
+            return None
+        reduced = lookup(REDUCE_PROMPT, _outline(results))
+        if reduced is None:
+            return None
+        reduced = dict(reduced, cleaned_text="\n\n".join(r.get("cleaned_text", "") for r in results))
+        return _to_memo(reduced)
+
+    def process_batch(self, texts: List[str]) -> List[Optional[ProcessedMemo]]:
+        """
+        一次请求整理多条短转写，按 id 对应回各条结果。
+        整体解析失败时抛出异常；个别条目缺失或格式不对时该位置为 None。
+        """
+        items = [{"id": i + 1, "text": t} for i, t in enumerate(texts)]
+        data = self._complete(BATCH_PROMPT, json.dumps(items, ensure_ascii=False))
+        by_id = {}
+        for item in data.get("results", []):
+            if isinstance(item, dict) and "id" in item:
+                by_id[str(item["id"])] = item
+        memos: List[Optional[ProcessedMemo]] = []
+        for i in range(len(texts)):
+            item = by_id.get(str(i + 1))
+            memos.append(_to_memo(item) if item and item.get("title") is not None else None)
+        return memos
+
+    @abc.abstractmethod
+    def _stream(self, system: str, user: str, cancel: Optional[CancelToken] = None) -> Iterator[str]:
+        """逐段产出模型输出文本。"""
+
+    def _complete(self, system: str, user: str,
+                  on_partial: Optional[Callable[[dict], None]] = None,
+                  cancel: Optional[CancelToken] = None) -> dict:
+        """流式请求，边接收边增量解析 JSON；返回完整结果。相同输入先查结果缓存。"""
+        key = _cache.key(self.NAME, self.MODEL, self.TEMPERATURE, system, user)
+        data = _cache.get(key)
+        if data is not None:
+            if on_partial:
+                on_partial(dict(data))
+            return data
+        # 只有需要部分结果时才增量解析（分块整理的 map 请求、批量请求不需要）
+        parser = IncrementalJSONParser() if on_partial else None
+        raw = []
+        # 经本服务的限流器：流结束前一直占用并发名额，首段输出的延迟用于调整限额
+        if cancel is not None and cancel.is_set():
+            raise Cancelled()
+        stream = ratelimit.get(self.NAME).stream(self._stream, system, user, cancel)
+        try:
+            for delta in stream:
+                if cancel is not None and cancel.is_set():
+                    raise Cancelled()
+                raw.append(delta)
+                if parser is not None:
+                    fields = parser.feed(delta)
+                    if fields:
+                        on_partial(fields)
+        except Exception as e:
+            # 被取消时底层连接已关闭，读取报的错统一视为取消
+            if cancel is not None and cancel.is_set() and not isinstance(e, Cancelled):
+                raise Cancelled() from e
+            raise
+        finally:
+            # 关闭生成器即关闭底层 HTTP 流
+            stream.close()
+        data = _load_json("".join(raw).strip())
+        _cache.put(key, system, self.NAME, self.MODEL, data)
+        return data
+
+    def _map_reduce(self, chunks: List[str], on_partial, cancel=None) -> ProcessedMemo:
+        logger.info("长文本分 %d 块并行处理", len(chunks))
+        results: List[Optional[dict]] = [None] * len(chunks)
+        lock = threading.Lock()
+
+        def report() -> None:
+            # 按顺序拼接已连续完成的前缀，保证部分结果的阅读顺序
+            done = []
+            for r in results:
+                if r is None:
+                    break
+                done.append(r.get("cleaned_text", ""))
+            if done:
+                on_partial({"cleaned_text": "\n\n".join(done)})
+
+        def run(idx: int) -> None:
+            results[idx] = self._complete(MAP_PROMPT, chunks[idx], cancel=cancel)
+            if on_partial:
+                with lock:
+                    report()
+
+        with ThreadPoolExecutor(max_workers=AI_MAX_PARALLEL, thread_name_prefix="ai-map") as pool:
+            for future in [pool.submit(run, i) for i in range(len(chunks))]:
+                future.result()
+
+        # 复制一份再改：_complete 可能直接返回结果缓存中的对象
+        reduced = dict(self._complete(REDUCE_PROMPT, _outline(results), on_partial, cancel))
+        reduced["cleaned_text"] = "\n\n".join(r.get("cleaned_text", "") for r in results)
+        return _to_memo(reduced)
+
+
+class KimiProcessor(_StreamingProcessor):
+    NAME = "kimi"
+    BASE_URL = os.getenv("KIMI_BASE_URL", "https://api.moonshot.cn/v1")
     MODEL = "kimi-k2-0711-preview"
+    TEMPERATURE = 0.3
 
     def __init__(self):
-        self._client = OpenAI(
-            api_key=os.getenv("KIMI_API_KEY", ""),
-            base_url=self.BASE_URL,
-        )
+        self._client = clients.openai_client(os.getenv("KIMI_API_KEY", ""), self.BASE_URL)
 
-    def process(self, text: str) -> ProcessedMemo:
-        response = self._client.chat.completions.create(
-            model=self.MODEL,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": text},
-            ],
-            temperature=0.3,
-        )
-        raw = response.choices[0].message.content.strip()
-        return _parse_response(raw)
-
-
-class DeepSeekProcessor:
-    BASE_URL = "https://api.deepseek.com/v1"
+    def _stream(self, system: str, user: str, cancel: Optional[CancelToken] = None) -> Iterator[str]:
+        yield from _openai_stream(self._client, self.MODEL, self.TEMPERATURE, system, user, cancel)
+
+
+class DeepSeekProcessor(_StreamingProcessor):
+    NAME = "deepseek"
+    BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
     MODEL = "deepseek-chat"
+    TEMPERATURE = 0.3
 
     def __init__(self):
-        self._client = OpenAI(
-            api_key=os.getenv("DEEPSEEK_API_KEY", ""),
-            base_url=self.BASE_URL,
-        )
+        self._client = clients.openai_client(os.getenv("DEEPSEEK_API_KEY", ""), self.BASE_URL)
 
-    def process(self, text: str) -> ProcessedMemo:
-        response = self._client.chat.completions.create(
-            model=self.MODEL,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": text},
-            ],
-            temperature=0.3,
-        )
-        raw = response.choices[0].message.content.strip()
-        return _parse_response(raw)
+    def _stream(self, system: str, user: str, cancel: Optional[CancelToken] = None) -> Iterator[str]:
+        yield from _openai_stream(self._client, self.MODEL, self.TEMPERATURE, system, user, cancel)
 
 
-class ClaudeProcessor:
+class ClaudeProcessor(_StreamingProcessor):
+    NAME = "claude"
     MODEL = "claude-sonnet-4-6"
+    TEMPERATURE = None   # 使用 API 默认值
 
     def __init__(self):
-        # 延迟导入，仅在使用 Claude 时才需要 anthropic 包
-        import anthropic
-        self._client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY", ""))
+        self._client = clients.anthropic_client(os.getenv("ANTHROPIC_API_KEY", ""))
 
-    def process(self, text: str) -> ProcessedMemo:
-        message = self._client.messages.create(
+    def _stream(self, system: str, user: str, cancel: Optional[CancelToken] = None) -> Iterator[str]:
+        with self._client.messages.stream(
             model=self.MODEL,
-            max_tokens=1024,
-            system=SYSTEM_PROMPT,
-            messages=[{"role": "user", "content": text}],
-        )
-        raw = message.content[0].text.strip()
-        return _parse_response(raw)
+            max_tokens=CLAUDE_MAX_TOKENS,
+            system=system,
+            messages=[{"role": "user", "content": user}],
+        ) as stream:
+            unregister = cancel.register(stream.close) if cancel else None
+            try:
+                yield from stream.text_stream
+            finally:
+                if unregister:
+                    unregister()
+
+
+def _openai_stream(client, model: str, temperature: float, system: str, user: str,
+                   cancel: Optional[CancelToken] = None) -> Iterator[str]:
+    """OpenAI 兼容接口（Kimi / DeepSeek）的流式输出。"""
+    response = client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": system},
+            {"role": "user", "content": user},
+        ],
+        temperature=temperature,
+        stream=True,
+    )
+    unregister = cancel.register(response.close) if cancel else None
+    try:
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        if unregister:
+            unregister()
+        response.close()
+
+
+def _outline(results: List[dict]) -> str:
+    """reduce 步骤的输入：各块的摘要和待办（按顺序）。"""
+    outline = [
+        {"part": i + 1, "summary": r.get("summary", ""), "todos": r.get("todos", [])}
+        for i, r in enumerate(results)
+    ]
+    return json.dumps(outline, ensure_ascii=False)
+
+
+# ── 结果缓存 ──────────────────────────────────────────────────────
+def _normalize(text: str) -> str:
+    """缓存键用的规范化：统一全角 / 半角，折叠空白。"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class _ResultCache:
+    """
+    AI 调用结果的两级缓存：进程内 LRU + 数据库 llm_cache（带 TTL 和条数上限）。
+    键包含提示词哈希，提示词变更后旧条目不再命中，首次使用时一并清理。
+    """
+
+    def __init__(self, max_memory: int = LLM_CACHE_MEMORY_ENTRIES):
+        self._memory: OrderedDict = OrderedDict()
+        self._max_memory = max_memory
+        self._lock = threading.Lock()
+        self._purged = False
+        self.hits_memory = self.hits_db = self.misses = 0
+
+    def key(self, provider: str, model: str, temperature, system: str, user: str) -> str:
+        return _sha256(json.dumps(
+            [provider, model, temperature, _sha256(system), _normalize(user)], ensure_ascii=False
+        ))
+
+    def get(self, key: str, count_miss: bool = True) -> Optional[dict]:
+        """count_miss=False 用于只探测缓存的场景，未命中时随后的正式查询会再计一次。"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits_memory += 1
+                return data
+        self._purge_stale()
+        from listen_watch import db
+        try:
+            raw = db.get_llm_cache(key)
+        except Exception as e:
+            logger.debug("读取 AI 结果缓存失败: %s", e)
+            raw = None
+        with self._lock:
+            if raw is None:
+                self.misses += count_miss
+                return None
+            self.hits_db += 1
+            data = json.loads(raw)
+            self._remember(key, data)
+            return data
+
+    def put(self, key: str, system: str, provider: str, model: str, data: dict) -> None:
+        with self._lock:
+            self._remember(key, data)
+        from listen_watch import db
+        try:
+            db.save_llm_cache(key, _sha256(system), provider, model, json.dumps(data, ensure_ascii=False))
+        except Exception as e:
+            logger.debug("写入 AI 结果缓存失败: %s", e)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits_memory + self.hits_db + self.misses
+            hits = self.hits_memory + self.hits_db
+            return {
+                "lookups": lookups,
+                "hits_memory": self.hits_memory,
+                "hits_db": self.hits_db,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else None,
+            }
+
+    def _remember(self, key: str, data: dict) -> None:
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._max_memory:
+            self._memory.popitem(last=False)
+
+    def _purge_stale(self) -> None:
+        if self._purged:
+            return
+        self._purged = True
+        from listen_watch import db
+        try:
+            removed = db.purge_llm_cache(
+                [_sha256(p) for p in (SYSTEM_PROMPT, MAP_PROMPT, REDUCE_PROMPT, BATCH_PROMPT)]
+            )
+        except Exception as e:
+            logger.debug("清理 AI 结果缓存失败: %s", e)
+            return
+        if removed:
+            logger.info("AI 结果缓存：清理提示词已变更或过期的条目 %d 条", removed)
+
+
+_cache = _ResultCache()
+metrics.register_gauge(
+    "llm_cache", lambda: {k: v for k, v in _cache.stats().items() if k != "hit_rate"}
+)
+
+
+def llm_cache_stats() -> dict:
+    """AI 结果缓存命中统计（进程启动以来）。"""
+    return _cache.stats()
+
+
+# ── 切块 ──────────────────────────────────────────────────────────
+_CJK_RE = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+# 句末标点或换行之后切分，尽量不把一句话拆到两块
+_SENTENCE_RE = re.compile(r"(?<=[。！？!?；;\n])")
 
 
-def _parse_response(raw: str) -> ProcessedMemo:
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文约每字 1 token，其余约每 4 字符 1 token。"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+def split_chunks(text: str, max_tokens: Optional[int] = None) -> List[str]:
+    """按段落 / 句子边界把文本切成不超过 max_tokens 的块；不足一块时原样返回。"""
+    max_tokens = max_tokens or AI_CHUNK_TOKENS
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for sentence in _SENTENCE_RE.split(text):
+        if not sentence:
+            continue
+        tokens = estimate_tokens(sentence)
+        if current and size + tokens > max_tokens:
+            chunks.append("".join(current).strip())
+            current, size = [], 0
+        # 超长的单句按字符硬切
+        while tokens > max_tokens:
+            cut = max(1, len(sentence) * max_tokens // tokens)
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:]
+            tokens = estimate_tokens(sentence)
+        current.append(sentence)
+        size += tokens
+    if current and "".join(current).strip():
+        chunks.append("".join(current).strip())
+    return [c for c in chunks if c]
+
+
+# ── 流式 JSON 解析 ────────────────────────────────────────────────
+_STRING_SPECIAL = re.compile(r'["\\]')
+# 未完成字段的部分结果按长度几何增长节流：至少增长该比例（且不少于最小字数）才重新拼接输出，
+# 每次拼接与字段长度成正比，总开销仍与流长度成线性
+PARTIAL_GROWTH = 0.25
+PARTIAL_MIN_GROWTH = 32
+
+
+class IncrementalJSONParser:
+    """
+    增量解析模型流式输出的 JSON 对象（只展开最外层字段）：扫描状态跨调用保留，每个字符只扫描一次。
+    字段有变化时返回当前字段 dict，否则返回 None。未完成的字符串 / 嵌套字段按长度节流给出已收到的部分，
+    完成的字段总是立即给出。
+    """
+
+    def __init__(self):
+        self._state = "start"     # start | key | colon | value | string | nested | scalar | comma | done
+        self._fields: dict = {}
+        self._key: Optional[str] = None
+        self._token: List[str] = []    # 键、嵌套值或标量值的原文
+        self._parts: List[str] = []    # 字符串值已解码的片段（输出时才拼接）
+        self._size = 0                 # 当前字符串 / 嵌套值已收到的字数
+        self._next_emit = 0            # 未完成字段下次输出部分结果的字数
+        self._escape = ""              # 字符串值中未读完的转义序列
+        self._high = ""                # 等待配对的高位代理（\uD8xx 已到、\uDCxx 未到）
+        self._in_string = False        # 嵌套值 / 键内部是否处于字符串中
+        self._backslash = False
+        self._stack: List[str] = []    # 嵌套值中未闭合括号对应的闭合符
+        self._changed = False
+
+    def feed(self, delta: str) -> Optional[dict]:
+        i = 0
+        while i < len(delta) and self._state != "done":
+            if self._state == "string" and not self._escape:
+                # 字符串值中的普通字符整段追加，只逐字处理引号和转义
+                match = _STRING_SPECIAL.search(delta, i)
+                end = match.start() if match else len(delta)
+                if end > i:
+                    self._append(delta[i:end])
+                if not match:
+                    break
+                i = end
+            self._step(delta[i])
+            i += 1
+        if self._state in ("string", "nested") and self._size >= self._next_emit:
+            self._next_emit = self._size + max(PARTIAL_MIN_GROWTH, int(self._size * PARTIAL_GROWTH))
+            if self._state == "string":
+                self._set(self._string_value())
+            else:
+                self._set(_close_json_prefix("".join(self._token), self._stack, self._in_string, self._backslash))
+        if not self._changed:
+            return None
+        self._changed = False
+        data = {k: v for k, v in self._fields.items() if v is not None}
+        return data or None
+
+    def _set(self, value) -> None:
+        self._fields[self._key] = value
+        self._changed = True
+
+    def _append(self, text: str) -> None:
+        if self._high:
+            text, self._high = self._high + text, ""
+        self._parts.append(text)
+        self._size += len(text)
+
+    def _string_value(self) -> str:
+        # 拼接后只保留一段，下次输出只需追加新片段
+        value = "".join(self._parts)
+        self._parts = [value] if value else []
+        return value
+
+    def _begin(self, state: str) -> None:
+        self._state = state
+        self._size = self._next_emit = 0
+
+    def _step(self, ch: str) -> None:
+        state = self._state
+        if state == "start":
+            # 跳过 ```json 等前缀，直到最外层的 {
+            if ch == "{":
+                self._state = "key"
+        elif state == "key":
+            if self._token:
+                self._token.append(ch)
+                if self._backslash:
+                    self._backslash = False
+                elif ch == "\\":
+                    self._backslash = True
+                elif ch == '"':
+                    self._key = json.loads("".join(self._token))
+                    self._token = []
+                    self._state = "colon"
+            elif ch == '"':
+                self._token = [ch]
+            elif ch == "}":
+                self._state = "done"
+        elif state == "colon":
+            if ch == ":":
+                self._state = "value"
+        elif state == "value":
+            if ch.isspace():
+                return
+            if ch == '"':
+                self._parts, self._escape, self._high = [], "", ""
+                self._begin("string")
+            elif ch in "{[":
+                self._token, self._stack = [ch], ["}" if ch == "{" else "]"]
+                self._in_string = self._backslash = False
+                self._begin("nested")
+                self._size = 1
+            else:
+                self._token = [ch]
+                self._state = "scalar"
+        elif state == "string":
+            self._step_string(ch)
+        elif state == "nested":
+            self._token.append(ch)
+            self._size += 1
+            if self._in_string:
+                if self._backslash:
+                    self._backslash = False
+                elif ch == "\\":
+                    self._backslash = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._stack.append("}" if ch == "{" else "]")
+            elif ch in "}]":
+                self._stack.pop()
+                if not self._stack:
+                    try:
+                        self._set(json.loads("".join(self._token)))
+                    except ValueError:
+                        pass
+                    self._token = []
+                    self._state = "comma"
+        elif state == "scalar":
+            if ch in ",}" or ch.isspace():
+                try:
+                    self._set(json.loads("".join(self._token)))
+                except ValueError:
+                    pass
+                self._token = []
+                self._state = "comma"
+                self._step(ch)
+            else:
+                self._token.append(ch)
+        elif state == "comma":
+            if ch == ",":
+                self._state = "key"
+            elif ch == "}":
+                self._state = "done"
+
+    def _step_string(self, ch: str) -> None:
+        if self._escape:
+            self._escape += ch
+            # \n 等转义两个字符，\uXXXX 六个字符
+            if self._escape[1] == "u" and len(self._escape) < 6:
+                return
+            try:
+                decoded = json.loads('"' + self._escape + '"')
+            except ValueError:
+                decoded = ""
+            self._escape = ""
+            if "\udc00" <= decoded <= "\udfff" and self._high:
+                # 代理对分两个转义到达，合并为一个字符
+                decoded = (self._high + decoded).encode("utf-16", "surrogatepass").decode("utf-16")
+                self._high = ""
+            elif "\ud800" <= decoded <= "\udbff":
+                # 高位代理先暂存，部分结果中不出现半个字符
+                if self._high:
+                    self._append("")
+                self._high = decoded
+                return
+            if decoded:
+                self._append(decoded)
+        elif ch == "\\":
+            self._escape = ch
+        elif ch == '"':
+            if self._high:
+                self._append("")
+            self._set(self._string_value())
+            self._parts = []
+            self._state = "comma"
+        else:
+            self._append(ch)
+
+
+def _close_partial_json(raw: str):
+    raw = raw.lstrip()
+    if raw.startswith("```"):
+        raw = raw.split("\n", 1)[1] if "\n" in raw else ""
+    start = raw.find("{")
+    if start < 0:
+        return None
+    raw = raw[start:]
+    stack = []
+    in_string = escape = False
+    end = len(raw)
+    for i, ch in enumerate(raw):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                end = i + 1
+                break
+    return _close_json_prefix(raw[:end], stack, in_string, escape)
+
+
+def _close_json_prefix(text: str, stack: List[str], in_string: bool, escape: bool):
+    """按扫描得到的未闭合括号补全 JSON 前缀并解析，失败返回 None。"""
+    if stack:
+        if in_string:
+            text = text[:-1] if escape else text
+            text += '"'
+        text = text.rstrip()
+        if text.endswith(","):
+            text = text[:-1]
+        elif text.endswith(":"):
+            text += "null"
+        text += "".join(reversed(stack))
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+def _load_json(raw: str) -> dict:
     """解析 AI 返回的 JSON，容忍 markdown 代码块包裹。"""
     # 去掉可能的 ```json ... ``` 包裹
     if raw.startswith("```"):
         lines = raw.splitlines()
         raw = "\n".join(lines[1:-1] if lines[-1].strip() == "```" else lines[1:])
-    data = json.loads(raw)
+    return json.loads(raw)
+
+
+def _to_memo(data: dict) -> ProcessedMemo:
+    # data 可能是结果缓存中的对象，待办列表复制一份，调用方修改 memo 不会影响缓存
     return ProcessedMemo(
         title=data.get("title", ""),
         summary=data.get("summary", ""),
-        todos=data.get("todos", []),
+        todos=list(data.get("todos") or []),
         cleaned_text=data.get("cleaned_text", ""),
     )
 
@@ -116,7 +751,7 @@ _PROVIDERS = {
 
 
 def get_processor(provider: Optional[str] = None):
-    """根据 AI_PROVIDER 环境变量返回对应的处理器实例。"""
+    """根据 AI_PROVIDER 环境变量返回对应的处理器实例（底层 SDK 客户端进程内共享）。"""
     name = (provider or os.getenv("AI_PROVIDER", "kimi")).lower()
     cls = _PROVIDERS.get(name)
     if cls is None:
@@ -125,25 +760,241 @@ def get_processor(provider: Optional[str] = None):
     return cls()
 
 
-def process(text: str) -> ProcessedMemo:
+class LatencyHistogram:
+    """
+    按服务统计处理耗时的直方图（对数分桶）。总数超过上限时各桶减半，
+    让近期样本占主导，跟随服务的延迟变化。
+    """
+    BUCKETS = (0.5, 1, 2, 3, 5, 8, 13, 20, 30, 45, 60, 90, 120, 180, float("inf"))
+    MAX_COUNT = 1000
+
+    def __init__(self):
+        self._counts = [0] * len(self.BUCKETS)
+        self._lock = threading.Lock()
+
+    @property
+    def total(self) -> int:
+        return sum(self._counts)
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    self._counts[i] += 1
+                    break
+            if sum(self._counts) > self.MAX_COUNT:
+                self._counts = [c // 2 for c in self._counts]
+
+    def percentile(self, q: float) -> Optional[float]:
+        """返回第 q 百分位所在桶的上界；无样本时返回 None。"""
+        with self._lock:
+            total = sum(self._counts)
+            if not total:
+                return None
+            threshold = total * q / 100
+            seen = 0
+            for bound, count in zip(self.BUCKETS, self._counts):
+                seen += count
+                if seen >= threshold:
+                    return bound
+        return None
+
+
+_histograms: dict = {}
+_histograms_lock = threading.Lock()
+_hedge_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _histogram(provider: str) -> LatencyHistogram:
+    with _histograms_lock:
+        return _histograms.setdefault(provider, LatencyHistogram())
+
+
+def ai_latency_percentiles() -> dict:
+    """各 AI 服务的处理耗时分位数，{provider: {"p50": 秒, "p90": 秒, "p99": 秒, "count": n}}。"""
+    with _histograms_lock:
+        items = list(_histograms.items())
+    return {
+        name: {**{f"p{q}": h.percentile(q) for q in (50, 90, 99)}, "count": h.total}
+        for name, h in items
+    }
+
+
+def hedge_budget(provider: str) -> float:
+    """对冲等待预算：该服务实测耗时的 AI_HEDGE_PERCENTILE 分位，样本不足时用默认值。"""
+    h = _histogram(provider)
+    if h.total < HEDGE_MIN_SAMPLES:
+        return AI_HEDGE_DEFAULT_BUDGET
+    budget = h.percentile(AI_HEDGE_PERCENTILE)
+    if budget is None or budget == float("inf"):
+        return AI_HEDGE_DEFAULT_BUDGET
+    return max(budget, AI_HEDGE_MIN_BUDGET)
+
+
+def _run_provider(provider: str, text: str, on_partial=None,
+                  cancel: Optional[CancelToken] = None) -> ProcessedMemo:
+    """
+    调用指定服务并记录耗时。被取消的请求按已耗时计入（实际耗时至少这么长），
+    否则慢请求总被对冲取消、从不进入统计，对冲阈值会越压越低；失败不计入。
+    """
+    started = time.monotonic()
+    try:
+        with metrics.timed("llm", detail=provider):
+            result = get_processor(provider).process(text, on_partial, cancel)
+    except Cancelled:
+        _histogram(provider).observe(time.monotonic() - started)
+        raise
+    _histogram(provider).observe(time.monotonic() - started)
+    return result
+
+
+class _LeadingPartials:
+    """
+    对冲时两个服务同时输出部分结果：只转发当前进度领先的一方（已输出字数最多），
+    领先方切换时下一次回调即给出新领先方的完整字段，调用方看到的始终是同一份结果的增长。
+    """
+
+    def __init__(self, on_partial: Callable[[dict], None]):
+        self._on_partial = on_partial
+        self._progress: dict = {}
+        self._lock = threading.Lock()
+
+    def callback(self, provider: str) -> Callable[[dict], None]:
+        def on_partial(fields: dict) -> None:
+            size = sum(len(v) if isinstance(v, str) else len(str(v)) for v in fields.values())
+            with self._lock:
+                self._progress[provider] = size
+                if size >= max(self._progress.values()):
+                    self._on_partial(fields)
+        return on_partial
+
+    def drop(self, provider: str) -> None:
+        """该服务已失败，不再参与比较。"""
+        with self._lock:
+            self._progress.pop(provider, None)
+
+
+def _get_hedge_pool() -> ThreadPoolExecutor:
+    global _hedge_pool
+    with _histograms_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="ai-hedge")
+        return _hedge_pool
+
+
+def _process_hedged(text: str, primary: str, fallback: str, on_partial) -> ProcessedMemo:
+    """
+    对冲执行：先请求主服务，超过预算仍未返回则同时请求备用服务，取先成功的结果并取消另一方。
+    主服务在预算内失败时立即切换到备用服务。
+    """
+    pool = _get_hedge_pool()
+    cancels = {primary: CancelToken(), fallback: CancelToken()}
+    partials = _LeadingPartials(on_partial) if on_partial else None
+
+    def start(name: str):
+        callback = partials.callback(name) if partials else None
+        return pool.submit(_run_provider, name, text, callback, cancels[name])
+
+    budget = hedge_budget(primary)
+    logger.info("AI 处理中（%s，对冲预算 %.1fs）...", primary, budget)
+    futures = {start(primary): primary}
+    done, _ = wait(futures, timeout=budget)
+    if not done:
+        logger.info("主服务 %s 超过 %.1fs 未返回，同时请求备用服务 %s", primary, budget, fallback)
+        futures[start(fallback)] = fallback
+
+    pending = set(futures)
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.warning("AI 服务 %s 失败: %s", name, e)
+                if partials:
+                    partials.drop(name)
+                error = e
+                continue
+            # 立即关闭落败方的连接，释放对冲线程和限流名额
+            for other in pending:
+                cancels[futures[other]].set()
+            suffix = "" if name == primary else f"（备用 {name}）"
+            logger.info("AI 处理完成%s：%s", suffix, result.title)
+            return result
+        if not pending and fallback not in futures.values():
+            # 主服务在预算内就失败了，直接切换
+            logger.warning("主服务 %s 失败，切换到备用服务 %s", primary, fallback)
+            future = start(fallback)
+            futures[future] = fallback
+            pending = {future}
+    raise error
+
+
+def batchable(text: str) -> bool:
+    """短到可以和其他录音合并整理的转写文本。"""
+    return AI_BATCH_SIZE > 1 and estimate_tokens(text) <= AI_BATCH_ITEM_TOKENS
+
+
+def process_batch(texts: List[str]) -> List[ProcessedMemo]:
+    """
+    批量入口：短文本按 AI_BATCH_SIZE 分组，每组一次请求；
+    整组失败或某条结果缺失时，对应文本改为逐条调用 process()（含备用服务切换）。
+    """
+    primary = os.getenv("AI_PROVIDER", "kimi")
+    processor = get_processor(primary)
+    results: List[Optional[ProcessedMemo]] = [processor.cached(t) for t in texts]
+    todo = [i for i, memo in enumerate(results) if memo is None]
+    for start in range(0, len(todo), AI_BATCH_SIZE):
+        group = todo[start:start + AI_BATCH_SIZE]
+        if len(group) == 1:
+            continue
+        try:
+            logger.info("AI 批量处理 %d 条（%s）...", len(group), primary)
+            memos = processor.process_batch([texts[i] for i in group])
+        except Exception as e:
+            logger.warning("批量处理失败（%s），改为逐条处理", e)
+            continue
+        for i, memo in zip(group, memos):
+            results[i] = memo
+    missing = [i for i, memo in enumerate(results) if memo is None]
+    if missing and len(missing) < len(todo):
+        logger.info("批量结果缺失 %d 条，逐条补处理", len(missing))
+    for i in missing:
+        results[i] = process(texts[i])
+    return results
+
+
+def process(text: str, on_partial: Optional[Callable[[dict], None]] = None) -> ProcessedMemo:
     """
     主入口：读取 AI_PROVIDER 配置，调用对应服务处理转写文本。
-    主服务失败时自动切换到 AI_FALLBACK_PROVIDER。
+    主服务失败时自动切换到 AI_FALLBACK_PROVIDER；开启 AI_HEDGE 时主服务慢于预算即同时请求备用服务。
+    on_partial: 流式输出中解析出新字段时回调（标题、摘要等可提前拿到）。
     """
     primary = os.getenv("AI_PROVIDER", "kimi")
     fallback = os.getenv("AI_FALLBACK_PROVIDER", "")
 
+    for name in filter(None, (primary, fallback)):
+        cached = get_processor(name).cached(text)
+        if cached is not None:
+            logger.info("使用 AI 结果缓存（%s）：%s", name, cached.title)
+            if on_partial:
+                on_partial({"title": cached.title, "summary": cached.summary})
+            return cached
+
+    if AI_HEDGE and fallback and fallback != primary:
+        return _process_hedged(text, primary, fallback, on_partial)
+
     try:
-        processor = get_processor(primary)
         logger.info("AI 处理中（%s）...", primary)
-        result = processor.process(text)
+        result = _run_provider(primary, text, on_partial)
         logger.info("AI 处理完成：%s", result.title)
         return result
     except Exception as e:
         if not fallback or fallback == primary:
             raise
         logger.warning("主服务 %s 失败（%s），切换到备用服务 %s", primary, e, fallback)
-        processor = get_processor(fallback)
-        result = processor.process(text)
+        result = _run_provider(fallback, text, on_partial)
         logger.info("AI 处理完成（备用 %s）：%s", fallback, result.title)
         return result
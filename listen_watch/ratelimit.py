@@ -0,0 +1,357 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from listen_watch import metrics
+
+logger = logging.getLogger(__name__)
+
+# 各服务的默认限额：(每秒请求数, 突发请求数, 最大并发)
+DEFAULT_LIMITS: Dict[str, Tuple[float, int, int]] = {
+    "doubao": (20, 40, 32),
+    "oss": (20, 40, 16),
+    "kimi": (3, 6, 8),
+    "deepseek": (10, 20, 16),
+    "claude": (1, 4, 4),
+}
+FALLBACK_LIMIT = (10, 20, 8)
+# 覆盖默认限额，格式 "服务=每秒请求数/最大并发"，逗号分隔，如 "kimi=5/10,claude=2/4"；
+# 两项都必须大于 0，无法解析或不大于 0 的条目忽略（该服务保留默认值）
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+
+# 按 429 和延迟自适应调整（AIMD）：被限流时并发和速率减半，成功一次并发加回 1/并发，速率加回上限的 5%
+THROTTLE_DECREASE = 0.5
+RATE_RECOVERY = 0.05
+# 延迟（流式接口为首段输出的延迟）的滑动均值超过基线的该倍数视为拥塞，并发下调 10%
+LATENCY_TOLERANCE = 2.0
+LATENCY_DECREASE = 0.9
+LATENCY_EWMA_ALPHA = 0.2
+# 限流错误：未给出 Retry-After 时暂停的秒数，以及同一请求因限流自动重试的次数
+THROTTLE_STATUSES = {429, 503}
+DEFAULT_RETRY_AFTER = 1.0
+THROTTLE_RETRIES = 3
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """
+    限流类错误（HTTP 429 / 503）返回应等待的秒数：优先取 Retry-After 头，缺省 DEFAULT_RETRY_AFTER；
+    其他错误返回 None。兼容 httpx、openai / anthropic SDK 和 oss2 的异常。
+    """
+    response = getattr(error, "response", None)
+    status = (
+        getattr(error, "status_code", None)
+        or getattr(error, "status", None)
+        or getattr(response, "status_code", None)
+    )
+    if status not in THROTTLE_STATUSES:
+        return None
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None) or {}
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    if not value:
+        return DEFAULT_RETRY_AFTER
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class _Call:
+    """一次受限调用的计时：mark() 记下首段输出时间，未调用时以整个调用耗时为准。"""
+
+    def __init__(self, track_latency: bool):
+        self.track_latency = track_latency
+        self.started = time.monotonic()
+        self.first = None
+
+    def mark(self) -> None:
+        if self.first is None:
+            self.first = time.monotonic()
+
+    @property
+    def latency(self) -> Optional[float]:
+        if not self.track_latency:
+            return None
+        return (self.first or time.monotonic()) - self.started
+
+
+class Limiter:
+    """
+    单个服务的限流器：令牌桶控制请求速率，信号量控制同时在途的请求数。
+    两者都按反馈自适应：429 / 503 时减半并按 Retry-After 暂停发送，成功时逐步加回上限；
+    延迟明显高于基线时小幅降低并发，在不触发限流的前提下尽量保持最高吞吐。
+    线程和事件循环（asr-loop）中都可使用：slot() / call() 为同步版本，aslot() / acall() 为异步版本。
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, concurrency: int):
+        self.name = name
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.max_limit = concurrency
+        self.limit = float(concurrency)
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._inflight = 0
+        self._waiters = deque()
+        self._ewma: Optional[float] = None
+        self._baseline: Optional[float] = None
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    # ── 令牌桶 ────────────────────────────────────────────────────
+    def _reserve(self) -> float:
+        """预取一个令牌，返回需要等待的秒数（含 Retry-After 暂停）。"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._paused_until - now)
+
+    # ── 并发名额 ──────────────────────────────────────────────────
+    def _capacity(self) -> int:
+        return max(1, int(self.limit))
+
+    def _try_acquire(self, waiter) -> bool:
+        """有空余名额且无人排队时直接占用；否则登记 waiter，名额释放时由 _wake 转交。"""
+        with self._lock:
+            if self._inflight < self._capacity() and not self._waiters:
+                self._inflight += 1
+                return True
+            self._waiters.append(waiter)
+            return False
+
+    def _release(self) -> None:
+        with self._lock:
+            self._inflight -= 1
+            self._wake()
+
+    def _wake(self) -> None:
+        """按排队顺序转交空出的名额（调用方持有 _lock）。"""
+        while self._waiters and self._inflight < self._capacity():
+            waiter = self._waiters.popleft()
+            self._inflight += 1
+            waiter()
+
+    def _acquire(self) -> None:
+        event = threading.Event()
+        if not self._try_acquire(event.set):
+            event.wait()
+
+    async def _aacquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def waiter():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        if self._try_acquire(waiter):
+            return
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise
+            self._release()   # 取消时名额已转交过来，归还
+            raise
+
+    # ── 反馈 ──────────────────────────────────────────────────────
+    def _cooldown(self) -> float:
+        """两次下调之间至少间隔一个典型请求耗时，同一批请求的多个 429 只算一次。"""
+        return max(1.0, self._ewma or 0.0)
+
+    def _succeeded(self, latency: Optional[float]) -> None:
+        with self._lock:
+            now = time.monotonic()
+            congested = False
+            if latency is not None:
+                self._ewma = latency if self._ewma is None else (
+                    LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * self._ewma
+                )
+                # 基线取滑动均值的最小值，并缓慢上浮，避免一次偶然的低延迟长期压低基线
+                self._baseline = self._ewma if self._baseline is None else min(self._ewma, self._baseline * 1.01)
+                congested = self._ewma > self._baseline * LATENCY_TOLERANCE
+            if congested:
+                if now - self._last_decrease >= self._cooldown() and self.limit > 1:
+                    self.limit = max(1.0, self.limit * LATENCY_DECREASE)
+                    self._last_decrease = now
+                    logger.debug("%s 延迟升高（%.2fs，基线 %.2fs），并发降至 %.1f",
+                                 self.name, self._ewma, self._baseline, self.limit)
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+                self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_RECOVERY)
+            self._wake()
+
+    def _throttled(self, wait: float) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + wait)
+            decreased = now - self._last_decrease >= self._cooldown()
+            if decreased:
+                self.limit = max(1.0, self.limit * THROTTLE_DECREASE)
+                self.rate = max(self.max_rate * RATE_RECOVERY, self.rate * THROTTLE_DECREASE)
+                self._last_decrease = now
+        metrics.inc("rate_limited_total", endpoint=self.name)
+        if decreased:
+            logger.warning(
+                "%s 触发限流，暂停 %.1fs，并发降至 %.1f、速率降至 %.1f/s",
+                self.name, wait, self.limit, self.rate,
+            )
+
+    def _failed(self, error: BaseException) -> None:
+        wait = retry_after(error)
+        if wait is not None:
+            self._throttled(wait)
+
+    # ── 使用方式 ──────────────────────────────────────────────────
+    @contextmanager
+    def slot(self, track_latency: bool = True) -> Iterator[_Call]:
+        """
+        占用一个并发名额并等待令牌，退出时按结果调整限额：
+            with ratelimit.get("oss").slot(track_latency=False):
+                bucket.put_object_from_file(...)
+        track_latency=False 用于耗时取决于数据量的请求（如上传），不参与延迟判断。
+        """
+        self._acquire()
+        try:
+            wait = self._reserve()
+            if wait > 0:
+                time.sleep(wait)
+            call = _Call(track_latency)
+            try:
+                yield call
+            except BaseException as e:
+                self._failed(e)
+                raise
+            self._succeeded(call.latency)
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def aslot(self, track_latency: bool = True):
+        """slot() 的异步版本，等待期间不阻塞事件循环。"""
+        await self._aacquire()
+        try:
+            wait = self._reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            call = _Call(track_latency)
+            try:
+                yield call
+            except BaseException as e:
+                self._failed(e)
+                raise
+            self._succeeded(call.latency)
+        finally:
+            self._release()
+
+    def call(self, fn: Callable, *args, track_latency: bool = True, **kwargs):
+        """在限流下执行 fn，被限流时按 Retry-After 等待后重试（最多 THROTTLE_RETRIES 次）。"""
+        for attempt in range(1, THROTTLE_RETRIES + 1):
+            try:
+                with self.slot(track_latency):
+                    return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt == THROTTLE_RETRIES or retry_after(e) is None:
+                    raise
+                logger.info("%s 被限流，稍后重试（第 %d 次）: %s", self.name, attempt, e)
+
+    async def acall(self, fn: Callable, *args, track_latency: bool = True, **kwargs):
+        """call() 的异步版本，fn 返回协程。"""
+        for attempt in range(1, THROTTLE_RETRIES + 1):
+            try:
+                async with self.aslot(track_latency):
+                    return await fn(*args, **kwargs)
+            except Exception as e:
+                if attempt == THROTTLE_RETRIES or retry_after(e) is None:
+                    raise
+                logger.info("%s 被限流，稍后重试（第 %d 次）: %s", self.name, attempt, e)
+
+    def stream(self, fn: Callable[..., Iterator], *args) -> Iterator:
+        """
+        流式接口：占用并发名额直到迭代结束，首个元素的延迟计入延迟统计。
+        尚未产出任何元素时被限流会自动重试；已开始输出后出错直接抛出。
+        """
+        for attempt in range(1, THROTTLE_RETRIES + 1):
+            started = False
+            try:
+                with self.slot() as call:
+                    for item in fn(*args):
+                        call.mark()
+                        started = True
+                        yield item
+                return
+            except Exception as e:
+                if started or attempt == THROTTLE_RETRIES or retry_after(e) is None:
+                    raise
+                logger.info("%s 被限流，稍后重试（第 %d 次）: %s", self.name, attempt, e)
+
+    def state(self) -> dict:
+        with self._lock:
+            return {
+                "concurrency": round(self.limit, 2),
+                "rate": round(self.rate, 2),
+                "inflight": self._inflight,
+                "waiting": len(self._waiters),
+            }
+
+
+_limiters: Dict[str, Limiter] = {}
+_lock = threading.Lock()
+
+
+def _configured_limits() -> Dict[str, Tuple[float, int, int]]:
+    limits = dict(DEFAULT_LIMITS)
+    for item in filter(None, (s.strip() for s in RATE_LIMITS.split(","))):
+        try:
+            name, spec = item.split("=", 1)
+            rate, concurrency = spec.split("/", 1)
+            rate, concurrency = float(rate), int(concurrency)
+        except ValueError:
+            logger.warning("RATE_LIMITS 配置无法解析，已忽略: %s", item)
+            continue
+        if not (rate > 0 and concurrency > 0):
+            # 速率为 0 时令牌桶永远等不到令牌，不接受；需要限制时配置一个小的正数
+            logger.warning("RATE_LIMITS 中的速率和并发必须大于 0，已忽略: %s", item)
+            continue
+        limits[name.strip()] = (rate, max(1, int(rate * 2)), concurrency)
+    return limits
+
+
+def get(name: str) -> Limiter:
+    """按服务名返回进程内共享的限流器。"""
+    limiter = _limiters.get(name)
+    if limiter is not None:
+        return limiter
+    with _lock:
+        if name not in _limiters:
+            rate, burst, concurrency = _configured_limits().get(name, FALLBACK_LIMIT)
+            _limiters[name] = Limiter(name, rate, burst, concurrency)
+        return _limiters[name]
+
+
+def states() -> Dict[str, dict]:
+    """各服务当前的限额和在途请求数。"""
+    with _lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.state() for limiter in limiters}
+
+
+metrics.register_gauge("rate_limit_concurrency", lambda: {n: s["concurrency"] for n, s in states().items()})
+metrics.register_gauge("rate_limit_rps", lambda: {n: s["rate"] for n, s in states().items()})
+metrics.register_gauge("rate_limit_inflight", lambda: {n: s["inflight"] for n, s in states().items()})
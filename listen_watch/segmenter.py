@@ -0,0 +1,169 @@
+import os
+import re
+import shutil
+import asyncio
+import logging
+import tempfile
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 超过此时长（秒）的录音按静音切段并行转写
+SEGMENT_THRESHOLD_SECONDS = float(os.getenv("SEGMENT_THRESHOLD_SECONDS", "300"))
+# 目标段长与最大段长（秒）：在目标段长附近找静音切开，找不到时在最大段长处硬切
+SEGMENT_TARGET_SECONDS = float(os.getenv("SEGMENT_TARGET_SECONDS", "120"))
+SEGMENT_MAX_SECONDS = float(os.getenv("SEGMENT_MAX_SECONDS", "180"))
+# 同一录音同时转写的段数
+SEGMENT_CONCURRENCY = int(os.getenv("SEGMENT_CONCURRENCY", "4"))
+
+# ffmpeg silencedetect 参数：低于该音量且持续超过该时长视为静音
+SILENCE_NOISE_DB = -30
+SILENCE_MIN_DURATION = 0.4
+
+_SILENCE_RE = re.compile(r"silence_(start|end): (-?[\d.]+)")
+
+
+@dataclass
+class Segment:
+    index: int
+    start: float   # 秒
+    end: float
+
+    @property
+    def key(self) -> Tuple[int, int]:
+        """缓存键：毫秒精度的起止时间，切分方案变化时自然失效。"""
+        return int(self.start * 1000), int(self.end * 1000)
+
+
+def segmentation_available() -> bool:
+    """分段转写依赖 ffmpeg 切分音频。"""
+    return shutil.which("ffmpeg") is not None
+
+
+def should_segment(duration: Optional[float]) -> bool:
+    return (
+        duration is not None
+        and duration > SEGMENT_THRESHOLD_SECONDS
+        and segmentation_available()
+    )
+
+
+def detect_silences(path: Path) -> List[Tuple[float, float]]:
+    """用 ffmpeg silencedetect 找出静音区间 [(起, 止)]，只解码不输出，长录音也只需几秒。"""
+    result = subprocess.run(
+        [
+            "ffmpeg", "-hide_banner", "-nostats", "-i", str(path), "-vn",
+            "-af", f"silencedetect=noise={SILENCE_NOISE_DB}dB:d={SILENCE_MIN_DURATION}",
+            "-f", "null", "-",
+        ],
+        capture_output=True, text=True, check=True,
+    )
+    silences = []
+    start = None
+    for kind, value in _SILENCE_RE.findall(result.stderr):
+        if kind == "start":
+            start = max(float(value), 0.0)
+        elif start is not None:
+            silences.append((start, float(value)))
+            start = None
+    return silences
+
+
+def plan_segments(duration: float, silences: List[Tuple[float, float]],
+                  target: float = SEGMENT_TARGET_SECONDS,
+                  max_len: float = SEGMENT_MAX_SECONDS) -> List[Segment]:
+    """
+    贪心切分：从当前位置出发，在 [target/2, max_len] 窗口内选最接近 target 的静音中点切开；
+    窗口内没有静音时在 max_len 处硬切。剩余不足一个窗口时整体作为最后一段。
+    """
+    cuts = [(s + e) / 2 for s, e in silences]
+    segments = []
+    cursor = 0.0
+    while duration - cursor > max_len:
+        window = [c for c in cuts if cursor + target / 2 <= c <= cursor + max_len]
+        cut = min(window, key=lambda c: abs(c - cursor - target)) if window else cursor + max_len
+        segments.append(Segment(len(segments), cursor, cut))
+        cursor = cut
+    segments.append(Segment(len(segments), cursor, duration))
+    return segments
+
+
+def cut_segment(path: Path, segment: Segment, out_dir: Path) -> Path:
+    """按时间截取一段（直接复制 AAC 流，不重新编码）。"""
+    out = out_dir / f"{path.stem}.{segment.index:03d}{path.suffix}"
+    subprocess.run(
+        [
+            "ffmpeg", "-v", "error", "-y",
+            "-ss", f"{segment.start:.3f}", "-t", f"{segment.end - segment.start:.3f}",
+            "-i", str(path), "-vn", "-c", "copy", str(out),
+        ],
+        capture_output=True, check=True,
+    )
+    return out
+
+
+def _format_ts(seconds: float, with_hours: bool) -> str:
+    minutes, sec = divmod(int(seconds), 60)
+    if with_hours:
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours:02d}:{minutes:02d}:{sec:02d}"
+    return f"{minutes:02d}:{sec:02d}"
+
+
+def stitch(segments: List[Segment], texts: dict) -> str:
+    """按时间顺序拼接各段文本，每段前标注起始时间。"""
+    with_hours = segments[-1].end >= 3600
+    parts = []
+    for seg in segments:
+        text = texts[seg.key].strip()
+        if text:
+            parts.append(f"[{_format_ts(seg.start, with_hours)}] {text}")
+    return "\n\n".join(parts)
+
+
+async def transcribe_segmented(path: Path, duration: float, audio_hash: str,
+                               transcribe: Callable[[Path, Optional[float]], Awaitable[str]]) -> str:
+    """
+    长录音分段转写（协程，在转写事件循环中执行）：按静音切段 → 并发转写各段 → 按顺序拼接。
+    切段和数据库读写放到线程池，等待转写结果不占用线程。
+    每段完成即写入 segment_cache；有段失败时抛出异常，重试只转写缺失的段。
+    """
+    from listen_watch import db
+
+    silences = await asyncio.to_thread(detect_silences, path)
+    segments = plan_segments(duration, silences)
+    cached = await asyncio.to_thread(db.get_segment_transcriptions, audio_hash)
+    texts = {key: text for key, text in cached.items() if key in {seg.key for seg in segments}}
+    missing = [seg for seg in segments if seg.key not in texts]
+    logger.info(
+        "长录音分段转写: %s，共 %d 段（已缓存 %d 段）",
+        path.name, len(segments), len(segments) - len(missing),
+    )
+
+    if missing:
+        semaphore = asyncio.Semaphore(SEGMENT_CONCURRENCY)
+        with tempfile.TemporaryDirectory(prefix="listen_watch_seg_") as tmp:
+            async def run(seg: Segment) -> None:
+                async with semaphore:
+                    seg_path = await asyncio.to_thread(cut_segment, path, seg, Path(tmp))
+                    text = await transcribe(seg_path, seg.end - seg.start)
+                texts[seg.key] = text
+                await asyncio.to_thread(db.save_segment_transcription, audio_hash, *seg.key, text)
+
+            results = await asyncio.gather(*(run(seg) for seg in missing), return_exceptions=True)
+        errors = []
+        for seg, result in zip(missing, results):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            if isinstance(result, BaseException):
+                logger.warning("第 %d 段转写失败（%.0fs-%.0fs）: %s", seg.index + 1, seg.start, seg.end, result)
+                errors.append(result)
+        if errors:
+            raise RuntimeError(
+                f"{len(errors)}/{len(segments)} 段转写失败，已完成的段已缓存: {errors[0]}"
+            ) from errors[0]
+
+    return stitch(segments, texts)
@@ -1,10 +1,19 @@
 import os
+import abc
 import uuid
+import hashlib
 import time
+import asyncio
 import logging
-import requests
-import oss2
+import threading
+import concurrent.futures
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Awaitable, Callable, List, Optional
+
+import httpx
+
+from listen_watch import clients, metrics, ratelimit
 
 logger = logging.getLogger(__name__)
 
@@ -13,14 +22,32 @@ VOLCENGINE_APP_ID = os.getenv("VOLCENGINE_APP_ID", "")
 VOLCENGINE_API_KEY = os.getenv("VOLCENGINE_API_KEY", "")
 VOLCENGINE_RESOURCE_ID = os.getenv("VOLCENGINE_RESOURCE_ID", "volc.bigasr.auc")
 
-SUBMIT_URL = "https://openspeech.bytedance.com/api/v3/auc/bigmodel/submit"
-QUERY_URL = "https://openspeech.bytedance.com/api/v3/auc/bigmodel/query"
+# 接口地址可改为本地模拟服务（python -m listen_watch.fake_services）
+VOLCENGINE_ASR_URL = os.getenv(
+    "VOLCENGINE_ASR_URL", "https://openspeech.bytedance.com/api/v3/auc/bigmodel"
+).rstrip("/")
+SUBMIT_URL = f"{VOLCENGINE_ASR_URL}/submit"
+QUERY_URL = f"{VOLCENGINE_ASR_URL}/query"
 
 CODE_SUCCESS = 20000000
 CODE_PROCESSING = 20000001
 
-POLL_INTERVAL = 3    # 轮询间隔（秒）
-POLL_MAX_WAIT = 300  # 最长等待时间（秒）
+# 轮询节奏按任务估算：首次查询放在预计耗时的一部分处，之后按倍数退避
+POLL_FIRST_PROBE = 0.5     # 首次查询时刻 = 预计耗时 × 该比例（早于预计，拟合才能向下修正）
+POLL_MIN_INTERVAL = 1      # 首次查询后的最短间隔（秒）
+POLL_MAX_INTERVAL = 15     # 退避后的最长间隔（秒）
+POLL_BACKOFF = 1.5
+POLL_MIN_WAIT = 300        # 超时下限（秒），长录音按预计耗时放大
+POLL_WAIT_FACTOR = 4       # 超时 = max(POLL_MIN_WAIT, 预计耗时 × 该倍数)
+
+# 没有历史数据时的转写耗时估算：固定开销 + 每秒音频耗时
+DEFAULT_ASR_OVERHEAD = 2.0
+DEFAULT_ASR_RATE = 0.1
+LATENCY_MIN_SAMPLES = 5      # 样本少于此数时使用默认估算
+LATENCY_WINDOW = 200         # 只用最近的样本拟合
+
+# 同时在途的转写任务上限（上传 + 提交 + 等待结果）
+ASR_MAX_CONCURRENCY = int(os.getenv("ASR_MAX_CONCURRENCY", "16"))
 
 # --- 阿里云 OSS 配置 ---
 OSS_ACCESS_KEY_ID = os.getenv("OSS_ACCESS_KEY_ID", "")
@@ -28,30 +55,80 @@ OSS_ACCESS_KEY_SECRET = os.getenv("OSS_ACCESS_KEY_SECRET", "")
 OSS_BUCKET_NAME = os.getenv("OSS_BUCKET_NAME", "")
 OSS_ENDPOINT = os.getenv("OSS_ENDPOINT", "")
 OSS_TEMP_PREFIX = os.getenv("OSS_TEMP_PREFIX", "listen_watch_tmp/")
+# Endpoint 为自定义域名（或本地模拟服务）时设为 true，按 endpoint/key 访问
+OSS_IS_CNAME = os.getenv("OSS_IS_CNAME", "").lower() in ("1", "true", "yes")
 
 # 签名 URL 有效期（秒），足够豆包服务器下载即可
 OSS_URL_EXPIRES = 3600
 
+# 超过此大小的文件走分片上传：分片并行发送，断点记录在本地，重试时续传
+OSS_MULTIPART_THRESHOLD = int(float(os.getenv("OSS_MULTIPART_THRESHOLD_MB", "8")) * 1024 * 1024)
+OSS_PART_SIZE = int(float(os.getenv("OSS_PART_SIZE_MB", "2")) * 1024 * 1024)
+OSS_UPLOAD_THREADS = int(os.getenv("OSS_UPLOAD_THREADS", "4"))
+OSS_CHECKPOINT_DIR = Path.home() / ".listen_watch" / "oss_checkpoints"
+
+# --- 转写引擎选择 ---
+# doubao：豆包 + OSS；whisper：本地 CPU 转写；auto：按录音时长估算哪个更快
+TRANSCRIBE_BACKEND = os.getenv("TRANSCRIBE_BACKEND", "doubao").lower()
+
+# --- 本地 Whisper 配置 ---
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "small")
+WHISPER_WORKERS = int(os.getenv("WHISPER_WORKERS", "1"))
+# 每秒音频的本地转写耗时（秒），无实测数据时用于估算
+WHISPER_DEFAULT_RTF = float(os.getenv("WHISPER_RTF", "0.5"))
+WHISPER_INITIAL_PROMPT = "以下是普通话的句子，使用简体中文和标点符号。"
+
 
-def _oss_bucket() -> oss2.Bucket:
-    auth = oss2.Auth(OSS_ACCESS_KEY_ID, OSS_ACCESS_KEY_SECRET)
-    return oss2.Bucket(auth, OSS_ENDPOINT, OSS_BUCKET_NAME)
+def _oss_bucket():
+    return clients.oss_bucket(
+        OSS_ACCESS_KEY_ID, OSS_ACCESS_KEY_SECRET, OSS_ENDPOINT, OSS_BUCKET_NAME, is_cname=OSS_IS_CNAME
+    )
+
+
+def _resumable_key(path: Path, stat: os.stat_result) -> str:
+    """大文件使用由路径、大小、修改时间决定的固定 key，重试时才能找回断点。"""
+    ident = f"{path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+    return f"{OSS_TEMP_PREFIX}{hashlib.sha1(ident.encode()).hexdigest()}{path.suffix}"
 
 
 def _upload_to_oss(path: Path) -> tuple[str, str]:
-    """上传文件到 OSS，返回 (oss_key, 签名URL)。"""
-    oss_key = f"{OSS_TEMP_PREFIX}{uuid.uuid4().hex}{path.suffix}"
+    """上传文件到 OSS，返回 (oss_key, 签名URL)。大文件分片并行上传并支持断点续传。"""
+    import oss2
+
+    stat = path.stat()
     bucket = _oss_bucket()
-    bucket.put_object_from_file(oss_key, str(path))
+    limiter = ratelimit.get("oss")
+    started = time.monotonic()
+    # 上传耗时取决于文件大小，不参与限流器的延迟判断
+    if stat.st_size >= OSS_MULTIPART_THRESHOLD:
+        oss_key = _resumable_key(path, stat)
+        OSS_CHECKPOINT_DIR.mkdir(parents=True, exist_ok=True)
+        limiter.call(
+            oss2.resumable_upload,
+            bucket, oss_key, str(path),
+            store=oss2.ResumableStore(root=str(OSS_CHECKPOINT_DIR.parent), dir=OSS_CHECKPOINT_DIR.name),
+            multipart_threshold=OSS_MULTIPART_THRESHOLD,
+            part_size=OSS_PART_SIZE,
+            num_threads=OSS_UPLOAD_THREADS,
+            track_latency=False,
+        )
+    else:
+        oss_key = f"{OSS_TEMP_PREFIX}{uuid.uuid4().hex}{path.suffix}"
+        limiter.call(bucket.put_object_from_file, oss_key, str(path), track_latency=False)
+    elapsed = max(time.monotonic() - started, 1e-6)
+    metrics.observe("oss_upload", elapsed, path=path, nbytes=stat.st_size)
     signed_url = bucket.sign_url("GET", oss_key, OSS_URL_EXPIRES)
-    logger.debug("OSS 上传完成: %s", oss_key)
+    logger.info(
+        "OSS 上传完成: %s (%.1f MB, %.1fs, %.2f MB/s)",
+        oss_key, stat.st_size / 1024 / 1024, elapsed, stat.st_size / 1024 / 1024 / elapsed,
+    )
     return oss_key, signed_url
 
 
 def _delete_from_oss(oss_key: str) -> None:
     """删除 OSS 临时文件，失败仅记录警告不抛出。"""
     try:
-        _oss_bucket().delete_object(oss_key)
+        ratelimit.get("oss").call(_oss_bucket().delete_object, oss_key)
         logger.debug("OSS 临时文件已删除: %s", oss_key)
     except Exception as e:
         logger.warning("删除 OSS 临时文件失败 %s: %s", oss_key, e)
@@ -68,9 +145,8 @@ def _make_headers(request_id: str) -> dict:
     }
 
 
-def _submit(audio_url: str, request_id: str) -> None:
-    """提交转写任务。"""
-    payload = {
+def _submit_payload(audio_url: str) -> dict:
+    return {
         "user": {"uid": "listen_watch"},
         "audio": {
             "url": audio_url,
@@ -82,9 +158,9 @@ def _submit(audio_url: str, request_id: str) -> None:
             "enable_punc": True,
         },
     }
-    resp = requests.post(SUBMIT_URL, json=payload, headers=_make_headers(request_id), timeout=30)
-    resp.raise_for_status()
-    data = resp.json()
+
+
+def _check_submit(data: dict) -> None:
     # 豆包 submit 接口正常返回空 {}，有 resp.code 时才检查错误
     if data:
         code = int(data.get("resp", {}).get("code", CODE_SUCCESS))
@@ -92,45 +168,457 @@ def _submit(audio_url: str, request_id: str) -> None:
             raise RuntimeError(f"提交转写任务失败: {data}")
 
 
-def _poll(request_id: str) -> str:
-    """轮询直到转写完成，返回转写文本。"""
-    headers = _make_headers(request_id)
-    waited = 0
-    while waited < POLL_MAX_WAIT:
-        time.sleep(POLL_INTERVAL)
-        waited += POLL_INTERVAL
-        resp = requests.post(QUERY_URL, json={}, headers=headers, timeout=30)
-        resp.raise_for_status()
-        data = resp.json()
-        # result.text 存在即转写完成
-        if data.get("result", {}).get("text") is not None:
-            return data["result"]["text"]
-        code = int(data.get("resp", {}).get("code", CODE_PROCESSING))
-        if code == CODE_PROCESSING:
-            logger.debug("转写进行中... (%ds)", waited)
-            continue
-        raise RuntimeError(f"转写失败: {data}")
-    raise TimeoutError(f"转写超时（>{POLL_MAX_WAIT}s）")
-
-
-def transcribe(path: Path) -> str:
+def _parse_query(data: dict) -> Optional[str]:
+    """解析查询结果：完成返回转写文本，处理中返回 None，失败抛出异常。"""
+    # result.text 存在即转写完成
+    if data.get("result", {}).get("text") is not None:
+        return data["result"]["text"]
+    code = int(data.get("resp", {}).get("code", CODE_PROCESSING))
+    if code == CODE_PROCESSING:
+        return None
+    raise RuntimeError(f"转写失败: {data}")
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+class _LatencyModel:
     """
-    主入口：上传音频到 OSS → 提交豆包转写 → 轮询结果 → 删除 OSS 临时文件。
-    返回转写文本，失败时抛出异常。
+    转写耗时模型：turnaround ≈ overhead + rate × 音频时长。
+    用数据库中最近的实测样本做最小二乘拟合，样本不足时使用默认值。
     """
-    oss_key = None
-    try:
-        logger.info("上传音频到 OSS: %s", path.name)
-        oss_key, signed_url = _upload_to_oss(path)
 
-        request_id = str(uuid.uuid4())
-        logger.info("提交转写任务 (request_id=%s)", request_id)
-        _submit(signed_url, request_id)
+    def __init__(self):
+        self._samples: Optional[list] = None  # [(duration, turnaround)]
+        self._overhead = DEFAULT_ASR_OVERHEAD
+        self._rate = DEFAULT_ASR_RATE
+
+    def _ensure_loaded(self) -> None:
+        if self._samples is None:
+            from listen_watch.db import get_asr_latency_samples
+            self._samples = get_asr_latency_samples(LATENCY_WINDOW)
+            self._fit()
+
+    def _fit(self) -> None:
+        samples = [(d, t) for d, t in self._samples if d]
+        if len(samples) < LATENCY_MIN_SAMPLES:
+            return
+        n = len(samples)
+        mean_d = sum(d for d, _ in samples) / n
+        mean_t = sum(t for _, t in samples) / n
+        var_d = sum((d - mean_d) ** 2 for d, _ in samples)
+        rate = (sum((d - mean_d) * (t - mean_t) for d, t in samples) / var_d) if var_d else 0.0
+        self._rate = max(rate, 0.0)
+        self._overhead = max(mean_t - self._rate * mean_d, 0.5)
+
+    def expected(self, duration: Optional[float]) -> float:
+        """预计转写耗时（秒），时长未知时取样本中位数。"""
+        self._ensure_loaded()
+        if duration is None:
+            median = _percentile([t for _, t in self._samples], 50)
+            return median if median is not None else DEFAULT_ASR_OVERHEAD + DEFAULT_ASR_RATE * 60
+        return self._overhead + self._rate * duration
+
+    def timeout(self, duration: Optional[float]) -> float:
+        return max(POLL_MIN_WAIT, self.expected(duration) * POLL_WAIT_FACTOR)
+
+    def observe(self, duration: Optional[float], turnaround: float) -> None:
+        self._ensure_loaded()
+        self._samples.append((duration, turnaround))
+        del self._samples[:-LATENCY_WINDOW]
+        self._fit()
+
+    def percentiles(self) -> dict:
+        """最近样本的转写耗时分位数（秒）。"""
+        self._ensure_loaded()
+        values = [t for _, t in self._samples]
+        return {f"p{q}": _percentile(values, q) for q in (50, 90, 99)}
+
+
+class TranscriptionBackend(abc.ABC):
+    """
+    转写引擎接口。实现类提供异步 transcribe()；estimate() 给出预计耗时，
+    供 auto 模式按录音时长选择最快的引擎。缺少任一抽象方法的实现类无法实例化。
+    """
+    name = ""
+
+    def available(self) -> bool:
+        """依赖和配置是否齐全。"""
+        return True
+
+    @abc.abstractmethod
+    def estimate(self, duration: Optional[float]) -> float:
+        """预计转写耗时（秒）。"""
+
+    @abc.abstractmethod
+    async def transcribe(self, path: Path, duration: Optional[float] = None) -> str:
+        """转写音频文件，返回文本。"""
+
+    async def aclose(self) -> None:
+        pass
+
+
+@dataclass
+class _PendingJob:
+    future: asyncio.Future
+    started: float
+    duration: Optional[float]
+    next_probe: float
+    deadline: float
+    interval: float = POLL_MIN_INTERVAL
+    queries: int = 0
+    last_pending: Optional[float] = None  # 最近一次查询仍未完成的时刻
+
+
+class DoubaoBackend(TranscriptionBackend):
+    """
+    豆包 + OSS 转写引擎：在一个事件循环内并发处理多个录音。
+    所有请求共用 clients 注册表中的 keep-alive HTTP 客户端；未完成的 request_id 由单个轮询协程
+    统一查询，而不是每个任务各占一个线程 sleep。每个任务按音频时长和历史耗时安排查询时间：
+    首次查询早于预计完成时刻，之后退避，超时也随时长放大。
+    """
+
+    name = "doubao"
+
+    def __init__(self, max_concurrency: int = ASR_MAX_CONCURRENCY,
+                 client: Optional[httpx.AsyncClient] = None):
+        self._max_concurrency = max_concurrency
+        self._client = client
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._pending: dict = {}
+        self._poller: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.latency = _LatencyModel()
+
+    def available(self) -> bool:
+        return all((VOLCENGINE_APP_ID, VOLCENGINE_API_KEY, OSS_ENDPOINT, OSS_BUCKET_NAME))
+
+    def estimate(self, duration: Optional[float]) -> float:
+        # 上传耗时相对转写排队可以忽略
+        return self.latency.expected(duration)
+
+    async def transcribe(self, path: Path, duration: Optional[float] = None) -> str:
+        """
+        上传音频到 OSS → 提交豆包转写 → 等待轮询结果 → 删除 OSS 临时文件。
+        duration: 音频时长（秒），用于安排查询时间和超时。
+        """
+        async with self._get_semaphore():
+            oss_key = None
+            try:
+                logger.info("上传音频到 OSS: %s", path.name)
+                oss_key, signed_url = await asyncio.to_thread(_upload_to_oss, path)
+
+                request_id = str(uuid.uuid4())
+                logger.info("提交转写任务 (request_id=%s)", request_id)
+                await self._submit(signed_url, request_id)
+
+                logger.info("等待转写结果...")
+                text = await self._wait(request_id, duration)
+                logger.info("转写完成，共 %d 字", len(text))
+                return text
+            finally:
+                if oss_key:
+                    await asyncio.to_thread(_delete_from_oss, oss_key)
+
+    async def aclose(self) -> None:
+        """停止轮询协程；共享客户端由 clients 注册表管理，不在这里关闭。"""
+        if self._poller:
+            self._poller.cancel()
+
+    # ── 内部实现 ──────────────────────────────────────────────────
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # 在事件循环内创建，兼容 Python 3.9 的 loop 绑定
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        return self._semaphore
+
+    def _get_client(self) -> httpx.AsyncClient:
+        return self._client or clients.async_http_client()
+
+    async def _submit(self, audio_url: str, request_id: str) -> None:
+        """提交转写任务（被限流时按 Retry-After 等待后重试）。"""
+        async def post() -> httpx.Response:
+            resp = await self._get_client().post(
+                SUBMIT_URL, json=_submit_payload(audio_url), headers=_make_headers(request_id)
+            )
+            resp.raise_for_status()
+            return resp
 
-        logger.info("等待转写结果...")
-        text = _poll(request_id)
-        logger.info("转写完成，共 %d 字", len(text))
+        with metrics.timed("asr_submit", detail=self.name):
+            resp = await ratelimit.get(self.name).acall(post)
+            _check_submit(resp.json())
+
+    async def _query(self, request_id: str) -> Optional[str]:
+        async with ratelimit.get(self.name).aslot():
+            resp = await self._get_client().post(QUERY_URL, json={}, headers=_make_headers(request_id))
+            resp.raise_for_status()
+        return _parse_query(resp.json())
+
+    async def _wait(self, request_id: str, duration: Optional[float]) -> str:
+        """登记待查询任务并等待轮询协程给出结果。"""
+        now = time.monotonic()
+        expected = self.latency.expected(duration)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = _PendingJob(
+            future=future,
+            started=now,
+            duration=duration,
+            next_probe=now + max(expected * POLL_FIRST_PROBE, POLL_MIN_INTERVAL),
+            deadline=now + self.latency.timeout(duration),
+        )
+        logger.debug("预计转写耗时 %.1fs (request_id=%s)", expected, request_id)
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll_loop())
+        try:
+            return await future
+        finally:
+            # 等待方超时或被取消时撤销登记，轮询协程不再查询它
+            self._pending.pop(request_id, None)
+
+    async def _poll_loop(self) -> None:
+        """按各任务的查询时间统一轮询，直到没有待查询的 request_id。"""
+        while self._pending:
+            now = time.monotonic()
+            next_due = min(job.next_probe for job in self._pending.values())
+            if next_due > now:
+                # 睡到最早的查询时间；期间有新任务登记则提前醒来重新计算
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), next_due - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            ids = [rid for rid, job in self._pending.items() if job.next_probe <= now]
+            logger.debug("查询 %d 个转写任务（共 %d 个未完成）", len(ids), len(self._pending))
+            probed = now
+            results = await asyncio.gather(
+                *(self._query(rid) for rid in ids), return_exceptions=True
+            )
+            now = time.monotonic()
+            metrics.inc("asr_queries_total", len(ids), backend=self.name)
+            for rid, result in zip(ids, results):
+                job = self._pending.get(rid)
+                if job is None or job.future.done():
+                    # 查询期间等待方已取消，结果无人接收
+                    self._pending.pop(rid, None)
+                    continue
+                job.queries += 1
+                waited = now - job.started
+                throttled = ratelimit.retry_after(result) if isinstance(result, BaseException) else None
+                if throttled is not None and now < job.deadline:
+                    # 查询被限流不代表任务失败，推迟下次查询
+                    job.next_probe = now + max(throttled, job.interval)
+                elif isinstance(result, BaseException):
+                    del self._pending[rid]
+                    metrics.observe("asr_wait", waited, type(result).__name__, self.name)
+                    job.future.set_exception(result)
+                elif result is not None:
+                    del self._pending[rid]
+                    job.future.set_result(result)
+                    # 任务在上次未完成与本次查询之间完成，取中点作为实际耗时，
+                    # 不把查询时刻（总晚于完成时刻）当作耗时，否则拟合只会越估越长
+                    finished = ((job.last_pending or job.started) + probed) / 2
+                    metrics.observe("asr_wait", waited, detail=self.name)
+                    self._record(job, finished - job.started)
+                elif now >= job.deadline:
+                    del self._pending[rid]
+                    metrics.observe("asr_wait", waited, "TimeoutError", self.name)
+                    job.future.set_exception(
+                        TimeoutError(f"转写超时（>{job.deadline - job.started:.0f}s）")
+                    )
+                else:
+                    job.last_pending = probed
+                    job.next_probe = now + job.interval
+                    job.interval = min(job.interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+                    logger.debug("转写进行中... (%ds) request_id=%s", waited, rid)
+
+    def _record(self, job: _PendingJob, turnaround: float) -> None:
+        """记录估算的实际转写耗时，用于后续任务的查询安排。"""
+        from listen_watch.db import record_asr_latency
+
+        self.latency.observe(job.duration, turnaround)
+        asyncio.get_running_loop().run_in_executor(
+            None, record_asr_latency, job.duration, turnaround, job.queries
+        )
+        logger.debug(
+            "转写耗时 %.1fs（音频 %ss，查询 %d 次），近期分位数 %s",
+            turnaround, job.duration, job.queries, self.latency.percentiles(),
+        )
+
+
+class WhisperBackend(TranscriptionBackend):
+    """
+    本地 Whisper 转写引擎（CPU）：无需上传和排队，适合短录音或离线使用。
+    模型首次使用时加载；推理占满 CPU，由独立线程池限制并发（默认 1）。
+    """
+    name = "whisper"
+
+    def __init__(self, model_name: str = WHISPER_MODEL, workers: int = WHISPER_WORKERS):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self._model_name = model_name
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="whisper")
+        self._workers = workers
+        self._active = 0
+        self._rtf = WHISPER_DEFAULT_RTF
+
+    def available(self) -> bool:
+        import importlib.util
+        import shutil
+        return importlib.util.find_spec("whisper") is not None and shutil.which("ffmpeg") is not None
+
+    def estimate(self, duration: Optional[float]) -> float:
+        # 排队中的任务按同等时长粗略计入
+        queued = self._active // self._workers
+        return (duration or 60) * self._rtf * (queued + 1)
+
+    async def transcribe(self, path: Path, duration: Optional[float] = None) -> str:
+        self._active += 1
+        try:
+            loop = asyncio.get_running_loop()
+            started = time.monotonic()
+            with metrics.timed("asr_local", detail=self._model_name, path=path):
+                text = await loop.run_in_executor(self._executor, self._run, path)
+        finally:
+            self._active -= 1
+        elapsed = time.monotonic() - started
+        if duration:
+            # 指数滑动平均，跟随机器负载变化
+            self._rtf = 0.8 * self._rtf + 0.2 * (elapsed / duration)
+        logger.info("本地转写完成，共 %d 字（%.1fs）", len(text), elapsed)
         return text
-    finally:
-        if oss_key:
-            _delete_from_oss(oss_key)
+
+    async def aclose(self) -> None:
+        self._executor.shutdown(wait=False)
+
+    def _load_model(self):
+        with self._model_lock:
+            if self._model is None:
+                import whisper
+                logger.info("加载 Whisper 模型: %s", self._model_name)
+                self._model = whisper.load_model(self._model_name, device="cpu")
+            return self._model
+
+    def _run(self, path: Path) -> str:
+        logger.info("本地转写: %s", path.name)
+        result = self._load_model().transcribe(
+            str(path), language="zh", fp16=False, initial_prompt=WHISPER_INITIAL_PROMPT
+        )
+        return result["text"].strip()
+
+
+_BACKENDS = {
+    "doubao": DoubaoBackend,
+    "whisper": WhisperBackend,
+}
+
+
+# 进程内共享的事件循环线程：同步调用方（流水线工作线程）把任务投递到这里，
+# 从而共用同一组引擎实例的连接池和轮询协程
+_backends: dict = {}
+_engine_loop: Optional[asyncio.AbstractEventLoop] = None
+_engine_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _engine_loop
+    with _engine_lock:
+        if _engine_loop is None:
+            _engine_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_engine_loop.run_forever, name="asr-loop", daemon=True
+            ).start()
+        return _engine_loop
+
+
+def get_backend(name: str) -> TranscriptionBackend:
+    """返回指定名称的转写引擎（进程内单例）。"""
+    with _engine_lock:
+        backend = _backends.get(name)
+        if backend is None:
+            cls = _BACKENDS.get(name)
+            if cls is None:
+                raise ValueError(f"未知的 TRANSCRIBE_BACKEND: {name}，可选值：{list(_BACKENDS) + ['auto']}")
+            backend = _backends[name] = cls()
+        return backend
+
+
+def choose_backend(duration: Optional[float], mode: Optional[str] = None) -> TranscriptionBackend:
+    """
+    按配置选择转写引擎。auto 模式下在可用的引擎中取预计耗时最短的一个：
+    短录音本地转写省去上传和排队，长录音交给云端。
+    """
+    mode = (mode or TRANSCRIBE_BACKEND).lower()
+    if mode != "auto":
+        return get_backend(mode)
+    candidates = [get_backend(name) for name in _BACKENDS]
+    candidates = [b for b in candidates if b.available()]
+    if not candidates:
+        raise RuntimeError("没有可用的转写引擎（检查豆包 / OSS 配置或安装 openai-whisper 与 ffmpeg）")
+    best = min(candidates, key=lambda b: b.estimate(duration))
+    logger.debug(
+        "转写引擎选择: %s（%s）",
+        best.name, ", ".join(f"{b.name}≈{b.estimate(duration):.1f}s" for b in candidates),
+    )
+    return best
+
+
+def transcribe_timeout(duration: Optional[float]) -> float:
+    """单个录音转写（含上传、排队和轮询）的总超时（秒），时长未知按 10 分钟计。"""
+    return 2 * POLL_MIN_WAIT + POLL_WAIT_FACTOR * (duration or 600)
+
+
+async def atranscribe(path: Path, duration: Optional[float] = None) -> str:
+    """在转写事件循环内转写单个录音（或分段），超过 transcribe_timeout() 时抛出 TimeoutError。"""
+    backend = choose_backend(duration)
+    return await asyncio.wait_for(backend.transcribe(path, duration), transcribe_timeout(duration))
+
+
+def run_async(coro: Awaitable[str],
+              then: Optional[Callable[[str], object]] = None) -> concurrent.futures.Future:
+    """
+    把转写协程交给共享的事件循环执行，立即返回 Future，调用方不必占用线程等待。
+    then(text) 在线程池中执行（可做数据库写入等阻塞操作），其返回值作为 Future 的结果；
+    未提供时结果为转写文本。
+    """
+    async def run():
+        text = await coro
+        return await asyncio.to_thread(then, text) if then else text
+
+    return asyncio.run_coroutine_threadsafe(run(), _get_loop())
+
+
+def transcribe_async(path: Path, duration: Optional[float] = None,
+                     then: Optional[Callable[[str], object]] = None) -> concurrent.futures.Future:
+    """异步转写录音，见 run_async()；超过 transcribe_timeout() 时以 TimeoutError 结束。"""
+    return run_async(atranscribe(path, duration), then)
+
+
+def transcribe(path: Path, duration: Optional[float] = None) -> str:
+    """
+    同步入口：按 TRANSCRIBE_BACKEND 选择引擎转写录音，返回转写文本，失败时抛出异常。
+    实际在共享的事件循环线程中执行，供需要阻塞等待结果的脚本和工具使用。
+    """
+    future = transcribe_async(path, duration)
+    try:
+        # 协程内已有超时，这里多留余量，防止事件循环卡住时调用线程永久阻塞
+        return future.result(transcribe_timeout(duration) + POLL_MIN_WAIT)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise TimeoutError(f"转写超时: {path.name}")
+
+
+def asr_latency_percentiles() -> dict:
+    """近期豆包转写耗时（提交到完成）的 p50 / p90 / p99（秒）。"""
+    return get_backend("doubao").latency.percentiles()
@@ -1,73 +1,217 @@
 import time
+import heapq
 import logging
+import threading
+from dataclasses import dataclass
 from pathlib import Path
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
+from listen_watch import metrics
+from listen_watch.metadata import moov_complete
 
 logger = logging.getLogger(__name__)
 
 WATCH_EXTENSIONS = {".m4a", ".mp4", ".caf"}
-# 文件大小稳定判断：连续两次检查大小不变则认为写入完成
-FILE_STABLE_CHECK_INTERVAL = 2  # 秒
-FILE_STABLE_MAX_WAIT = 60       # 最长等待秒数
+MP4_EXTENSIONS = {".m4a", ".mp4"}
+# 文件就绪判断：最后一次事件后静默一段时间，大小不变且 MP4 的 moov 已写完
+FILE_STABLE_QUIET_PERIOD = 2  # 静默期（秒）
+FILE_STABLE_MAX_WAIT = 60     # 首次事件后最长等待秒数
 
 
-def _wait_until_stable(path: Path) -> bool:
-    """等待文件写入完成（大小稳定）。返回 True 表示稳定，False 表示超时。"""
-    prev_size = -1
-    waited = 0
-    while waited < FILE_STABLE_MAX_WAIT:
+@dataclass
+class _PendingFile:
+    first_seen: float
+    due: float
+    size: int = -1
+
+
+class StabilityTracker:
+    """
+    去抖动的文件就绪检测。
+    created / modified / moved / closed 事件只更新待检查记录并推迟检查时间，
+    由单个定时线程按到期顺序检查：大小与上次一致且 moov 完整即视为就绪，回调 callback。
+    不占用 observer 线程，也不为每个文件单开线程，可同时跟踪大量文件。
+    """
+
+    def __init__(self, callback, quiet_period: float = FILE_STABLE_QUIET_PERIOD,
+                 max_wait: float = FILE_STABLE_MAX_WAIT):
+        self.callback = callback
+        self.quiet_period = quiet_period
+        self.max_wait = max_wait
+        self._pending = {}
+        self._heap = []
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def start(self) -> None:
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="stability-tracker", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+
+    def touch(self, path: Path, immediate: bool = False) -> None:
+        """记录一次文件事件；immediate=True（如写入关闭事件）时跳过静默期立即检查。"""
+        now = time.monotonic()
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            self.discard(path)
+            return
+        key = str(path)
+        due = now if immediate else now + self.quiet_period
+        with self._cond:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = _PendingFile(first_seen=now, due=due)
+            elif not immediate and entry.size != size:
+                entry.due = due  # 仍在写入，推迟检查
+            else:
+                entry.due = min(entry.due, due)
+            entry.size = size
+            heapq.heappush(self._heap, (entry.due, key))
+            self._cond.notify()
+
+    def discard(self, path: Path) -> None:
+        with self._cond:
+            self._pending.pop(str(path), None)
+
+    @property
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if self._heap:
+                        wait = self._heap[0][0] - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+                if self._stopped:
+                    return
+                due, key = heapq.heappop(self._heap)
+                entry = self._pending.get(key)
+                if entry is None or entry.due != due:
+                    continue  # 过期的堆记录（文件已就绪 / 已删除 / 检查时间被推迟）
+                expected_size = entry.size
+            self._check(Path(key), entry, expected_size)
+
+    def _check(self, path: Path, entry: _PendingFile, expected_size: int) -> None:
+        """到期检查（在锁外执行文件 IO）。"""
         try:
-            current_size = path.stat().st_size
+            size = path.stat().st_size
         except FileNotFoundError:
-            return False
-        if current_size > 0 and current_size == prev_size:
-            return True
-        prev_size = current_size
-        time.sleep(FILE_STABLE_CHECK_INTERVAL)
-        waited += FILE_STABLE_CHECK_INTERVAL
-    logger.warning("文件写入等待超时: %s", path)
-    return False
+            self.discard(path)
+            return
+        ready = (
+            size > 0 and size == expected_size
+            and (path.suffix.lower() not in MP4_EXTENSIONS or moov_complete(path))
+        )
+        now = time.monotonic()
+        with self._cond:
+            if self._pending.get(str(path)) is not entry:
+                return
+            ready = ready and entry.size == expected_size  # 检查期间又有新写入
+            if ready:
+                del self._pending[str(path)]
+            elif now - entry.first_seen >= self.max_wait:
+                del self._pending[str(path)]
+                logger.warning("文件写入等待超时，跳过未稳定文件: %s", path.name)
+                return
+            else:
+                entry.size = size
+                entry.due = now + self.quiet_period
+                heapq.heappush(self._heap, (entry.due, str(path)))
+                return
+        logger.info("文件写入完成（%.1fs）: %s", now - entry.first_seen, path.name)
+        metrics.observe("stability_wait", now - entry.first_seen, path=path, nbytes=size)
+        try:
+            self.callback(path)
+        except Exception as e:
+            logger.error("提交文件时发生错误 %s: %s", path.name, e, exc_info=True)
 
 
 class VoiceMemoHandler(FileSystemEventHandler):
-    def __init__(self, callback):
+    def __init__(self, tracker: StabilityTracker):
         """
-        callback: 接收一个 Path 参数，在新录音文件就绪后被调用
+        tracker: 接收文件事件的 StabilityTracker，文件写入完成后由它回调处理函数。
+        iCloud 常见先写临时文件再重命名，因此 moved 事件的目标路径同样需要跟踪。
         """
         super().__init__()
-        self.callback = callback
+        self.tracker = tracker
+
+    @staticmethod
+    def _audio_path(path: str):
+        p = Path(path)
+        return p if p.suffix.lower() in WATCH_EXTENSIONS else None
 
     def on_created(self, event):
         if event.is_directory:
             return
-        path = Path(event.src_path)
-        if path.suffix.lower() not in WATCH_EXTENSIONS:
+        path = self._audio_path(event.src_path)
+        if path:
+            logger.info("检测到新文件: %s", path.name)
+            self.tracker.touch(path)
+
+    def on_modified(self, event):
+        if event.is_directory:
             return
-        logger.info("检测到新文件: %s", path.name)
-        if _wait_until_stable(path):
-            logger.info("文件写入完成，开始处理: %s", path.name)
-            try:
-                self.callback(path)
-            except Exception as e:
-                logger.error("处理文件时发生错误 %s: %s", path.name, e, exc_info=True)
-        else:
-            logger.warning("跳过未稳定文件: %s", path.name)
+        path = self._audio_path(event.src_path)
+        if path:
+            self.tracker.touch(path)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            return
+        src = self._audio_path(event.src_path)
+        if src:
+            self.tracker.discard(src)
+        dest = self._audio_path(event.dest_path)
+        if dest:
+            logger.info("检测到文件移入: %s", dest.name)
+            self.tracker.touch(dest)
+
+    def on_closed(self, event):
+        if event.is_directory:
+            return
+        path = self._audio_path(event.src_path)
+        if path:
+            self.tracker.touch(path, immediate=True)
+
+    def on_deleted(self, event):
+        path = self._audio_path(event.src_path)
+        if path:
+            self.tracker.discard(path)
 
 
 class VoiceMemoWatcher:
     def __init__(self, watch_dir: str, callback):
+        """callback: 接收一个 Path 参数，在新录音文件写入完成后被调用"""
         self.watch_dir = Path(watch_dir).expanduser()
         self.callback = callback
         self._observer = None
+        self._tracker = None
 
     def start(self):
         if not self.watch_dir.exists():
             raise FileNotFoundError(f"监听目录不存在: {self.watch_dir}")
-        handler = VoiceMemoHandler(self.callback)
+        tracker = StabilityTracker(self.callback)
         self._observer = Observer()
-        self._observer.schedule(handler, str(self.watch_dir), recursive=False)
+        self._observer.schedule(VoiceMemoHandler(tracker), str(self.watch_dir), recursive=False)
         self._observer.start()
+        tracker.start()
+        self._tracker = tracker
         logger.info("开始监听: %s", self.watch_dir)
 
     def stop(self):
@@ -75,9 +219,14 @@ class VoiceMemoWatcher:
             self._observer.stop()
             self._observer.join()
             logger.info("监听已停止")
+        if self._tracker:
+            self._tracker.stop()
 
-    def run_forever(self):
-        """阻塞运行，直到 KeyboardInterrupt。权限不足时每 30 秒重试一次。"""
+    def run_forever(self, on_started=None):
+        """
+        阻塞运行，直到 KeyboardInterrupt。权限不足时每 30 秒重试一次。
+        on_started: 监听启动成功后调用一次（如开始补处理遗漏文件），监听期间产生的新录音不会错过。
+        """
         while True:
             try:
                 self.start()
@@ -89,6 +238,8 @@ class VoiceMemoWatcher:
                 except KeyboardInterrupt:
                     return
         try:
+            if on_started:
+                on_started()
             while True:
                 time.sleep(1)
         except KeyboardInterrupt:
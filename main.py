@@ -1,22 +1,36 @@
+import argparse
+import fnmatch
 import logging
 import logging.handlers
 import os
 import re
+import sys
 import time
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 from dotenv import load_dotenv
-from mutagen.mp4 import MP4, MP4StreamInfoError
+
+# 先加载 .env，listen_watch 各模块在导入时读取配置
+load_dotenv()
+
 from listen_watch.watcher import VoiceMemoWatcher
+from listen_watch.pipeline import PRIORITY_BACKFILL, MemoJob, Pipeline, Stage
+from listen_watch import metrics
+from listen_watch.clients import close_all
+from listen_watch.metadata import get_metadata
+from listen_watch.segmenter import segmentation_available
 from listen_watch.db import (
-    init_db, is_processed, mark_success, mark_failed, get_unprocessed,
+    WATCH_EXTENSIONS, init_db, close_db, transaction,
+    is_processed, mark_success, mark_failed, get_unprocessed,
     get_transcription, get_ai_result, save_transcription, save_ai_result,
-    save_file_info,
+    compute_audio_hash, save_audio_hash,
+    get_content_transcription, get_content_ai_result,
+    save_content_transcription, save_content_ai_result, clear_segment_transcriptions,
+    enqueue_job, schedule_job_retry, mark_job_dead, finish_job, get_pending_jobs,
 )
 
-load_dotenv()
-
 # ── 日志配置 ──────────────────────────────────────────────────────
 LOG_DIR = Path.home() / ".listen_watch"
 LOG_DIR.mkdir(parents=True, exist_ok=True)
@@ -51,9 +65,16 @@ VOICE_MEMOS_DIR = os.getenv(
     "VOICE_MEMOS_DIR",
     str(Path.home() / "Library/Group Containers/group.com.apple.VoiceMemos.shared/Recordings"),
 )
-MAX_TRANSCRIBE_MINUTES = float(os.getenv("MAX_TRANSCRIBE_MINUTES", "10"))
+# 超过此时长（分钟）的录音跳过转写，0 不限制。未配置时：有 ffmpeg 可分段并行转写长录音，不限制；
+# 没有 ffmpeg 时长录音只能整段提交，仍限制为 10 分钟
+MAX_TRANSCRIBE_MINUTES = float(os.getenv("MAX_TRANSCRIBE_MINUTES") or (0 if segmentation_available() else 10))
 
-RETRY_DELAYS = [5, 15, 45]  # 指数退避间隔（秒）
+# 各阶段并发数；日记阶段的工作线程只负责提交并等待，实际写入由单个 JournalWriter 合并完成
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", "4"))
+AI_WORKERS = int(os.getenv("AI_WORKERS", "4"))
+# 批量导入时 AI 阶段一次合并处理的短录音条数上限
+AI_BATCH_SIZE = int(os.getenv("AI_BATCH_SIZE", "10"))
+JOURNAL_WORKERS = int(os.getenv("JOURNAL_WORKERS", "4"))
 
 
 # ── 工具函数 ──────────────────────────────────────────────────────
@@ -99,122 +120,338 @@ def parse_recorded_at(path: Path) -> Optional[datetime]:
         return None
 
 
-def get_audio_duration_seconds(path: Path) -> Optional[float]:
-    """返回音频时长（秒），读取失败返回 None。"""
-    try:
-        audio = MP4(path)
-        return audio.info.length
-    except (MP4StreamInfoError, Exception) as e:
-        logger.warning("无法读取音频时长 %s: %s", path.name, e)
-        return None
-
-
-def get_memo_title(path: Path) -> Optional[str]:
-    """从 m4a 元数据读取 iOS 语音备忘录标题（©nam），读取失败返回 None。"""
-    try:
-        audio = MP4(path)
-        titles = audio.tags.get("©nam")
-        return titles[0] if titles else None
-    except Exception as e:
-        logger.warning("无法读取录音标题 %s: %s", path.name, e)
-        return None
+# ── 核心处理 ──────────────────────────────────────────────────────
+# 流水线三个阶段：转写 → AI → 写入 Obsidian，各阶段结果独立缓存，
+# 重试时已完成的阶段直接读缓存，不重复调用 API。
+def _audio_hash(job: MemoJob) -> str:
+    """按需计算并记录音频内容哈希（每个任务只算一次）。"""
+    if job.audio_hash is None:
+        job.audio_hash = compute_audio_hash(job.path)
+        save_audio_hash(job.path, job.audio_hash)
+    return job.audio_hash
 
 
-# ── 核心处理 ──────────────────────────────────────────────────────
-def _process_once(path: Path) -> None:
+def stage_transcribe(job: MemoJob):
     """
-    执行完整处理流程（转写 → AI → 写入 Obsidian），各阶段结果独立缓存。
-    重试时已完成的阶段直接读缓存，不重复调用 API。
+    阶段 1：重复检测、读取元数据，然后转写（有缓存则跳过 OSS 上传和豆包调用）。
+    需要调用转写服务时返回 Future，工作线程不等待结果，同时在途的转写数由 ASR_MAX_CONCURRENCY 限制。
+    长录音按静音切段并发转写，每段结果单独缓存，失败重试只补转缺失的段。
     """
-    from listen_watch.transcriber import transcribe
-    from listen_watch.processor import process
-    from listen_watch.obsidian import append_memo
+    from listen_watch.transcriber import atranscribe, run_async, transcribe_async
+    from listen_watch.segmenter import should_segment, transcribe_segmented
 
-    recorded_at = parse_recorded_at(path)
+    path = job.path
+    if is_processed(path):
+        logger.info("已处理过，跳过: %s", path.name)
+        return None
+
+    if not job.prepared:
+        size_kb = path.stat().st_size / 1024
+        job.recorded_at = parse_recorded_at(path)
+
+        if job.recorded_at and job.recorded_at.date() != datetime.now().date():
+            logger.info(
+                "录音日期 %s 与今天 %s 不一致，将写入对应日期的日记",
+                job.recorded_at.strftime("%Y-%m-%d"),
+                datetime.now().date(),
+            )
+        elif not job.recorded_at:
+            logger.warning("无法从文件名解析录制时间，将使用当前时间: %s", path.name)
+
+        # 单次解析读取时长、标题等全部元数据，并记录到 processed_files
+        meta = get_metadata(path)
+        job.duration = meta.duration
+        job.memo_title = meta.title
+        if job.duration is not None:
+            minutes, seconds = divmod(int(job.duration), 60)
+            logger.info(">>> 新备忘录就绪: %s (%.1f KB, %d:%02d)", path.name, size_kb, minutes, seconds)
+        else:
+            logger.info(">>> 新备忘录就绪: %s (%.1f KB, 时长未知)", path.name, size_kb)
+        job.prepared = True
+
+    duration = job.duration
+    if MAX_TRANSCRIBE_MINUTES > 0 and duration is not None and duration > MAX_TRANSCRIBE_MINUTES * 60:
+        logger.info(
+            "文件时长 %.1f 分钟，超过限制 %.0f 分钟，跳过转写，仅记录文件路径。",
+            duration / 60,
+            MAX_TRANSCRIBE_MINUTES,
+        )
+        return None
 
-    # 阶段 1：转写（有缓存则跳过 OSS 上传和豆包调用）
     text = get_transcription(path)
     if text:
         logger.info("使用缓存转写结果: %s", path.name)
     else:
-        text = transcribe(path)
-        save_transcription(path, text)
-        logger.info("转写结果: %s", text)
-
-    # 阶段 2：AI 处理（有缓存则跳过 Kimi 调用）
+        # 相同音频内容（重命名 / 重新同步 / 重复导入）直接复用，不再上传和转写
+        audio_hash = _audio_hash(job)
+        text = get_content_transcription(audio_hash)
+        if text:
+            logger.info("音频内容与已转写文件相同，复用转写结果: %s", path.name)
+            save_transcription(path, text)
+        elif should_segment(duration):
+            return run_async(
+                transcribe_segmented(path, duration, audio_hash, atranscribe),
+                then=lambda t: _save_transcription(job, t),
+            )
+        else:
+            return transcribe_async(path, duration, then=lambda t: _save_transcription(job, t))
+    job.text = text
+    return job
+
+
+def _save_transcription(job: MemoJob, text: str) -> MemoJob:
+    """新转写结果按路径和音频内容缓存，清理分段结果。"""
+    with transaction():
+        save_content_transcription(job.audio_hash, job.path.stat().st_size, text)
+        save_transcription(job.path, text)
+        clear_segment_transcriptions(job.audio_hash)
+    logger.info("转写结果: %s", text)
+    job.text = text
+    return job
+
+
+def _log_partial_title(path: Path):
+    """流式输出中标题一出现就记录，长文本不必等全部整理完才知道内容。"""
+    logged = False
+
+    def on_partial(fields: dict) -> None:
+        nonlocal logged
+        title = fields.get("title")
+        if not logged and title and "summary" in fields:
+            logged = True
+            logger.info("AI 标题: %s (%s)", title, path.name)
+    return on_partial
+
+
+def _cached_memo(job: MemoJob):
+    """按路径、再按音频内容查找已有的 AI 结果；路径缓存命中时直接设置 job.memo。"""
+    path = job.path
     memo = get_ai_result(path)
     if memo:
         logger.info("使用缓存 AI 结果: %s", path.name)
-    else:
-        memo = process(text)
-        memo.original_text = text
-        memo.memo_title = get_memo_title(path)
-        save_ai_result(path, memo)
-        if memo.memo_title:
-            logger.info("录音标题: %s", memo.memo_title)
+        job.memo = memo
+        return memo
+    memo = get_content_ai_result(_audio_hash(job))
+    if memo:
+        logger.info("音频内容与已处理文件相同，复用 AI 结果: %s", path.name)
+        _save_memo(job, memo)
+    return memo
 
-    # 阶段 3：写入 Obsidian（每次重试都会重新执行）
-    append_memo(memo, recorded_at=recorded_at)
 
+def _save_memo(job: MemoJob, memo) -> None:
+    memo.memo_title = job.memo_title
+    with transaction():
+        save_content_ai_result(_audio_hash(job), job.path.stat().st_size, memo)
+        save_ai_result(job.path, memo)
+    if memo.memo_title:
+        logger.info("录音标题: %s", memo.memo_title)
+    job.memo = memo
 
-def on_new_memo(path: Path) -> None:
-    """新录音文件就绪后的处理入口，含重复检测和指数退避重试。"""
-    if is_processed(path):
-        logger.info("已处理过，跳过: %s", path.name)
-        return
 
-    size_kb = path.stat().st_size / 1024
-    recorded_at = parse_recorded_at(path)
+def stage_ai(job: MemoJob) -> MemoJob:
+    """阶段 2：AI 处理（有缓存则跳过 Kimi 调用）。"""
+    from listen_watch.processor import process
 
-    if recorded_at and recorded_at.date() != datetime.now().date():
-        logger.info(
-            "录音日期 %s 与今天 %s 不一致，将写入对应日期的日记",
-            recorded_at.strftime("%Y-%m-%d"),
-            datetime.now().date(),
-        )
-    elif not recorded_at:
-        logger.warning("无法从文件名解析录制时间，将使用当前时间: %s", path.name)
+    if not _cached_memo(job):
+        memo = process(job.text, on_partial=_log_partial_title(job.path))
+        memo.original_text = job.text
+        _save_memo(job, memo)
+    return job
 
-    duration = get_audio_duration_seconds(path)
-    if duration is not None:
-        minutes, seconds = divmod(int(duration), 60)
-        logger.info(">>> 新备忘录就绪: %s (%.1f KB, %d:%02d)", path.name, size_kb, minutes, seconds)
-    else:
-        logger.info(">>> 新备忘录就绪: %s (%.1f KB, 时长未知)", path.name, size_kb)
 
-    save_file_info(path, get_memo_title(path), duration)
+def stage_ai_batch(jobs: List[MemoJob]) -> List[MemoJob]:
+    """阶段 2 的批量版本：多条短转写合并为一次 AI 请求，其余逐个处理。"""
+    from listen_watch.processor import batchable, process_batch
 
-    if MAX_TRANSCRIBE_MINUTES > 0 and duration is not None and duration > MAX_TRANSCRIBE_MINUTES * 60:
-        logger.info(
-            "文件时长 %.1f 分钟，超过限制 %.0f 分钟，跳过转写，仅记录文件路径。",
-            duration / 60,
-            MAX_TRANSCRIBE_MINUTES,
-        )
-        return
+    short = [job for job in jobs if not _cached_memo(job) and batchable(job.text)]
+    if len(short) > 1:
+        memos = process_batch([job.text for job in short])
+        for job, memo in zip(short, memos):
+            memo.original_text = job.text
+            _save_memo(job, memo)
+    return [job if job.memo else stage_ai(job) for job in jobs]
 
-    last_error = None
-    for attempt, delay in enumerate(RETRY_DELAYS, start=1):
-        try:
-            _process_once(path)
-            mark_success(path)
-            return
-        except Exception as e:
-            last_error = e
-            logger.warning("处理失败（第 %d 次），%d 秒后重试: %s", attempt, delay, e)
-            time.sleep(delay)
-
-    # 3 次均失败
-    mark_failed(path)
+
+def stage_journal(job: MemoJob) -> None:
+    """阶段 3：写入 Obsidian 并标记成功（重试时已写入的条目不会重复追加）。"""
+    from listen_watch.obsidian import append_memo
+
+    append_memo(job.memo, recorded_at=job.recorded_at, entry_id=str(job.path))
+    mark_success(job.path)
+    logger.info("<<< 处理完成: %s (%.1fs)", job.path.name, time.monotonic() - job.submitted_at)
+
+
+def on_job_submitted(job: MemoJob) -> None:
+    enqueue_job(job.path, job.priority)
+
+
+def on_stage_retry(job: MemoJob, stage: str, error: Exception, delay: float) -> None:
+    """记录重试时间，进程重启后按原计划继续重试。"""
+    schedule_job_retry(
+        job.path, stage, job.attempts, datetime.now() + timedelta(seconds=delay), str(error)
+    )
+
+
+def on_stage_failed(job: MemoJob, stage: str, error: Exception) -> None:
+    """重试耗尽：标记失败并转为死信，不再自动重试（python main.py jobs --retry 可重新排队）。"""
+    with transaction():
+        mark_failed(job.path)
+        mark_job_dead(job.path, stage, job.attempts, str(error))
     logger.error(
-        "处理失败，已达最大重试次数，跳过文件 %s: %s",
-        path.name, last_error, exc_info=True,
+        "处理失败（%s 阶段），已达最大重试次数，转为死信 %s: %s",
+        stage, job.path.name, error, exc_info=error,
     )
 
 
-# ── 入口 ──────────────────────────────────────────────────────────
-if __name__ == "__main__":
-    init_db()
-    logger.info("listen_watch 启动")
+def build_pipeline(transcribe_workers: int = TRANSCRIBE_WORKERS, ai_workers: int = AI_WORKERS,
+                   on_complete=None, ai_batch_size: int = 1, asr_concurrency: Optional[int] = None) -> Pipeline:
+    """
+    按配置创建转写 / AI / 日记三阶段流水线，任务状态持久化在 jobs 表。
+    asr_concurrency 为同时在途的转写请求数（默认 ASR_MAX_CONCURRENCY），不占用转写阶段的工作线程。
+    ai_batch_size > 1 时 AI 阶段把排队中的短转写合并请求（批量导入用，实时监听不等待凑批）。
+    """
+    from listen_watch.transcriber import ASR_MAX_CONCURRENCY
+
+    def complete(job: MemoJob) -> None:
+        finish_job(job.path)
+        if on_complete:
+            on_complete(job)
+
+    return Pipeline(
+        [
+            Stage("transcribe", stage_transcribe, transcribe_workers, max_pending=asr_concurrency or ASR_MAX_CONCURRENCY),
+            Stage("ai", stage_ai, ai_workers, batch_handler=stage_ai_batch, batch_size=ai_batch_size),
+            Stage("journal", stage_journal, JOURNAL_WORKERS),
+        ],
+        on_submit=on_job_submitted,
+        on_retry=on_stage_retry,
+        on_failure=on_stage_failed,
+        on_complete=complete,
+    )
+
+
+# ── 批量补处理（backfill）────────────────────────────────────────
+def _file_date(path: Path) -> datetime:
+    """录制时间：优先取文件名中的时间，其次取文件修改时间。"""
+    return parse_recorded_at(path) or datetime.fromtimestamp(path.stat().st_mtime)
+
+
+def iter_backfill_files(directory: Path, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                        globs: Optional[list] = None):
+    """按日期范围和文件名通配筛选目录中尚未成功处理的音频文件（流式产出）。"""
+    with os.scandir(directory) as it:
+        for entry in it:
+            path = Path(entry.path)
+            if path.suffix.lower() not in WATCH_EXTENSIONS or not entry.is_file():
+                continue
+            if globs and not any(fnmatch.fnmatch(path.name, g) for g in globs):
+                continue
+            if since or until:
+                date = _file_date(path)
+                if (since and date < since) or (until and date >= until):
+                    continue
+            if is_processed(path):
+                continue
+            yield path
+
+
+def estimate_backfill(files: list) -> None:
+    """dry-run：统计文件数、总时长和预计消耗的转写分钟数。"""
+    total = transcribe_seconds = 0.0
+    unknown = cached = over_limit = 0
+    for path in files:
+        duration = get_metadata(path).duration
+        if duration is None:
+            unknown += 1
+            continue
+        total += duration
+        if MAX_TRANSCRIBE_MINUTES > 0 and duration > MAX_TRANSCRIBE_MINUTES * 60:
+            over_limit += 1
+        elif get_transcription(path):
+            cached += 1
+        else:
+            transcribe_seconds += duration
+    print(f"待处理文件: {len(files)} 个（时长未知 {unknown} 个）")
+    print(f"录音总时长: {total / 60:.1f} 分钟")
+    print(f"超过时长限制跳过: {over_limit} 个，已有转写缓存: {cached} 个")
+    print(f"预计转写消耗: {transcribe_seconds / 60:.1f} 分钟")
+
+
+class _ProgressBar:
+    """在 stderr 单行刷新的进度条（多个流水线工作线程完成任务时都会调用 advance）。"""
+
+    def __init__(self, total: int, width: int = 30):
+        self.total = total
+        self.width = width
+        self.done = 0
+        self.audio_seconds = 0.0  # 成功处理的录音总时长
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def advance(self, job: Optional[MemoJob] = None) -> None:
+        succeeded = bool(job and job.duration and is_processed(job.path))
+        with self._lock:
+            self.done += 1
+            if succeeded:
+                self.audio_seconds += job.duration
+            elapsed = time.monotonic() - self.started
+            ratio = self.done / self.total if self.total else 1
+            filled = int(self.width * ratio)
+            rate = self.done / elapsed * 60 if elapsed > 0 else 0
+            eta = (self.total - self.done) / rate * 60 if rate else 0
+            sys.stderr.write(
+                f"\r[{'#' * filled}{'.' * (self.width - filled)}] {self.done}/{self.total} "
+                f"{ratio:.0%} {rate:.1f} 个/分 剩余 {int(eta // 60)}m{int(eta % 60):02d}s"
+            )
+            if self.done >= self.total:
+                sys.stderr.write("\n")
+            sys.stderr.flush()
+
+
+def run_backfill(args: argparse.Namespace) -> None:
+    """批量导入：并发处理目录中所有未处理的录音，可中断，重跑时跳过已成功的文件。"""
+    directory = Path(args.dir).expanduser()
+    since = datetime.strptime(args.since, "%Y-%m-%d") if args.since else None
+    until = datetime.strptime(args.until, "%Y-%m-%d") if args.until else None
+    files = sorted(iter_backfill_files(directory, since, until, args.glob))
+
+    if args.dry_run:
+        estimate_backfill(files)
+        return
+    if not files:
+        print("没有需要补处理的文件")
+        return
+
+    # 进度条占用终端，控制台只保留警告及以上日志（完整日志仍写入日志文件）
+    _console.setLevel(logging.WARNING)
+    progress = _ProgressBar(len(files))
+    pipeline = build_pipeline(
+        args.concurrency, args.concurrency, on_complete=progress.advance, ai_batch_size=AI_BATCH_SIZE,
+        asr_concurrency=args.concurrency,
+    )
+    pipeline.start()
+    interval = 60 / args.rate if args.rate else 0
+    try:
+        for path in files:
+            pipeline.submit(path, PRIORITY_BACKFILL)
+            if interval:
+                time.sleep(interval)
+        pipeline.join()
+    except KeyboardInterrupt:
+        sys.stderr.write("\n已中断，下次运行会从未完成的文件继续\n")
+    finally:
+        pipeline.stop()
+
+    elapsed = time.monotonic() - progress.started
+    succeeded = sum(1 for p in files if is_processed(p))
+    audio_minutes = progress.audio_seconds / 60
+    print(f"完成 {succeeded}/{len(files)} 个，未成功 {len(files) - succeeded} 个，用时 {elapsed / 60:.1f} 分钟")
+    if elapsed > 0:
+        print(f"吞吐: {succeeded / elapsed * 60:.1f} 个/分钟，{audio_minutes / (elapsed / 60):.1f} 分钟录音/分钟")
+
+
+def _startup_checks() -> None:
+    """校验监听目录和日记文件权限，只记录警告（可能较慢，在后台执行，不推迟开始监听）。"""
     try:
         ensure_directory_readable(Path(VOICE_MEMOS_DIR), "Voice Memos 监听目录")
         journal_probe_date = datetime.now()
@@ -224,13 +461,222 @@ if __name__ == "__main__":
     except (PermissionError, FileNotFoundError) as e:
         logger.warning("启动校验未通过（将在运行中重试）: %s", e)
 
-    # 补处理启动前遗漏的文件
-    missed = get_unprocessed(Path(VOICE_MEMOS_DIR))
-    if missed:
-        logger.info("发现 %d 个未处理文件，开始补处理...", len(missed))
-        for p in missed:
-            on_new_memo(p)
 
-    watcher = VoiceMemoWatcher(VOICE_MEMOS_DIR, on_new_memo)
-    watcher.run_forever()
+def _build_search_index() -> None:
+    """为升级前已有的记录补建全文索引（分批提交，不阻塞流水线写库）。"""
+    from listen_watch.db import build_search_index
+    try:
+        build_search_index()
+    except Exception as e:
+        logger.warning("补建全文索引失败: %s", e)
+
+
+def _resume_jobs(pipeline: Pipeline) -> int:
+    """恢复上次运行未完成的任务：沿用失败次数，等待重试的按原定时间继续。"""
+    resumed = 0
+    now = datetime.now()
+    for row in get_pending_jobs():
+        path = Path(row["file_path"])
+        if not path.exists() or is_processed(path):
+            finish_job(path)
+            continue
+        delay = 0.0
+        if row["next_attempt_at"]:
+            delay = max(0.0, (datetime.fromisoformat(row["next_attempt_at"]) - now).total_seconds())
+        resumed += pipeline.submit(path, row["priority"], attempts=row["attempts"], delay=delay)
+    return resumed
+
+
+def _submit_missed(pipeline: Pipeline) -> None:
+    """
+    先恢复 jobs 表中未完成的任务，再补处理启动前遗漏的文件：边增量扫描边以补处理优先级提交，
+    不把整个目录读进内存；入口队列按文件大小排序，排队中的短录音先出结果，
+    监听到的新录音始终排在它们前面。队列满时本线程等待（背压），不影响监听。
+    """
+    resumed = _resume_jobs(pipeline)
+    if resumed:
+        logger.info("恢复 %d 个未完成的任务", resumed)
+
+    missed = get_unprocessed(Path(VOICE_MEMOS_DIR).expanduser())
+    submitted = sum(pipeline.submit(p, PRIORITY_BACKFILL) for p in missed)
+    if submitted:
+        logger.info("发现 %d 个未处理文件，已提交补处理", submitted)
+
+
+def run_watch() -> None:
+    """
+    常驻监听模式：先启动监听，再在后台补处理遗漏文件。
+    新录音与补处理任务进入同一个优先级流水线，不必等积压处理完。
+    """
+    logger.info("listen_watch 启动")
+    threading.Thread(target=_startup_checks, name="startup-checks", daemon=True).start()
+    threading.Thread(target=_build_search_index, name="search-index", daemon=True).start()
+
+    pipeline = build_pipeline()
+    pipeline.start()
+
+    def on_started() -> None:
+        threading.Thread(target=_submit_missed, args=(pipeline,), name="backfill", daemon=True).start()
+
+    watcher = VoiceMemoWatcher(VOICE_MEMOS_DIR, pipeline.submit)
+    watcher.run_forever(on_started=on_started)
+    pipeline.stop()
     logger.info("listen_watch 已退出")
+
+
+# ── 耗时统计 ──────────────────────────────────────────────────────
+def run_stats(args: argparse.Namespace) -> None:
+    """按环节汇总 metrics 表：次数、失败数、p50 / p95 / p99、平均耗时和数据量。"""
+    from listen_watch.db import get_metrics
+
+    since = datetime.fromtimestamp(time.time() - args.hours * 3600)
+    rows = get_metrics(since.isoformat())
+    if not rows:
+        print(f"最近 {args.hours:g} 小时没有耗时记录")
+        return
+
+    groups = {}
+    for row in rows:
+        groups.setdefault((row["stage"], row["detail"]), []).append(row)
+
+    print(f"最近 {args.hours:g} 小时各环节耗时（秒）")
+    # 中文表头按双倍宽度扣减补齐空格，保证与数据列对齐
+    print(f"{'环节':<28}{'次数':>5}{'失败':>4}{'p50':>9}{'p95':>9}{'p99':>9}{'平均':>7}{'数据量':>8}")
+    print("-" * 90)
+    for (stage, detail), items in sorted(groups.items()):
+        seconds = [r["duration_ms"] / 1000 for r in items]
+        failed = sum(1 for r in items if r["outcome"] != "ok")
+        total_bytes = sum(r["bytes"] or 0 for r in items)
+        name = f"{stage}/{detail}" if detail else stage
+        size = f"{total_bytes / 1024 / 1024:.1f} MB" if total_bytes else "-"
+        print(
+            f"{name:<30}{len(items):>7}{failed:>6}"
+            f"{metrics.percentile(seconds, 0.5):>9.2f}{metrics.percentile(seconds, 0.95):>9.2f}"
+            f"{metrics.percentile(seconds, 0.99):>9.2f}{sum(seconds) / len(seconds):>9.2f}{size:>11}"
+        )
+
+
+# ── 全文检索 ──────────────────────────────────────────────────────
+def run_search(args: argparse.Namespace) -> None:
+    """按相关度列出命中的录音：日期、文件名、标题和命中处的摘录。"""
+    from listen_watch.db import build_search_index, search_memos
+
+    build_search_index()
+    started = time.perf_counter()
+    hits = search_memos(" ".join(args.query), args.limit)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if not hits:
+        print(f"没有找到匹配的录音（{elapsed_ms:.0f} ms）")
+        return
+    for hit in hits:
+        date = (hit["date"] or "")[:16].replace("T", " ")
+        print(f"{date}  {Path(hit['file_path']).name}  {hit['title'] or ''}")
+        print(f"    {hit['snippet']}")
+    print(f"共 {len(hits)} 条（{elapsed_ms:.0f} ms）")
+
+
+# ── 数据库维护 ────────────────────────────────────────────────────
+def _format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def run_vacuum(args: argparse.Namespace) -> None:
+    """整理数据库并报告前后大小；--tables 额外列出各表占用。"""
+    from listen_watch.db import compact_db, table_sizes
+
+    result = compact_db()
+    saved = result["before"] - result["after"]
+    print(
+        f"数据库 {_format_size(result['before'])} → {_format_size(result['after'])}"
+        f"，回收 {_format_size(max(saved, 0))}"
+    )
+    if result["compressed"]:
+        print(f"压缩旧版本内容缓存 {result['compressed']} 项")
+    if args.tables:
+        for name, size in table_sizes().items():
+            print(f"  {name:<36} {_format_size(size):>10}")
+
+
+# ── 任务队列 ──────────────────────────────────────────────────────
+def run_jobs(args: argparse.Namespace) -> None:
+    """列出未完成的任务和死信；--retry 把死信重新排队，下次启动监听时处理。"""
+    from listen_watch.db import get_jobs, requeue_dead_jobs
+
+    if args.retry:
+        print(f"已重新排队 {requeue_dead_jobs()} 个死信任务，重启监听后处理")
+        return
+    rows = get_jobs()
+    if not rows:
+        print("没有未完成的任务")
+        return
+    labels = {"queued": "排队", "retry": "待重试", "dead": "死信"}
+    for row in rows:
+        when = row["next_attempt_at"] or row["updated_at"]
+        print(
+            f"{labels.get(row['state'], row['state']):<4} {when[:19]}  失败 {row['attempts']} 次"
+            f"  {row['stage'] or '-':<10} {Path(row['file_path']).name}"
+        )
+        if row["last_error"]:
+            print(f"      {row['last_error'][:200]}")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Voice Memos → 转写 → AI 整理 → Obsidian 日记")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("watch", help="常驻监听（默认）")
+
+    bf = sub.add_parser("backfill", help="批量补处理 / 导入历史录音")
+    bf.add_argument("--dir", default=VOICE_MEMOS_DIR, help="录音目录（默认 VOICE_MEMOS_DIR）")
+    bf.add_argument("--since", help="起始日期（含），YYYY-MM-DD")
+    bf.add_argument("--until", help="截止日期（不含），YYYY-MM-DD")
+    bf.add_argument("--glob", action="append", help="文件名通配，可多次指定，如 '2024*.m4a'")
+    bf.add_argument("--concurrency", type=int, default=TRANSCRIBE_WORKERS, help="转写 / AI 阶段并发数")
+    bf.add_argument("--rate", type=float, default=0, help="每分钟最多提交的文件数，0 不限制")
+    bf.add_argument("--dry-run", action="store_true", help="只统计文件数、总时长和预计转写分钟数")
+
+    st = sub.add_parser("stats", help="各环节耗时统计")
+    st.add_argument("--hours", type=float, default=24, help="统计最近多少小时（默认 24）")
+
+    se = sub.add_parser("search", help="全文检索转写文本和 AI 整理结果")
+    se.add_argument("query", nargs="+", help="检索词，多个词须全部命中")
+    se.add_argument("--limit", type=int, default=20, help="最多显示条数（默认 20）")
+
+    va = sub.add_parser("vacuum", help="整理数据库，回收空间并报告前后大小（需先停止监听）")
+    va.add_argument("--tables", action="store_true", help="列出各表及索引占用的空间")
+
+    jb = sub.add_parser("jobs", help="查看未完成的任务和重试耗尽的死信")
+    jb.add_argument("--retry", action="store_true", help="把死信任务重新排队")
+    return parser.parse_args(argv)
+
+
+# ── 入口 ──────────────────────────────────────────────────────────
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    init_db()
+    commands = {"stats": run_stats, "jobs": run_jobs, "search": run_search, "vacuum": run_vacuum}
+    if args.command in commands:
+        try:
+            commands[args.command](args)
+        finally:
+            close_db()
+        return
+    metrics.start()
+    try:
+        if args.command == "backfill":
+            run_backfill(args)
+        else:
+            run_watch()
+    finally:
+        from listen_watch.obsidian import stop_writer
+        stop_writer()
+        close_all()
+        metrics.stop()
+        close_db()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+测试环境：listen_watch 各模块在导入时读取配置，必须先指向临时目录和本地模拟服务再导入。
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from listen_watch.fake_services import FakeConfig, start_server  # noqa: E402
+
+FAKE_CONFIG = FakeConfig(asr_latency=0.2, asr_rate=0.0, asr_jitter=0.0, llm_latency=0.0, llm_chunks=3)
+_server, BASE_URL = start_server(config=FAKE_CONFIG)
+_tmp = Path(tempfile.mkdtemp(prefix="listen_watch_test_"))
+
+os.environ.update({
+    "HOME": str(_tmp / "home"),
+    "VOICE_MEMOS_DIR": str(_tmp / "watch"),
+    "OBSIDIAN_JOURNAL_DIR": str(_tmp / "journal"),
+    "VOLCENGINE_APP_ID": "test",
+    "VOLCENGINE_API_KEY": "test",
+    "VOLCENGINE_ASR_URL": f"{BASE_URL}/api/v3/auc/bigmodel",
+    "OSS_ACCESS_KEY_ID": "test",
+    "OSS_ACCESS_KEY_SECRET": "test",
+    "OSS_BUCKET_NAME": "test",
+    "OSS_ENDPOINT": BASE_URL,
+    "OSS_IS_CNAME": "true",
+    "TRANSCRIBE_BACKEND": "doubao",
+    "AI_PROVIDER": "kimi",
+    "AI_FALLBACK_PROVIDER": "",
+    "KIMI_API_KEY": "test",
+    "KIMI_BASE_URL": f"{BASE_URL}/v1",
+    "METRICS_FILE": "",
+    "METRICS_PORT": "0",
+    "RATE_LIMITS": "",
+})
+for name in ("home", "watch", "journal"):
+    (_tmp / name).mkdir(parents=True, exist_ok=True)
+
+
+@pytest.fixture
+def fake_server():
+    """本地模拟的豆包 / OSS / AI 服务；用例可临时修改 config，结束后恢复。"""
+    saved = vars(_server.state.config).copy()
+    yield _server
+    vars(_server.state.config).update(saved)
+
+
+@pytest.fixture
+def tmp_db(tmp_path, monkeypatch):
+    """每个用例使用独立的 SQLite 文件。"""
+    from listen_watch import db
+
+    db.close_db()
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / "processed.db")
+    monkeypatch.setattr(db, "_processed", None)
+    db.init_db()
+    yield db
+    db.close_db()
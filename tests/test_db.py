@@ -0,0 +1,49 @@
+import os
+from pathlib import Path
+
+from listen_watch import db
+
+
+def scan(directory: Path):
+    return sorted(p.name for batch in db._scan_changes(directory) for p in batch)
+
+
+def snapshot(tmp_db):
+    with db._connect() as conn:
+        return {Path(r["file_path"]).name for r in conn.execute("SELECT file_path FROM dir_snapshot")}
+
+
+def test_scan_changes_add_modify_delete(tmp_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "SCAN_BATCH_SIZE", 2)
+    watch = tmp_path / "watch"
+    watch.mkdir()
+    for name in ("a.m4a", "b.m4a", "c.m4a"):
+        (watch / name).write_bytes(b"x")
+    (watch / "notes.txt").write_text("ignored")
+
+    assert scan(watch) == ["a.m4a", "b.m4a", "c.m4a"]
+    assert scan(watch) == []
+
+    # 原地改写：目录本身的修改时间不变，仍要发现大小 / mtime 的变化
+    dir_stat = watch.stat()
+    (watch / "b.m4a").write_bytes(b"longer")
+    os.utime(watch, ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+    assert scan(watch) == ["b.m4a"]
+
+    (watch / "c.m4a").unlink()
+    (watch / "d.m4a").write_bytes(b"x")
+    assert scan(watch) == ["d.m4a"]
+    assert snapshot(tmp_db) == {"a.m4a", "b.m4a", "d.m4a"}
+
+
+def test_get_unprocessed_skips_processed_and_retries_failed(tmp_db, tmp_path):
+    watch = tmp_path / "watch"
+    watch.mkdir()
+    for name in ("done.m4a", "failed.m4a", "new.m4a"):
+        (watch / name).write_bytes(b"x")
+    db.mark_success(watch / "done.m4a")
+    db.mark_failed(watch / "failed.m4a")
+
+    assert sorted(p.name for p in db.get_unprocessed(watch)) == ["failed.m4a", "new.m4a"]
+    # 新文件已登记为 pending，下次启动从状态表找回，不依赖快照
+    assert sorted(p.name for p in db.get_unprocessed(watch)) == ["failed.m4a", "new.m4a"]
@@ -0,0 +1,24 @@
+import threading
+
+import main
+
+
+def test_progress_bar_counts_every_completion(capsys):
+    threads, per_thread = 8, 250
+    progress = main._ProgressBar(threads * per_thread)
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        barrier.wait()
+        for _ in range(per_thread):
+            progress.advance()
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    assert progress.done == threads * per_thread
+    err = capsys.readouterr().err
+    assert err.count("\n") == 1 and err.endswith("\n")
+    assert err.rstrip("\n").rsplit("\r", 1)[1].startswith(f"[{'#' * 30}] {threads * per_thread}/")
@@ -0,0 +1,78 @@
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from listen_watch import obsidian
+from listen_watch.processor import ProcessedMemo
+
+JOURNAL = "# 2026-01-02\n\n## 语音记录\n\n---\n## 其他\n正文\n"
+
+
+@pytest.fixture
+def journal(tmp_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(obsidian, "JOURNAL_DIR", str(tmp_path))
+    path = tmp_path / "2026-01-02.md"
+    path.write_text(JOURNAL, encoding="utf-8")
+    # 流水线在写日记之前已登记录音文件（转写阶段记录元数据）
+    for name in ("a", "b", "早", "中"):
+        tmp_db.update_file(Path(f"/v/{name}.m4a"))
+    writer = obsidian.JournalWriter(flush_interval=0.01)
+    yield path, writer
+    writer.stop()
+
+
+def memo(title):
+    return ProcessedMemo(title=title, summary=f"{title}摘要", todos=["回电话"], original_text="原文")
+
+
+def at(hour):
+    return datetime(2026, 1, 2, hour, 0)
+
+
+def test_entries_are_inserted_before_separator_in_order(journal):
+    path, writer = journal
+    futures = [writer.submit(memo(t), at(h), f"/v/{t}.m4a") for h, t in ((9, "早"), (10, "中"))]
+    assert [f.result(5) for f in futures] == [path, path]
+    content = path.read_text(encoding="utf-8")
+    section = content.split("## 语音记录", 1)[1].split("---", 1)[0]
+    assert section.index("### 09:00 · 早") < section.index("### 10:00 · 中")
+    assert "- [ ] 回电话" in section
+    assert content.endswith("---\n## 其他\n正文\n")
+
+
+def test_same_entry_id_is_written_once(journal):
+    path, writer = journal
+    # 同一窗口内重复提交
+    first = writer.submit(memo("早"), at(9), "/v/a.m4a")
+    dup = writer.submit(memo("早"), at(9), "/v/a.m4a")
+    assert first.result(5) == dup.result(5) == path
+    # 之后重试（如流水线重跑该阶段）
+    writer.submit(memo("早"), at(9), "/v/a.m4a").result(5)
+    assert path.read_text(encoding="utf-8").count("### 09:00 · 早") == 1
+    # 新的写入服务（进程重启）同样从数据库得知已写入
+    restarted = obsidian.JournalWriter(flush_interval=0.01)
+    try:
+        restarted.submit(memo("早"), at(9), "/v/a.m4a").result(5)
+    finally:
+        restarted.stop()
+    assert path.read_text(encoding="utf-8").count("### 09:00 · 早") == 1
+
+
+def test_external_edit_is_not_overwritten(journal):
+    path, writer = journal
+    writer.submit(memo("早"), at(9), "/v/a.m4a").result(5)
+    edited = path.read_text(encoding="utf-8").replace("正文", "用户在 Obsidian 中的修改")
+    path.write_text(edited, encoding="utf-8")
+    writer.submit(memo("中"), at(10), "/v/b.m4a").result(5)
+    content = path.read_text(encoding="utf-8")
+    assert "用户在 Obsidian 中的修改" in content
+    assert content.index("### 10:00 · 中") < content.index("---")
+
+
+def test_missing_section_is_created(journal):
+    path, writer = journal
+    path.write_text("# 日记\n", encoding="utf-8")
+    writer.submit(memo("早"), at(9), "/v/a.m4a").result(5)
+    content = path.read_text(encoding="utf-8")
+    assert content.startswith("# 日记\n\n## 语音记录\n\n### 09:00 · 早")
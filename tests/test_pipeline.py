@@ -0,0 +1,152 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from listen_watch.pipeline import PRIORITY_BACKFILL, Pipeline, Stage
+
+
+@pytest.fixture
+def run_pipeline(tmp_db):
+    """启动流水线，用例结束时停止；retry 间隔缩短到毫秒级。"""
+    started = []
+
+    def run(stages, **kwargs):
+        kwargs.setdefault("retry_base", 0.01)
+        kwargs.setdefault("retry_max", 0.02)
+        pipeline = Pipeline(stages, **kwargs)
+        pipeline.start()
+        started.append(pipeline)
+        return pipeline
+
+    yield run
+    for pipeline in started:
+        pipeline.stop(timeout=2)
+
+
+def files(tmp_path, n):
+    paths = []
+    for i in range(n):
+        p = tmp_path / f"{i:02d}.m4a"
+        p.write_bytes(b"x" * (i + 1))
+        paths.append(p)
+    return paths
+
+
+def test_retry_then_succeed_continues_from_failed_stage(run_pipeline, tmp_path):
+    first_calls, second_calls, retries, done = [], [], [], []
+
+    def first(job):
+        first_calls.append(job.path.name)
+        job.text = "t"
+        return job
+
+    def second(job):
+        second_calls.append(job.path.name)
+        if len(second_calls) < 3:
+            raise RuntimeError("flaky")
+        return job
+
+    pipeline = run_pipeline(
+        [Stage("first", first), Stage("second", second)],
+        max_attempts=5,
+        on_retry=lambda job, stage, e, delay: retries.append((stage, job.attempts)),
+        on_complete=done.append,
+    )
+    [path] = files(tmp_path, 1)
+    assert pipeline.submit(path)
+    assert not pipeline.submit(path)   # 处理中重复提交被忽略
+    assert pipeline.join(5)
+    assert first_calls == ["00.m4a"]   # 重试从失败的阶段继续
+    assert len(second_calls) == 3
+    assert retries == [("second", 1), ("second", 2)]
+    assert [j.attempts for j in done] == [2]
+
+
+def test_dead_letter_after_max_attempts(run_pipeline, tmp_path):
+    failures, done, reached = [], [], []
+
+    def broken(job):
+        raise ValueError("bad file")
+
+    pipeline = run_pipeline(
+        [Stage("first", broken), Stage("second", reached.append)],
+        max_attempts=3,
+        on_failure=lambda job, stage, e: failures.append((job.path.name, stage, str(e))),
+        on_complete=done.append,
+    )
+    [path] = files(tmp_path, 1)
+    pipeline.submit(path)
+    assert pipeline.join(5)
+    assert failures == [("00.m4a", "first", "bad file")]
+    assert done[0].attempts == 3
+    assert reached == []
+    assert pipeline.retry_pending == 0
+
+
+def test_future_results_are_forwarded_without_holding_workers(run_pipeline, tmp_path):
+    lock = threading.Lock()
+    pending, peak, forwarded = [], 0, []
+
+    def start(job):
+        nonlocal peak
+        future = Future()
+        with lock:
+            pending.append((job, future))
+            peak = max(peak, sum(1 for _, f in pending if not f.done()))
+        return future
+
+    def resolver():
+        # 逐个完成挂起的 Future；奇数文件第一次以异常结束，走重试
+        failed = set()
+        while len(forwarded) < 6:
+            with lock:
+                ready = [(j, f) for j, f in pending if not f.done()]
+            for job, future in ready:
+                time.sleep(0.005)
+                if int(job.path.stem) % 2 and job.path.name not in failed:
+                    failed.add(job.path.name)
+                    future.set_exception(TimeoutError("asr"))
+                else:
+                    job.text = f"text-{job.path.stem}"
+                    future.set_result(job)
+            time.sleep(0.005)
+
+    pipeline = run_pipeline(
+        [Stage("transcribe", start, workers=1, max_pending=2),
+         Stage("write", lambda job: forwarded.append(job.text))],
+        max_attempts=3,
+    )
+    thread = threading.Thread(target=resolver, daemon=True)
+    thread.start()
+    for path in files(tmp_path, 6):
+        pipeline.submit(path, priority=PRIORITY_BACKFILL)
+    assert pipeline.join(10)
+    thread.join(2)
+    # 单个工作线程同时挂起多个 Future，但不超过 max_pending
+    assert peak == 2
+    assert sorted(forwarded) == [f"text-{i:02d}" for i in range(6)]
+
+
+def test_batch_failure_falls_back_to_single_jobs(run_pipeline, tmp_path):
+    singles, batches, done = [], [], []
+
+    def batch_handler(jobs):
+        batches.append(len(jobs))
+        raise RuntimeError("batch broken")
+
+    def handler(job):
+        singles.append(job.path.name)
+        return job
+
+    pipeline = run_pipeline(
+        [Stage("ai", handler, batch_handler=batch_handler, batch_size=4, batch_wait=0.2)],
+        on_complete=done.append,
+    )
+    for path in files(tmp_path, 3):
+        pipeline.submit(path, priority=PRIORITY_BACKFILL)
+    assert pipeline.join(5)
+    assert batches and batches[0] > 1
+    assert sorted(singles) == ["00.m4a", "01.m4a", "02.m4a"]
+    assert len(done) == 3
@@ -0,0 +1,152 @@
+import json
+import random
+
+import pytest
+
+from listen_watch.processor import IncrementalJSONParser, _StreamingProcessor, _close_partial_json, _load_json
+
+
+def feed_all(deltas):
+    """逐段喂入，返回每次回调得到的字段 dict 与最终字段。"""
+    parser = IncrementalJSONParser()
+    seen = []
+    for delta in deltas:
+        fields = parser.feed(delta)
+        if fields is not None:
+            seen.append(fields)
+    return seen, (seen[-1] if seen else {})
+
+
+def chunked(text, sizes):
+    i, out = 0, []
+    while i < len(text):
+        n = sizes[len(out) % len(sizes)]
+        out.append(text[i:i + n])
+        i += n
+    return out
+
+
+DOC = {
+    "title": "周会 \"纪要\"",
+    "summary": "讨论了 Q3 目标\n下周跟进\t😀 表情",
+    "todos": ["联系 {客户}", "写 [方案]", "回复 \"张三\""],
+    "meta": {"n": 1, "nested": [1, {"a": "b\\c"}]},
+    "score": 3.5,
+    "ok": True,
+    "none": None,
+    "cleaned_text": "第一段。\\ 反斜杠 / 斜杠 é",
+}
+
+
+@pytest.mark.parametrize("ensure_ascii", [False, True])
+@pytest.mark.parametrize("sizes", [[1], [2, 3], [7], [5, 1, 11], [1000]])
+def test_final_fields_match_json(sizes, ensure_ascii):
+    raw = json.dumps(DOC, ensure_ascii=ensure_ascii, indent=1)
+    _, final = feed_all(chunked(raw, sizes))
+    expected = {k: v for k, v in DOC.items() if v is not None}
+    assert final == expected
+
+
+def test_random_chunkings_match_json():
+    rng = random.Random(7)
+    raw = json.dumps(DOC, ensure_ascii=True)
+    expected = {k: v for k, v in DOC.items() if v is not None}
+    for _ in range(200):
+        cuts = sorted(rng.sample(range(1, len(raw)), rng.randint(1, 40)))
+        deltas = [raw[a:b] for a, b in zip([0] + cuts, cuts + [len(raw)])]
+        assert feed_all(deltas)[1] == expected
+
+
+def test_partial_strings_are_prefixes():
+    raw = json.dumps({"summary": "早上好" * 200, "title": "t"}, ensure_ascii=False)
+    seen, final = feed_all(chunked(raw, [3]))
+    partials = [f["summary"] for f in seen if "summary" in f]
+    assert len(partials) > 2
+    assert all(final["summary"].startswith(p) for p in partials)
+    assert final == {"summary": "早上好" * 200, "title": "t"}
+
+
+def test_escapes_split_across_deltas():
+    raw = r'{"a": "x\n\"y\\z中\t"}'
+    for cut in range(1, len(raw)):
+        assert feed_all([raw[:cut], raw[cut:]])[1] == {"a": 'x\n"y\\z中\t'}
+
+
+def test_surrogate_pair_split_across_deltas_is_never_half_emitted():
+    raw = '{"a": "ok\\ud83d\\ude00!"}'
+    for cut in range(1, len(raw)):
+        seen, final = feed_all([raw[:cut], raw[cut:]])
+        assert final == {"a": "ok😀!"}
+        for fields in seen:
+            value = fields.get("a", "")
+            assert not any("\ud800" <= ch <= "\udfff" for ch in value)
+
+
+def test_nested_value_partial_then_complete():
+    parser = IncrementalJSONParser()
+    assert parser.feed('{"todos": ["买菜", "写') == {"todos": ["买菜", "写"]}
+    assert parser.feed('周报"], "title": "x"}') == {"todos": ["买菜", "写周报"], "title": "x"}
+
+
+def test_fenced_output():
+    raw = '```json\n{"title": "标题", "todos": []}\n```'
+    assert feed_all(chunked(raw, [4]))[1] == {"title": "标题", "todos": []}
+    assert _load_json(raw) == {"title": "标题", "todos": []}
+    assert _close_partial_json('```json\n{"title": "标') == {"title": "标"}
+
+
+def test_no_callback_without_new_data():
+    parser = IncrementalJSONParser()
+    assert parser.feed("```json\n") is None
+    assert parser.feed('{"title"') is None
+    assert parser.feed(': "a"') == {"title": "a"}
+    assert parser.feed("  ") is None
+
+
+def test_partial_output_cost_is_linear():
+    # 单字增量的长字段：各次部分结果的总长度与流长度成线性，而不是平方
+    n = 50_000
+    parser = IncrementalJSONParser()
+    parser.feed('{"cleaned_text": "')
+    emitted = 0
+    for _ in range(n):
+        fields = parser.feed("字")
+        if fields:
+            emitted += len(fields["cleaned_text"])
+    assert parser.feed('"}') == {"cleaned_text": "字" * n}
+    assert emitted < 6 * n
+
+
+class StubProcessor(_StreamingProcessor):
+    NAME = "stub"
+    MODEL = "stub-1"
+    TEMPERATURE = 0
+
+    def __init__(self, data):
+        self.raw = json.dumps(data, ensure_ascii=False)
+        self.calls = 0
+
+    def _stream(self, system, user, cancel=None):
+        self.calls += 1
+        yield from chunked(self.raw, [5])
+
+
+def test_cached_memo_todos_are_not_shared(tmp_db):
+    stub = StubProcessor({"title": "t", "summary": "s", "todos": ["a"], "cleaned_text": "c"})
+    text = "cache-isolation 测试文本"
+    first = stub.process(text)
+    first.todos.append("mutated")
+    second = stub.process(text)
+    assert stub.calls == 1
+    assert second.todos == ["a"]
+    second.todos.clear()
+    assert stub.cached(text).todos == ["a"]
+
+
+def test_kimi_streams_against_fake_services(tmp_db, fake_server):
+    from listen_watch.processor import KimiProcessor
+
+    partials = []
+    memo = KimiProcessor().process("嗯，明天下午三点记得给张三回电话。", on_partial=partials.append)
+    assert memo.title and memo.summary and memo.cleaned_text
+    assert partials and partials[-1]["title"] == memo.title
@@ -0,0 +1,106 @@
+import logging
+
+import pytest
+
+from listen_watch import ratelimit
+from listen_watch.ratelimit import Limiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    return clock
+
+
+class HTTPError(Exception):
+    def __init__(self, status, headers=None):
+        super().__init__(status)
+        self.status_code = status
+        self.headers = headers or {}
+
+
+def test_token_bucket_wait(clock):
+    limiter = Limiter("t", rate=2, burst=2, concurrency=4)
+    assert limiter._reserve() == 0
+    assert limiter._reserve() == 0
+    assert limiter._reserve() == pytest.approx(0.5)   # 桶空，下一个令牌 1/rate 秒后
+    assert limiter._reserve() == pytest.approx(1.0)
+    clock.now += 1.0
+    assert limiter._reserve() == pytest.approx(0.5)   # 1 秒补回 2 个令牌，仍欠 1 个
+
+
+def test_retry_after_parsing():
+    assert ratelimit.retry_after(HTTPError(429, {"Retry-After": "3"})) == 3
+    assert ratelimit.retry_after(HTTPError(503)) == ratelimit.DEFAULT_RETRY_AFTER
+    assert ratelimit.retry_after(HTTPError(429, {"retry-after": "bogus"})) == ratelimit.DEFAULT_RETRY_AFTER
+    assert ratelimit.retry_after(HTTPError(500)) is None
+    assert ratelimit.retry_after(ValueError()) is None
+
+
+def test_throttle_halves_and_pauses_then_recovers(clock):
+    limiter = Limiter("t", rate=10, burst=10, concurrency=8)
+    limiter._failed(HTTPError(429, {"Retry-After": "5"}))
+    assert limiter.limit == 4 and limiter.rate == 5
+    assert limiter._reserve() == pytest.approx(5)        # Retry-After 期间暂停发送
+    # 冷却期内的第二个 429 只延长暂停，不再减半
+    limiter._failed(HTTPError(429, {"Retry-After": "6"}))
+    assert limiter.limit == 4
+    clock.now += 2
+    limiter._failed(HTTPError(429))
+    assert limiter.limit == 2 and limiter.rate == 2.5
+
+    limiter._succeeded(None)
+    assert limiter.limit == 2.5                          # 并发加回 1/limit
+    assert limiter.rate == pytest.approx(3.0)            # 速率加回上限的 RATE_RECOVERY
+    for _ in range(200):
+        limiter._succeeded(None)
+    assert (limiter.limit, limiter.rate) == (8, 10)
+
+
+def test_latency_congestion_lowers_concurrency(clock):
+    limiter = Limiter("t", rate=10, burst=10, concurrency=10)
+    limiter._succeeded(0.1)
+    for _ in range(20):
+        clock.now += 2
+        limiter._succeeded(2.0)
+    assert limiter.limit < 10
+    assert limiter.limit >= 1
+
+
+def test_call_retries_throttled_requests(clock, monkeypatch):
+    monkeypatch.setattr(ratelimit.time, "sleep", lambda s: setattr(clock, "now", clock.now + s))
+    limiter = Limiter("t", rate=100, burst=100, concurrency=4)
+    attempts = []
+
+    def flaky():
+        attempts.append(clock.now)
+        if len(attempts) < 3:
+            raise HTTPError(429, {"Retry-After": "2"})
+        return "ok"
+
+    assert limiter.call(flaky) == "ok"
+    assert len(attempts) == 3
+    assert attempts[1] - attempts[0] >= 2
+    assert limiter.state()["inflight"] == 0
+
+    with pytest.raises(HTTPError):
+        limiter.call(lambda: (_ for _ in ()).throw(HTTPError(500)))
+
+
+@pytest.mark.parametrize("spec", ["kimi=0/4", "kimi=5/0", "kimi=-1/4", "kimi=nan/4", "kimi=5", "kimi"])
+def test_invalid_rate_limits_keep_default(spec, monkeypatch, caplog):
+    monkeypatch.setattr(ratelimit, "RATE_LIMITS", f"{spec},claude=2/3")
+    with caplog.at_level(logging.WARNING, logger="listen_watch.ratelimit"):
+        limits = ratelimit._configured_limits()
+    assert limits["kimi"] == ratelimit.DEFAULT_LIMITS["kimi"]
+    assert limits["claude"] == (2.0, 4, 3)
+    assert "已忽略" in caplog.text
@@ -0,0 +1,63 @@
+from pathlib import Path
+
+import pytest
+
+from listen_watch.processor import ProcessedMemo
+
+
+@pytest.fixture
+def memos(tmp_db):
+    db = tmp_db
+    rows = {
+        "a.m4a": ("明天上午和产品经理开会讨论季度规划", "季度规划会议", "录音 1"),
+        "b.m4a": ("买菜：西红柿、鸡蛋，顺便交电费", "家务清单", "录音 2"),
+        "c.m4a": ("关于 100%_done 的特殊字符测试", "特殊字符", "录音 3"),
+    }
+    for name, (text, title, memo_title) in rows.items():
+        path = Path("/voice") / name
+        db.update_file(path, memo_title=memo_title)
+        db.save_transcription(path, text)
+        db.save_ai_result(path, ProcessedMemo(title=title, summary=f"{title}的摘要", todos=["跟进"],
+                                              cleaned_text=text))
+    return db
+
+
+def names(results):
+    return sorted(Path(r["file_path"]).name for r in results)
+
+
+def test_long_terms_use_fts(memos):
+    results = memos.search_memos("季度规划")
+    assert names(results) == ["a.m4a"]
+    assert "【季度规划】" in results[0]["snippet"]
+    assert results[0]["title"] == "季度规划会议"
+
+
+def test_short_terms_use_like(memos):
+    assert names(memos.search_memos("电费")) == ["b.m4a"]
+    assert names(memos.search_memos("跟进")) == ["a.m4a", "b.m4a", "c.m4a"]
+    assert "【电费】" in memos.search_memos("电费")[0]["snippet"]
+
+
+def test_mixed_terms_must_all_match(memos):
+    assert names(memos.search_memos("产品经理 开会")) == ["a.m4a"]
+    assert memos.search_memos("产品经理 电费") == []
+
+
+def test_like_wildcards_are_literal(memos):
+    assert names(memos.search_memos("%_")) == ["c.m4a"]
+    assert memos.search_memos("_x") == []
+
+
+def test_title_change_and_delete_update_index(memos):
+    db = memos
+    db.update_file(Path("/voice/b.m4a"), memo_title="超市采购")
+    assert names(db.search_memos("超市采购")) == ["b.m4a"]
+    with db._connect() as conn:
+        conn.execute("DELETE FROM processed_files WHERE file_path = ?", ("/voice/b.m4a",))
+    assert db.search_memos("超市采购") == []
+    assert db.search_memos("电费") == []
+
+
+def test_empty_query(memos):
+    assert memos.search_memos("   ") == []
@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from listen_watch import segmenter
+from listen_watch.segmenter import Segment, plan_segments, stitch, transcribe_segmented
+
+
+@pytest.fixture
+def no_ffmpeg(monkeypatch):
+    """切段不调用 ffmpeg：无静音，段文件直接用原文件路径。"""
+    monkeypatch.setattr(segmenter, "detect_silences", lambda path: [])
+    monkeypatch.setattr(segmenter, "cut_segment", lambda path, seg, out_dir: out_dir / f"{seg.index:03d}")
+
+
+def test_plan_segments_cuts_at_silence_near_target():
+    segments = plan_segments(300, [(118, 122)], target=120, max_len=180)
+    assert [(s.start, s.end) for s in segments] == [(0, 120), (120, 300)]
+
+
+def test_stitch_orders_segments_with_timestamps():
+    segments = [Segment(0, 0, 60), Segment(1, 60, 125)]
+    texts = {segments[1].key: "后", segments[0].key: "前"}
+    assert stitch(segments, texts) == "[00:00] 前\n\n[01:00] 后"
+
+
+def test_segments_run_concurrently_and_retry_only_missing(tmp_db, no_ffmpeg, monkeypatch):
+    monkeypatch.setattr(segmenter, "SEGMENT_CONCURRENCY", 2)
+    calls, active, peak = [], 0, 0
+    fail = {"001"}
+
+    async def transcribe(path, duration):
+        nonlocal active, peak
+        calls.append(path.name)
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        if path.name in fail:
+            raise RuntimeError("boom")
+        return f"段{path.name}"
+
+    with pytest.raises(RuntimeError, match="1/3"):
+        asyncio.run(transcribe_segmented(segmenter.Path("a.m4a"), 500, "h", transcribe))
+    assert sorted(calls) == ["000", "001", "002"]
+    assert peak == 2
+
+    calls.clear()
+    fail.clear()
+    text = asyncio.run(transcribe_segmented(segmenter.Path("a.m4a"), 500, "h", transcribe))
+    assert calls == ["001"]
+    assert text.splitlines()[::2] == ["[00:00] 段000", "[03:00] 段001", "[06:00] 段002"]
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from listen_watch import transcriber
+from listen_watch.transcriber import DoubaoBackend
+
+
+@pytest.fixture
+def backend(tmp_db, monkeypatch):
+    """_query 由用例控制的豆包引擎，轮询间隔缩短到毫秒级。"""
+    monkeypatch.setattr(transcriber, "POLL_MIN_INTERVAL", 0.01)
+    monkeypatch.setattr(transcriber, "POLL_MAX_INTERVAL", 0.02)
+    b = DoubaoBackend()
+    b.latency._samples = []
+    b.latency._overhead = 0.01
+    b.latency._rate = 0.0
+    b.results = {}
+    b.blocked = {}
+
+    async def query(rid):
+        gate = b.blocked.get(rid)
+        if gate is not None:
+            await gate.wait()
+        return b.results.get(rid)
+
+    b._query = query
+    return b
+
+
+def test_timed_out_waiter_does_not_break_other_jobs(backend):
+    async def scenario():
+        other = asyncio.ensure_future(backend._wait("b", 1.0))
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(backend._wait("a", 1.0), 0.05)
+        assert "a" not in backend._pending
+        backend.results.update(a="late", b="ok")
+        assert await asyncio.wait_for(other, 5) == "ok"
+        assert not backend._poller.done() or backend._poller.exception() is None
+
+    asyncio.run(scenario())
+
+
+def test_waiter_cancelled_during_query(backend):
+    async def scenario():
+        gate = asyncio.Event()
+        backend.blocked["a"] = gate
+        waiter = asyncio.ensure_future(backend._wait("a", 1.0))
+        other = asyncio.ensure_future(backend._wait("b", 1.0))
+        await asyncio.sleep(0.05)  # 轮询协程已卡在 a 的查询上
+        waiter.cancel()
+        await asyncio.sleep(0)
+        backend.results.update(a="late", b="ok")
+        gate.set()
+        assert await asyncio.wait_for(other, 5) == "ok"
+        assert waiter.cancelled()
+        assert backend._pending == {}
+        await asyncio.sleep(0.05)
+        assert not backend._poller.done() or backend._poller.exception() is None
+
+    asyncio.run(scenario())
+
+
+
+def test_incomplete_backend_cannot_be_instantiated():
+    class Incomplete(transcriber.TranscriptionBackend):
+        def estimate(self, duration):
+            return 1.0
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_doubao_round_trip_against_fake_services(tmp_db, fake_server, tmp_path):
+    audio = tmp_path / "memo.m4a"
+    audio.write_bytes(b"\0" * 2048)
+    text = transcriber.transcribe(audio, 3.0)
+    assert text
+    stats = fake_server.state.stats
+    assert stats["put"] >= 1 and stats["submit"] >= 1 and stats["query"] >= 1
+    assert stats["delete"] >= 1   # OSS 临时文件已清理
+    with tmp_db._connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM asr_latency").fetchone()[0] >= 1
+
+
+def test_failed_asr_job_raises(tmp_db, fake_server, tmp_path):
+    fake_server.state.config.asr_error_rate = 1.0
+    audio = tmp_path / "bad.m4a"
+    audio.write_bytes(b"\0" * 512)
+    with pytest.raises(RuntimeError, match="转写失败"):
+        transcriber.transcribe(audio, 1.0)